@@ -3,16 +3,36 @@
 Route module for the API
 """
 from os import getenv
+from api.v1.auth.auth import ExcludedPaths
+from api.v1.auth.rate_limit import RateLimited
+from api.v1.json_provider import FastJSONProvider
 from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models.base import Base
+from models.user import User
 import os
 
 
+Base.use_storage(getenv("DB_BACKEND", "json"))
+User.load_from_file()
+
 app = Flask(__name__)
+# Behind TRUSTED_PROXIES reverse proxies, the client IP of the rate
+# limits is the one they add to X-Forwarded-For
+TRUSTED_PROXIES = int(getenv("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+if FastJSONProvider is not None:
+    app.json = FastJSONProvider(app)
 app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
+excluded_paths = ExcludedPaths([
+    '/api/v1/status/',
+    '/api/v1/unauthorized/',
+    '/api/v1/forbidden/'])
 
 if getenv("AUTH_TYPE") == "auth":
     from api.v1.auth.auth import Auth
@@ -21,6 +41,10 @@ elif getenv("AUTH_TYPE") == "basic_auth":
     from api.v1.auth.basic_auth import BasicAuth
     auth = BasicAuth()
 
+if getenv("METRICS") == "1":
+    from api.v1 import metrics
+    metrics.init_app(app, auth)
+
 
 @app.errorhandler(404)
 def not_found(error) -> str:
@@ -43,13 +67,18 @@ def unauthorized(error) -> str:
     return jsonify({"error": "Forbidden"}), 403
 
 
+@app.errorhandler(RateLimited)
+def rate_limited(error: RateLimited) -> str:
+    """ Too many password checks handler
+    """
+    response = jsonify({"error": "Too many requests"})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+
 @app.before_request
 def before_request() -> str:
     """Filter for request."""
-    excluded_paths = [
-        '/api/v1/status/',
-        '/api/v1/unauthorized/',
-        '/api/v1/forbidden/']
     if auth:
         """
         ret
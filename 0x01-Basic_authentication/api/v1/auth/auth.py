@@ -2,10 +2,57 @@
 """
 Implements the Authentication Base Class
 """
-from typing import List, TypeVar
+from functools import lru_cache
+from typing import Iterable, List, TypeVar
 from flask import request
 
 
+class ExcludedPaths:
+    """
+    Excluded paths compiled once for Auth.require_auth: exact paths
+    go in a set and the prefixes of paths ending with '*' in a trie,
+    so matching cost doesn't depend on the number of paths
+    """
+    _END = ''
+
+    def __init__(self, paths: Iterable[str]) -> None:
+        """Compiles paths"""
+        self.paths = tuple(paths)
+        self._exact = frozenset(self.paths)
+        self._prefixes = {}
+        for stars in self.paths:
+            if stars[-1] != '*':
+                continue
+            node = self._prefixes
+            for char in stars[:-1]:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def __bool__(self) -> bool:
+        """False when there is no excluded path"""
+        return len(self.paths) > 0
+
+    def match(self, path: str) -> bool:
+        """True if path, or path with a trailing slash, is excluded
+        or if it starts with the prefix of a wildcard path"""
+        if path in self._exact or path + '/' in self._exact:
+            return True
+        node = self._prefixes
+        for char in path:
+            if self._END in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return self._END in node
+
+
+@lru_cache(maxsize=32)
+def _compile(paths: tuple) -> ExcludedPaths:
+    """Compiled excluded paths of callers passing plain lists"""
+    return ExcludedPaths(paths)
+
+
 class Auth:
     """
     Base Class for Authentication
@@ -14,19 +61,13 @@ class Auth:
     def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
         """checks that path is not in excluded paths so that it can
         enforce authentication as a requirement
+        excluded_paths is best given compiled as ExcludedPaths
         """
         if not path or not excluded_paths:
             return True
-        if path in excluded_paths:
-            return False
-        if path + '/' in excluded_paths:
-            return False
-        astericks = [stars[:-1]
-                     for stars in excluded_paths if stars[-1] == '*']
-        for stars in astericks:
-            if path.startswith(stars):
-                return False
-        return True
+        if not isinstance(excluded_paths, ExcludedPaths):
+            excluded_paths = _compile(tuple(excluded_paths))
+        return not excluded_paths.match(path)
 
     def authorization_header(self, request=None) -> str:
         """Returns the authorization header that was received in request"""
@@ -4,8 +4,13 @@ Implements Basic Authentication that uses
 username:password
 """
 import base64
+from os import getenv
 from typing import TypeVar
 from api.v1.auth.auth import Auth
+from api.v1.auth.credential_cache import CredentialCache
+from api.v1.auth.negative_cache import NegativeCache
+from api.v1.auth.rate_limit import login_limiter_from_env
+from models.password import fake_verify
 from models.user import User
 
 
@@ -18,6 +23,27 @@ class BasicAuth(Auth):
         """Call to parent class to prevent overriding
           of initialization function"""
         super().__init__()
+        self.credential_cache = CredentialCache(
+            int(getenv("BASIC_AUTH_CACHE_SIZE", "10000")),
+            float(getenv("BASIC_AUTH_CACHE_TTL", "300")))
+        self.unknown_emails = NegativeCache(
+            int(getenv("BASIC_AUTH_UNKNOWN_CACHE_SIZE", "100000")),
+            float(getenv("BASIC_AUTH_UNKNOWN_CACHE_TTL", "60")))
+        self.login_limiter = login_limiter_from_env()
+        User.subscribe(self._on_user_change)
+
+    def _on_user_change(self, event: str, user: TypeVar('User')) -> None:
+        """Keeps the credential and unknown email caches in line with
+          saved/removed users"""
+        if event == "save":
+            self.credential_cache.invalidate_user(user.id, user.password)
+            if user.email is not None:
+                self.unknown_emails.discard(user.email)
+        elif event == "remove":
+            self.credential_cache.invalidate_user(user.id)
+        else:
+            self.credential_cache.clear()
+            self.unknown_emails.clear()
 
     def extract_base64_authorization_header(
             self, authorization_header: str) -> str:
@@ -65,15 +91,29 @@ class BasicAuth(Auth):
             user_email: str,
             user_pwd: str) -> TypeVar('User'):
         """checks that username exists and that password
-          is valid then returns the User object to caller"""
+          is valid then returns the User object to caller
+          Emails found unknown are not looked up again for a while,
+          and they take as long as a wrong password"""
         if user_email is None or not isinstance(user_email, str):
             return None
         if user_pwd is None or not isinstance(user_pwd, str):
             return None
+        try:
+            # Registrations of other processes discard their email
+            User._sync()
+        except Exception:
+            return None
+        if user_email in self.unknown_emails:
+            fake_verify()
+            return None
         try:
             users = User.search({"email": user_email})
         except Exception:
             return None
+        if len(users) == 0:
+            self.unknown_emails.add(user_email)
+            fake_verify()
+            return None
 
         for user in users:
             if user.is_valid_password(user_pwd):
@@ -91,12 +131,24 @@ class BasicAuth(Auth):
           checks validity of the password and
           performs matching
            finally returns  user Object to
-             calling Function"""
+             calling Function
+        A header that was already verified is only checked
+        against the credential cache, the others are refused while
+        the client IP or the email has no token left, and take one
+        of each when they fail: see rate_limit"""
         header = self.authorization_header(request)
 
-        if not header:
+        if not header or type(header) is not str:
             return None
 
+        key = self.credential_cache.key(header)
+        cached = self.credential_cache.get(key)
+        if cached is not None:
+            user = User.get(cached[0])
+            if user is not None and user.password == cached[1]:
+                return user
+            self.credential_cache.invalidate_user(cached[0])
+
         b64_header = self.extract_base64_authorization_header(header)
 
         if not b64_header:
@@ -112,4 +164,11 @@ class BasicAuth(Auth):
         if not email or not pwd:
             return None
 
-        return self.user_object_from_credentials(email, pwd)
+        ip = getattr(request, "remote_addr", None)
+        self.login_limiter.check(email, ip)
+        user = self.user_object_from_credentials(email, pwd)
+        if user is None:
+            self.login_limiter.failed(email, ip)
+        else:
+            self.credential_cache.put(key, user.id, user.password)
+        return user
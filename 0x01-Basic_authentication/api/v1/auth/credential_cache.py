@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Implements a cache of verified Basic Authentication credentials
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+
+class CredentialCache:
+    """
+    Bounded LRU cache, with a time to live, mapping the keyed digest of
+    an Authorization header to the id and password hash of the User it
+    was verified against
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300,
+                 secret: bytes = None) -> None:
+        """max_size of 0 disables the cache, ttl is in seconds"""
+        self.max_size = max_size
+        self.ttl = ttl
+        # Headers are never kept: entries are keyed by an HMAC with a
+        # per-process secret so a memory dump doesn't leak credentials
+        self._secret = secret or os.urandom(32)
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def key(self, authorization_header: str) -> bytes:
+        """Returns the cache key of an Authorization header"""
+        return hmac.new(self._secret,
+                        authorization_header.encode('utf-8', 'replace'),
+                        hashlib.sha256).digest()
+
+    def get(self, key: bytes) -> Tuple[str, str]:
+        """Returns (user_id, password hash) cached for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, password, expires = entry
+            if expires < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return user_id, password
+
+    def put(self, key: bytes, user_id: str, password: str) -> None:
+        """Caches a successful verification of key for user_id"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (user_id, password,
+                                  time.monotonic() + self.ttl)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str, password: str = None) -> None:
+        """Drops the entries of user_id, except the ones verified against
+        password when it is given"""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                if password is None or self._entries[key][1] != password:
+                    self._discard(key)
+
+    def clear(self) -> None:
+        """Drops every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self) -> int:
+        """Number of cached entries"""
+        return len(self._entries)
+
+    def _discard(self, key: bytes) -> None:
+        """Drops one entry, the lock must be held"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_user.get(entry[0])
+        keys.discard(key)
+        if len(keys) == 0:
+            del self._by_user[entry[0]]
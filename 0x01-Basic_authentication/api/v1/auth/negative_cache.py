@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Implements a cache of the emails Basic Authentication did not find
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class NegativeCache:
+    """
+    Bounded LRU set, with a time to live, of the digests of unknown
+    emails
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 60) -> None:
+        """max_size of 0 disables the cache, ttl is in seconds"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._emails = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(email: str) -> bytes:
+        """Returns the fixed size key of an email"""
+        return hashlib.blake2b(email.encode('utf-8', 'replace'),
+                               digest_size=16).digest()
+
+    def __contains__(self, email: str) -> bool:
+        """True if email was found unknown less than ttl seconds ago"""
+        key = self._key(email)
+        with self._lock:
+            expires = self._emails.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._emails[key]
+                return False
+            self._emails.move_to_end(key)
+            return True
+
+    def add(self, email: str) -> None:
+        """Records that no user has email"""
+        if self.max_size <= 0:
+            return
+        key = self._key(email)
+        with self._lock:
+            self._emails.pop(key, None)
+            self._emails[key] = time.monotonic() + self.ttl
+            while len(self._emails) > self.max_size:
+                self._emails.popitem(last=False)
+
+    def discard(self, email: str) -> None:
+        """Forgets email, a user has it now"""
+        with self._lock:
+            self._emails.pop(self._key(email), None)
+
+    def clear(self) -> None:
+        """Drops every entry"""
+        with self._lock:
+            self._emails.clear()
+
+    def __len__(self) -> int:
+        """Number of cached emails"""
+        return len(self._emails)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+""" Rate limiting of password checks
+
+Each client IP and each email gets a token bucket of `burst` tokens,
+refilled one every `period / burst` seconds. A bucket is kept as one
+float, the time at which it is full again: a full bucket is the same as
+no bucket, so buckets are evicted once refilled. A check that finds an
+empty bucket raises RateLimited, which app.py turns into a 429 with a
+Retry-After header, before any password is hashed. Only the checks
+that fail take a token, so that a client sending valid credentials
+doesn't use its tokens up.
+
+Backends, chosen with RATE_LIMIT:
+- memory (default): buckets of the process, at most RATE_LIMIT_SIZE
+  per limit, least recently used first out
+- sqlite: buckets shared by every worker in RATE_LIMIT_PATH
+  (default .db_rate_limit.sqlite3)
+- none: no limit
+Limits are "<burst>/<seconds>": RATE_LIMIT_IP (default 30/60) and
+RATE_LIMIT_EMAIL (default 5/60).
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Tuple
+
+
+class RateLimited(Exception):
+    """ Raised when a client or an email has no token left
+    """
+
+    def __init__(self, retry_after: int):
+        """ retry_after: seconds until a token is available
+        """
+        super().__init__("too many attempts")
+        self.retry_after = retry_after
+
+
+def take(full_at: float, now: float, interval: float,
+         burst: int) -> Tuple[float, float]:
+    """ Take one token from the bucket full again at full_at: the new
+    full_at and 0, or full_at unchanged and the seconds to wait
+    """
+    after = max(full_at, now) + interval
+    wait = after - now - burst * interval
+    if wait > 0:
+        return full_at, wait
+    return after, 0.0
+
+
+def _digest(key: str) -> bytes:
+    """ Fixed size key of a bucket, however long the email
+    """
+    return hashlib.blake2b(key.encode('utf-8', 'replace'),
+                           digest_size=8).digest()
+
+
+class RateLimiter():
+    """ One limit, never reached: the base of the backends
+    """
+
+    def __init__(self, burst: int = 1, period: float = 1):
+        """ Initialize a limit of burst tokens refilled over period
+        """
+        self.burst = burst
+        self.interval = period / burst
+
+    def take(self, key: str) -> float:
+        """ Take a token of key: 0 or the seconds to wait for one
+        """
+        return 0.0
+
+    def peek(self, key: str) -> float:
+        """ Like take, without taking the token
+        """
+        return 0.0
+
+
+class MemoryRateLimiter(RateLimiter):
+    """ Buckets of the process, in insertion order of their last take
+    """
+
+    def __init__(self, burst: int = 1, period: float = 1,
+                 max_size: int = 100000):
+        """ Initialize without any bucket
+        """
+        super().__init__(burst, period)
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """ See RateLimiter.take
+        """
+        key = _digest(key)
+        now = time.monotonic()
+        with self._lock:
+            full_at, wait = take(self._buckets.pop(key, now), now,
+                                 self.interval, self.burst)
+            self._buckets[key] = full_at
+            buckets = self._buckets
+            while buckets and (len(buckets) > self.max_size
+                               or buckets[next(iter(buckets))] <= now):
+                buckets.popitem(last=False)
+        return wait
+
+    def peek(self, key: str) -> float:
+        """ See RateLimiter.peek
+        """
+        now = time.monotonic()
+        full_at = self._buckets.get(_digest(key), now)
+        return take(full_at, now, self.interval, self.burst)[1]
+
+    def __len__(self) -> int:
+        """ Number of buckets not full
+        """
+        return len(self._buckets)
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """ Buckets of every process in a table of a SQLite database, taken
+    in one write transaction
+    """
+
+    # Full buckets are deleted every PURGE_EVERY takes of the process
+    PURGE_EVERY = 1000
+
+    def __init__(self, db_path: str, name: str, burst: int = 1,
+                 period: float = 1):
+        """ Initialize a limit kept in the table name of db_path
+        """
+        super().__init__(burst, period)
+        self.db_path = db_path
+        self.table = "rate_limit_{}".format(name)
+        self._conn = None
+        self._pid = None
+        self._takes = 0
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """ See RateLimiter.take, with the wall clock shared by processes
+        """
+        key = _digest(key)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    'SELECT full_at FROM "{}" WHERE key = ?'
+                    .format(self.table), (key,)).fetchone()
+                full_at, wait = take(now if row is None else row[0], now,
+                                     self.interval, self.burst)
+                conn.execute('INSERT OR REPLACE INTO "{}" (key, full_at) '
+                             'VALUES (?, ?)'.format(self.table),
+                             (key, full_at))
+                self._takes += 1
+                if self._takes % self.PURGE_EVERY == 0:
+                    conn.execute('DELETE FROM "{}" WHERE full_at <= ?'
+                                 .format(self.table), (now,))
+            finally:
+                conn.execute("COMMIT")
+        return wait
+
+    def peek(self, key: str) -> float:
+        """ See RateLimiter.peek
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT full_at FROM "{}" WHERE key = ?'.format(self.table),
+                (_digest(key),)).fetchone()
+        if row is None:
+            return 0.0
+        return take(row[0], now, self.interval, self.burst)[1]
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Connection of this process, the table created if needed
+        """
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.db_path, timeout=30,
+                               isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('CREATE TABLE IF NOT EXISTS "{}" (key BLOB PRIMARY KEY, '
+                     'full_at REAL NOT NULL)'.format(self.table))
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+
+class LoginLimiter():
+    """ Limits of the password checks per client IP and per email
+    """
+
+    def __init__(self, by_ip: RateLimiter, by_email: RateLimiter):
+        """ Initialize with one limit per IP and one per email
+        """
+        self.by_ip = by_ip
+        self.by_email = by_email
+
+    def check(self, email: str, ip: str = None):
+        """ Raise RateLimited if ip or email has no token left, without
+        taking any
+        """
+        wait = max(self.by_ip.peek(ip or ""),
+                   self.by_email.peek(email.lower()))
+        if wait > 0:
+            raise RateLimited(math.ceil(wait))
+
+    def failed(self, email: str, ip: str = None):
+        """ Take a token of ip and of email for a failed password check
+        """
+        self.by_ip.take(ip or "")
+        self.by_email.take(email.lower())
+
+
+def _limit(name: str, default: str) -> Tuple[int, float]:
+    """ (burst, period) of the "<burst>/<seconds>" variable name
+    """
+    burst, _, period = getenv(name, default).partition("/")
+    return int(burst), float(period)
+
+
+def login_limiter_from_env() -> LoginLimiter:
+    """ LoginLimiter configured by RATE_LIMIT, RATE_LIMIT_IP,
+    RATE_LIMIT_EMAIL, RATE_LIMIT_SIZE and RATE_LIMIT_PATH
+    """
+    backend = getenv("RATE_LIMIT", "memory")
+    by_ip = _limit("RATE_LIMIT_IP", "30/60")
+    by_email = _limit("RATE_LIMIT_EMAIL", "5/60")
+    if backend == "none":
+        return LoginLimiter(RateLimiter(), RateLimiter())
+    if backend == "memory":
+        size = int(getenv("RATE_LIMIT_SIZE", "100000"))
+        return LoginLimiter(MemoryRateLimiter(*by_ip, size),
+                            MemoryRateLimiter(*by_email, size))
+    if backend == "sqlite":
+        path = getenv("RATE_LIMIT_PATH", ".db_rate_limit.sqlite3")
+        return LoginLimiter(SQLiteRateLimiter(path, "ip", *by_ip),
+                            SQLiteRateLimiter(path, "email", *by_email))
+    raise ValueError("Unknown RATE_LIMIT {}".format(backend))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+""" JSON provider of the API, encoding with orjson when it is available
+
+JSON providers appeared in Flask 2.2, FastJSONProvider is None before.
+"""
+from flask import Response
+from models import json_backend
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    DefaultJSONProvider = None
+
+
+class _FastJSONProvider(DefaultJSONProvider or object):
+    """ Flask's default provider, with orjson as encoder: same keys order
+    and layout, non ASCII characters are not escaped
+    """
+
+    def _option(self, indent: bool) -> int:
+        """ orjson options of a document
+        """
+        orjson = json_backend.orjson
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs) -> str:
+        """ Serialize obj, with the json module when given its options
+        """
+        orjson = json_backend.orjson
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default,
+                                option=self._option(False)).decode()
+        except TypeError:
+            return super().dumps(obj)
+
+    def response(self, *args, **kwargs) -> Response:
+        """ JSON response of the arguments, see DefaultJSONProvider
+        """
+        orjson = json_backend.orjson
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) \
+            or self.compact is False
+        try:
+            data = orjson.dumps(obj, default=self.default,
+                                option=self._option(indent))
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(data + b"\n",
+                                        mimetype=self.mimetype)
+
+
+FastJSONProvider = _FastJSONProvider if DefaultJSONProvider else None
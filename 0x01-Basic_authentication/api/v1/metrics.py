@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+""" Request and hot path latency metrics, in the Prometheus text format
+
+Opt-in with METRICS=1: `init_app` then times every request by route,
+method and status, wraps the hot paths of the models and of the
+authentication with a timer and serves GET /api/v1/metrics. Nothing is
+wrapped nor registered otherwise, so disabled metrics cost nothing.
+"""
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, List
+from flask import Flask, Response, g, request
+
+# Upper bounds of the buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram():
+    """ Latency histogram per set of label values
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple,
+                 buckets: tuple = BUCKETS):
+        """ Initialize a Histogram
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Label values: [count per bucket then +Inf, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *values: str):
+        """ Count one measure for the label values
+        """
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += seconds
+
+    def render(self) -> List[str]:
+        """ Lines of the histogram, buckets are cumulative
+        """
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            series = sorted((values, list(counts), total)
+                            for values, (counts, total)
+                            in self._series.items())
+        for values, counts, total in series:
+            labels = ",".join('{}="{}"'.format(label, _escape(value))
+                              for label, value in zip(self.labels, values))
+            sep = "," if labels else ""
+            cumulated = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulated += count
+                lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(
+                    self.name, labels, sep, bound, cumulated))
+            lines.append("{}_sum{{{}}} {}".format(self.name, labels, total))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels,
+                                                    cumulated))
+        return lines
+
+
+def _escape(value: str) -> str:
+    """ Label value escaped for the text format
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+REQUESTS = Histogram("http_request_duration_seconds",
+                     "Time to build the response of a request",
+                     ("method", "route", "status"))
+PHASES = Histogram("app_phase_duration_seconds",
+                   "Time spent in a hot path, per call",
+                   ("phase",))
+
+
+def timed(fn: Callable, phase: str) -> Callable:
+    """ fn, observed in PHASES under phase
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            PHASES.observe(time.perf_counter() - start, phase)
+    return wrapper
+
+
+def instrument(owner, name: str, phase: str = None):
+    """ Replace the method name of owner, a class or an instance, by its
+    timed version, a phase named after them by default
+    """
+    if phase is None:
+        owner_name = owner.__name__ if isinstance(owner, type) \
+            else type(owner).__name__
+        phase = "{}.{}".format(owner_name, name)
+    if not isinstance(owner, type):
+        setattr(owner, name, timed(getattr(owner, name), phase))
+        return
+    method = inspect.getattr_static(owner, name)
+    if isinstance(method, classmethod):
+        setattr(owner, name, classmethod(timed(method.__func__, phase)))
+    elif isinstance(method, staticmethod):
+        setattr(owner, name, staticmethod(timed(method.__func__, phase)))
+    else:
+        setattr(owner, name, timed(method, phase))
+
+
+def render() -> str:
+    """ Every metric in the Prometheus text format
+    """
+    return "\n".join(REQUESTS.render() + PHASES.render()) + "\n"
+
+
+def init_app(app: Flask, auth=None):
+    """ Time the requests of app and the hot paths of the API, and
+    serve the metrics; called before any other before_request
+    """
+    from models.base import Base
+    from models.user import User
+
+    instrument(Base, "load_from_file")
+    instrument(Base, "save")
+    instrument(Base, "remove")
+    instrument(Base, "save_to_file")
+    instrument(User, "search")
+    instrument(User, "is_valid_password")
+    if auth is not None:
+        instrument(auth, "current_user")
+
+    @app.before_request
+    def start_timer():
+        """ Remember when the request started
+        """
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response: Response) -> Response:
+        """ Observe the time to build the response
+        """
+        start = g.get("metrics_start")
+        if start is not None:
+            rule = request.url_rule
+            REQUESTS.observe(time.perf_counter() - start, request.method,
+                             rule.rule if rule is not None else "unmatched",
+                             str(response.status_code))
+        return response
+
+    def metrics() -> Response:
+        """ GET /api/v1/metrics
+        """
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/api/v1/metrics", "metrics", metrics,
+                     methods=["GET"], strict_slashes=False)
@@ -2,18 +2,95 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request, stream_with_context
+from flask import json as flask_json
+from models.base import DATA, public_json
+from models.bulk import MIMETYPES, export_users, format_of, import_users
 from models.user import User
+from typing import Iterator, Tuple
+from urllib.parse import urlencode
+import base64
+import binascii
+import io
+import json
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _encode_cursor(position: Tuple[str, str]) -> str:
+    """ Opaque cursor of a (created_at, id) position
+    """
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """ Position of a cursor, ValueError if it isn't one
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(cursor)
+    if type(position) is not list or len(position) != 2 \
+            or not all(type(value) is str for value in position):
+        raise ValueError(cursor)
+    return tuple(position)
+
+
+def _stream_users() -> Iterator[str]:
+    """ All Users as a JSON list, one User at a time
+    """
+    User._sync()
+    objs = DATA.get(User.__name__, {})
+    yield "["
+    separator = ""
+    for obj_id in list(objs):
+        entry = objs.get(obj_id)
+        if entry is None:
+            continue
+        yield separator + flask_json.dumps(public_json(entry))
+        separator = ","
+    yield "]\n"
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: number of Users per page, up to 1000
+      - cursor: X-Next-Cursor of the previous page
     Return:
-      - list of all User objects JSON represented
+      - list of all User objects JSON represented, streamed
+      - with limit or cursor, one page of that list ordered by created_at
+        then id; the cursor of the next page is in the X-Next-Cursor and
+        Link headers, absent on the last page
+      - 400 if limit or cursor is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if "limit" not in request.args and "cursor" not in request.args:
+        return Response(stream_with_context(_stream_users()),
+                        mimetype="application/json")
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': "Wrong limit"}), 400
+    after = None
+    if request.args.get("cursor"):
+        try:
+            after = _decode_cursor(request.args.get("cursor"))
+        except ValueError:
+            return jsonify({'error': "Wrong cursor"}), 400
+    users, last = User.page(limit, after)
+    resp = jsonify([user.to_json() for user in users])
+    if last is not None:
+        cursor = _encode_cursor(last)
+        query = urlencode({"limit": limit, "cursor": cursor})
+        resp.headers["X-Next-Cursor"] = cursor
+        resp.headers["Link"] = '<{}?{}>; rel="next"'.format(
+            request.base_url, query)
+    return resp
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -89,6 +166,43 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    Body, read one line at a time:
+      - NDJSON (Content-Type: application/x-ndjson): one JSON object per
+        line with email, password, last_name and first_name (optional)
+      - CSV (Content-Type: text/csv): header line then one User per line,
+        same columns
+    Return:
+      - number of created Users and the errors of the skipped lines
+      - 400 if the Content-Type isn't NDJSON or CSV
+    """
+    fmt = format_of(request.content_type)
+    if fmt is None:
+        return jsonify({'error': "Wrong format"}), 400
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8',
+                             errors='replace', newline='')
+    report = import_users(lines, fmt)
+    status = 201 if report["created"] > 0 else 400
+    return jsonify(report), status
+
+
+@app_views.route('/users/export', methods=['GET'], strict_slashes=False)
+def export_all_users() -> str:
+    """ GET /api/v1/users/export
+    Query parameter:
+      - format: ndjson (default) or csv
+    Return:
+      - all Users, streamed one per line
+      - 400 if the format is unknown
+    """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in MIMETYPES:
+        return jsonify({'error': "Wrong format"}), 400
+    return Response(export_users(fmt), mimetype=MIMETYPES[fmt])
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -0,0 +1,4 @@
+#!/usr/bin/env python3
+""" Benchmarks of the API hot paths, run from the project root with:
+$ python3 -m benchmarks.<module> --help
+"""
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+""" Cold start benchmark of User.load_from_file
+
+Compares the streaming, lazily materialised loader with the former
+`json.load` + `User(**record)` for every record, in time and peak memory.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from models.base import TIMESTAMP_FORMAT
+from models.user import User
+
+
+def write_users(file_path: str, n: int):
+    """ Write a snapshot of n users
+    """
+    now = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+    with open(file_path, 'w') as f:
+        f.write("{")
+        for i in range(n):
+            obj_id = str(uuid.uuid4())
+            record = {"id": obj_id, "created_at": now, "updated_at": now,
+                      "email": "user{}@example.com".format(i),
+                      "_password": uuid.uuid4().hex * 2,
+                      "first_name": "First{}".format(i),
+                      "last_name": "Last{}".format(i)}
+            f.write("{}{}: {}".format("," if i else "", json.dumps(obj_id),
+                                      json.dumps(record)))
+        f.write("}")
+
+
+def eager_load():
+    """ Former loader: whole document, then every object and datetime
+    """
+    with open(".db_User.json", 'r') as f:
+        objs_json = json.load(f)
+    objs = {}
+    for obj_id, obj_json in objs_json.items():
+        obj = User(**obj_json)
+        obj.created_at
+        obj.updated_at
+        objs[obj_id] = obj
+    return objs
+
+
+def measure(load) -> dict:
+    """ Wall time of one load, then its peak traced memory
+    """
+    start = time.perf_counter()
+    load()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    load()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": round(seconds, 4), "peak_mib": round(peak / 2**20, 1)}
+
+
+def run(n: int) -> dict:
+    """ Benchmark both loaders on a snapshot of n users
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            write_users(".db_User.json", n)
+            return {"users": n,
+                    "eager": measure(eager_load),
+                    "streaming": measure(User.load_from_file)}
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[10000, 100000])
+    args = parser.parse_args()
+    for n in args.users:
+        print(json.dumps(run(n)))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+""" Memory benchmark of built User objects
+
+Bytes per user held by n Users built from their JSON records, for the
+former layout (a __dict__ per instance, one string then one datetime per
+timestamp) and the __slots__ one (interned timestamp strings, shared
+parsed datetimes), before and after their timestamps are read.
+"""
+import argparse
+import json
+import tracemalloc
+import uuid
+from datetime import datetime
+from models.base import TIMESTAMP_FORMAT
+from models.user import User
+
+
+class DictUser():
+    """ Former layout of a User
+    """
+
+    def __init__(self, **kwargs):
+        """ Same attributes as User, in an instance __dict__
+        """
+        self.id = kwargs.get('id')
+        self.created_at = kwargs.get('created_at')
+        self.updated_at = kwargs.get('updated_at')
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+    def read_timestamps(self):
+        """ Former Timestamp: parse and keep a datetime per object
+        """
+        self.created_at = datetime.strptime(self.created_at,
+                                            TIMESTAMP_FORMAT)
+        self.updated_at = datetime.strptime(self.updated_at,
+                                            TIMESTAMP_FORMAT)
+
+
+def records(n: int):
+    """ Yield n User records as JSON text, 1000 users per second
+    """
+    for i in range(n):
+        now = datetime.utcfromtimestamp(1700000000 + i // 1000)
+        now = now.strftime(TIMESTAMP_FORMAT)
+        yield json.dumps({"id": str(uuid.uuid4()), "created_at": now,
+                          "updated_at": now,
+                          "email": "user{}@example.com".format(i),
+                          "_password": uuid.uuid4().hex * 2,
+                          "first_name": "First{}".format(i),
+                          "last_name": "Last{}".format(i)})
+
+
+def measure(cls: type, texts: list, read: bool) -> float:
+    """ Traced bytes per object left by building cls from each text
+    """
+    tracemalloc.start()
+    objs = [cls(**json.loads(text)) for text in texts]
+    if read:
+        for obj in objs:
+            if cls is DictUser:
+                obj.read_timestamps()
+            else:
+                obj.created_at
+                obj.updated_at
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return round(size / len(texts), 1)
+
+
+def run(n: int) -> dict:
+    """ Bytes per user of both layouts with n users
+    """
+    texts = list(records(n))
+    User(**json.loads(texts[0]))
+    return {"users": n,
+            "dict_bytes_per_user": measure(DictUser, texts, False),
+            "slots_bytes_per_user": measure(User, texts, False),
+            "dict_read_bytes_per_user": measure(DictUser, texts, True),
+            "slots_read_bytes_per_user": measure(User, texts, True)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[100000, 1000000])
+    args = parser.parse_args()
+    for n in args.users:
+        print(json.dumps(run(n)))
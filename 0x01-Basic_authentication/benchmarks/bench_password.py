@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+""" Benchmark of password verification
+
+Cost per verify of each scheme for the given parameters, without and
+with the verified-hash cache, next to the legacy unsalted SHA256, and
+the time to hash a batch of passwords on one thread and on every CPU
+as the bulk import does.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from models import password
+
+
+def timed(fn, samples: int) -> float:
+    """ Mean wall time of fn() over samples calls
+    """
+    start = time.perf_counter()
+    for _ in range(samples):
+        fn()
+    return (time.perf_counter() - start) / samples
+
+
+def measure(scheme: str, cost: int, samples: int, batch: int) -> dict:
+    """ Times of scheme at cost: iterations or log2 n
+    """
+    saved = (password.SCHEME, password.PBKDF2_ITERATIONS,
+             password.SCRYPT_LOG_N, password.CACHE_SIZE)
+    password.SCHEME = scheme
+    if scheme == "scrypt":
+        password.SCRYPT_LOG_N = cost
+    else:
+        password.PBKDF2_ITERATIONS = cost
+    try:
+        stored = password.hash_password("secret")
+        password.CACHE_SIZE = 0
+        verify = timed(lambda: password.verify_password("secret", stored),
+                       samples)
+        password.CACHE_SIZE = 10000
+        password.verify_password("secret", stored)
+        cached = timed(lambda: password.verify_password("secret", stored),
+                       samples * 1000)
+        pwds = ["secret{}".format(i) for i in range(batch)]
+        start = time.perf_counter()
+        password.hash_passwords(pwds, 1)
+        batch_one = time.perf_counter() - start
+        start = time.perf_counter()
+        password.hash_passwords(pwds)
+        batch_all = time.perf_counter() - start
+    finally:
+        (password.SCHEME, password.PBKDF2_ITERATIONS,
+         password.SCRYPT_LOG_N, password.CACHE_SIZE) = saved
+    return {"scheme": scheme, "cost": cost,
+            "verify_ms": round(verify * 1e3, 2),
+            "cached_verify_us": round(cached * 1e6, 2),
+            "batch": batch, "cpus": os.cpu_count(),
+            "batch_one_thread_s": round(batch_one, 3),
+            "batch_all_cpus_s": round(batch_all, 3)}
+
+
+def run_legacy(samples: int) -> dict:
+    """ Time of the former verification: unsalted SHA256 and ==
+    """
+    stored = hashlib.sha256(b"secret").hexdigest().lower()
+    verify = timed(lambda: password.verify_password("secret", stored),
+                   samples * 1000)
+    return {"scheme": "sha256", "verify_ms": round(verify * 1e3, 5)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, nargs="+",
+                        default=[100000, 300000, 600000])
+    parser.add_argument("--log-n", type=int, nargs="+",
+                        default=[14, 15, 16])
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=16)
+    args = parser.parse_args()
+    print(json.dumps(run_legacy(args.samples)))
+    for iterations in args.iterations:
+        print(json.dumps(measure("pbkdf2", iterations, args.samples,
+                                 args.batch)))
+    for log_n in args.log_n:
+        print(json.dumps(measure("scrypt", log_n, args.samples,
+                                 args.batch)))
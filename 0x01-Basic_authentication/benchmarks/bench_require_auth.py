@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+""" Microbenchmark of Auth.require_auth
+
+Per-call cost of the former list scan, rebuilding the wildcard prefixes
+on every call, and of the paths compiled once as ExcludedPaths, for a
+growing number of excluded paths (half of them wildcards).
+"""
+import argparse
+import json
+import timeit
+from api.v1.auth.auth import Auth, ExcludedPaths
+
+
+def excluded(n: int) -> list:
+    """ n excluded paths, every other one a wildcard
+    """
+    return ['/api/v1/p{}/{}'.format(i, '*' if i % 2 else '')
+            for i in range(n)]
+
+
+def list_scan(path: str, excluded_paths: list) -> bool:
+    """ Former Auth.require_auth
+    """
+    if not path or not excluded_paths:
+        return True
+    if path in excluded_paths:
+        return False
+    if path + '/' in excluded_paths:
+        return False
+    astericks = [stars[:-1]
+                 for stars in excluded_paths if stars[-1] == '*']
+    for stars in astericks:
+        if path.startswith(stars):
+            return False
+    return True
+
+
+def run(n: int, number: int = 2000) -> dict:
+    """ Nanoseconds per require_auth call for n excluded paths
+    """
+    auth = Auth()
+    paths = excluded(n)
+    compiled = ExcludedPaths(paths)
+    # An authenticated path: every exclusion has to be ruled out
+    path = '/api/v1/users/0b7e5d4e'
+    result = {"excluded_paths": n}
+    for name, check in (("list_scan", lambda: list_scan(path, paths)),
+                        ("compiled",
+                         lambda: auth.require_auth(path, compiled))):
+        seconds = min(timeit.repeat(check, number=number, repeat=3))
+        result[name + "_ns"] = round(seconds / number * 1e9)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paths", type=int, nargs="+",
+                        default=[3, 30, 300, 3000])
+    args = parser.parse_args()
+    for n in args.paths:
+        print(json.dumps(run(n)))
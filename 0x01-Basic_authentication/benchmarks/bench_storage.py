@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+""" Benchmark of the storage backends
+
+For each backend, with n users: one save_many of all of them, a cold
+load_from_file, then the mean time of a save() and of a remove() of one
+user among them. The json backend is measured with the default
+snapshot rewrite and in journal mode (DB_JOURNAL=1), without background
+compaction.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from models import base
+from models.base import Base
+from models.password import hash_password
+from models.user import User
+
+SAMPLES = 100
+PASSWORD = hash_password("pwd")
+
+
+def make_users(n: int) -> list:
+    """ n new users
+    """
+    users = []
+    for i in range(n):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+        # One hash for all: a password costs a key derivation
+        user._password = PASSWORD
+        users.append(user)
+    return users
+
+
+def mean(fn, samples: int = SAMPLES) -> float:
+    """ Mean wall time of fn(i) for i in range(samples)
+    """
+    start = time.perf_counter()
+    for i in range(samples):
+        fn(i)
+    return round((time.perf_counter() - start) / samples, 6)
+
+
+def measure(backend: str, journal: bool, n: int) -> dict:
+    """ Times of the backend with n users, in a scratch directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        journal_mode = base.JOURNAL_MODE
+        compact_every = base.JOURNAL_COMPACT_EVERY
+        base.JOURNAL_MODE = journal
+        base.JOURNAL_COMPACT_EVERY = n + 2 * SAMPLES + 1
+        try:
+            Base.use_storage(backend)
+            User.load_from_file()
+            users = make_users(n)
+            start = time.perf_counter()
+            User.save_many(users)
+            save_many = time.perf_counter() - start
+            start = time.perf_counter()
+            User.load_from_file()
+            load = time.perf_counter() - start
+            return {"save_many": round(save_many, 4),
+                    "load": round(load, 4),
+                    "save": mean(lambda i: users[i].save()),
+                    "remove": mean(lambda i: users[i].remove())}
+        finally:
+            base.JOURNAL_MODE = journal_mode
+            base.JOURNAL_COMPACT_EVERY = compact_every
+            Base.use_storage("json")
+            os.chdir(cwd)
+
+
+def run(n: int) -> dict:
+    """ Benchmark every backend with n users
+    """
+    return {"users": n,
+            "json": measure("json", False, n),
+            "json_journal": measure("json", True, n),
+            "sqlite": measure("sqlite", False, n),
+            "memory": measure("memory", False, n)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[10000, 100000])
+    args = parser.parse_args()
+    for n in args.users:
+        print(json.dumps(run(n)))
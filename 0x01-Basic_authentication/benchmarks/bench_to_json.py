@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+""" Benchmark of User serialization
+
+Users list: the former to_json (walk every attribute, check for
+datetimes, strftime both timestamps) then json, against the precomputed
+serializer then the JSON backend (orjson when installed).
+Save: save_to_file of n built users, former serialization and json
+against the current one.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from models import json_backend
+from models.base import DATA, TIMESTAMP_FORMAT
+from models.journal import _write_atomic
+from models.password import hash_password
+from models.user import User
+
+PASSWORD = hash_password("pwd")
+
+
+def former_attributes(user: User) -> dict:
+    """ Former instance __dict__ of a built user: datetime timestamps
+    """
+    attributes = user.to_json(True)
+    for key in ("created_at", "updated_at"):
+        attributes[key] = getattr(user, key)
+    return attributes
+
+
+def former_to_json(attributes: dict, for_serialization: bool = False) -> dict:
+    """ Former Base.to_json, walking the instance __dict__
+    """
+    result = {}
+    for key, value in attributes.items():
+        if not for_serialization and key[0] == '_':
+            continue
+        if type(value) is datetime:
+            result[key] = value.strftime(TIMESTAMP_FORMAT)
+        else:
+            result[key] = value
+    return result
+
+
+def make_users(n: int) -> list:
+    """ n built and stored users
+    """
+    users = []
+    for i in range(n):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+        # One hash for all: a password costs a key derivation
+        user._password = PASSWORD
+        DATA["User"][user.id] = user
+        users.append(user)
+    return users
+
+
+def timed(fn) -> float:
+    """ Best wall time of 3 runs of fn
+    """
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return round(best, 4)
+
+
+def run(n: int) -> dict:
+    """ Benchmark both serializations with n users
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            DATA["User"] = {}
+            users = make_users(n)
+            formers = [former_attributes(user) for user in users]
+
+            def former_list():
+                json.dumps([former_to_json(former) for former in formers])
+
+            def current_list():
+                json_backend.dumps([user.to_json() for user in users])
+
+            def former_save():
+                orjson = json_backend.orjson
+                json_backend.orjson = None
+                try:
+                    _write_atomic(".db_User.json",
+                                  {former["id"]: former_to_json(former, True)
+                                   for former in formers})
+                finally:
+                    json_backend.orjson = orjson
+
+            return {"users": n, "backend": json_backend.BACKEND,
+                    "list_former": timed(former_list),
+                    "list_current": timed(current_list),
+                    "save_former": timed(former_save),
+                    "save_current": timed(User.save_to_file)}
+        finally:
+            DATA["User"] = {}
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[10000, 100000])
+    args = parser.parse_args()
+    for n in args.users:
+        print(json.dumps(run(n)))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Benchmark of GET /api/v1/users
+
+Compares the former response, every User built then jsonify'd at once,
+with the streamed list and with one page of 100 users, in time and peak
+memory per request, on a freshly loaded snapshot.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from benchmarks.bench_load import write_users
+from models.user import User
+
+
+def former_list(app) -> int:
+    """ Former view: list of every User JSON, then jsonify
+    """
+    with app.test_request_context('/api/v1/users'):
+        from flask import jsonify
+        all_users = [user.to_json() for user in User.all()]
+        return len(jsonify(all_users).get_data())
+
+
+def streamed_list(client) -> int:
+    """ GET /api/v1/users, consumed chunk by chunk
+    """
+    resp = client.get('/api/v1/users', buffered=False)
+    size = sum(len(chunk) for chunk in resp.response)
+    resp.close()
+    return size
+
+
+def first_page(client) -> int:
+    """ GET /api/v1/users?limit=100
+    """
+    return len(client.get('/api/v1/users?limit=100').get_data())
+
+
+def measure(request) -> dict:
+    """ Wall time and peak traced memory of one request on a freshly
+    loaded snapshot
+    """
+    User.load_from_file()
+    start = time.perf_counter()
+    request()
+    seconds = time.perf_counter() - start
+    User.load_from_file()
+    tracemalloc.start()
+    request()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": round(seconds, 4), "peak_mib": round(peak / 2**20, 1)}
+
+
+def run(n: int) -> dict:
+    """ Benchmark the three responses with n users
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            write_users(".db_User.json", n)
+            from api.v1.app import app
+            client = app.test_client()
+            return {"users": n,
+                    "former": measure(lambda: former_list(app)),
+                    "streamed": measure(lambda: streamed_list(client)),
+                    "page_100": measure(lambda: first_page(client))}
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[10000, 100000])
+    args = parser.parse_args()
+    for n in args.users:
+        print(json.dumps(run(n)))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+""" Benchmark suite of the API, in-process through the Flask test client
+
+Scenarios, with n users in the default JSON snapshot store:
+- basic_auth_cached / basic_auth_uncached: GET /api/v1/users/<id> with a
+  verified Authorization header, then with the credential and password
+  caches emptied before each request
+- user_create, user_update, user_delete: POST, PUT and DELETE
+  /api/v1/users, each rewriting the snapshot through save_to_file
+- users_page: GET /api/v1/users?limit=100
+- load_from_file: cold start of the n users
+
+Passwords use PBKDF2 with SUITE_ITERATIONS so that key derivation does
+not drown the rest, see bench_password for its own cost.
+Results are printed as JSON, with the median of each scenario compared
+to a baseline (benchmarks/baseline.json by default): the exit status is
+1 when one of them is more than --tolerance slower.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+SUITE_ITERATIONS = 10000
+EMAIL = "suite@example.com"
+PASSWORD = "suite-password"
+
+
+def measure(op: Callable[[int], None], ops: int,
+            setup: Callable[[int], None] = None) -> dict:
+    """ Time op(i) for i in range(ops), setup(i) before each untimed
+    """
+    times = []
+    for i in range(ops):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        op(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"ops": ops,
+            "median_ms": round(statistics.median(times) * 1e3, 4),
+            "p95_ms": round(times[int(0.95 * (ops - 1))] * 1e3, 4)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """ Ratio of each median to the baseline one, and whether it is a
+    regression
+    """
+    comparison = {}
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] \
+            if before["median_ms"] else 1.0
+        comparison[name] = {"baseline_median_ms": before["median_ms"],
+                            "ratio": round(ratio, 3),
+                            "regression": ratio > 1 + tolerance}
+    return comparison
+
+
+def scenarios(n: int, scale: int) -> dict:
+    """ Run every scenario with n users, scale times the base number
+    of operations, in the current directory
+    """
+    from benchmarks.bench_load import write_users
+    write_users(".db_User.json", n)
+    os.environ["AUTH_TYPE"] = "basic_auth"
+    # The uncached scenario checks the same password over and over
+    os.environ.setdefault("RATE_LIMIT", "none")
+    from models import password
+    password.PBKDF2_ITERATIONS = SUITE_ITERATIONS
+    from api.v1.app import app, auth
+    from models.user import User
+
+    user = User(email=EMAIL)
+    user.password = PASSWORD
+    user.save()
+    client = app.test_client()
+    credentials = base64.b64encode(
+        "{}:{}".format(EMAIL, PASSWORD).encode()).decode()
+    headers = {"Authorization": "Basic " + credentials}
+    me = "/api/v1/users/" + user.id
+    created = []
+
+    def get_me(i: int):
+        assert client.get(me, headers=headers).status_code == 200
+
+    def empty_caches(i: int):
+        auth.credential_cache.clear()
+        password._verified.clear()
+
+    def create(i: int):
+        resp = client.post("/api/v1/users", headers=headers,
+                           json={"email": "new{}@example.com".format(i),
+                                 "password": "pwd"})
+        assert resp.status_code == 201
+        created.append(resp.get_json()["id"])
+
+    def update(i: int):
+        assert client.put("/api/v1/users/" + created[i], headers=headers,
+                          json={"first_name": "F{}".format(i)}
+                          ).status_code == 200
+
+    def delete(i: int):
+        assert client.delete("/api/v1/users/" + created[i],
+                             headers=headers).status_code == 200
+
+    def page(i: int):
+        assert client.get("/api/v1/users?limit=100",
+                          headers=headers).status_code == 200
+
+    get_me(0)
+    return {"basic_auth_cached": measure(get_me, 200 * scale),
+            "basic_auth_uncached": measure(get_me, 50 * scale,
+                                           empty_caches),
+            "user_create": measure(create, 10 * scale),
+            "user_update": measure(update, 10 * scale),
+            "user_delete": measure(delete, 10 * scale),
+            "users_page": measure(page, 100 * scale),
+            "load_from_file": measure(lambda i: User.load_from_file(),
+                                      3 * scale)}
+
+
+def run(n: int, scale: int = 1) -> dict:
+    """ Results of the suite with n users, in a scratch directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            results = scenarios(n, scale)
+        finally:
+            os.chdir(cwd)
+    return {"suite": "0x01-Basic_authentication", "users": n,
+            "python": platform.python_version(), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiply the number of operations")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown ratio above which a median regresses")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+    report = run(args.users, args.scale)
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("users") == args.users:
+            report["comparison"] = compare(report["results"], baseline,
+                                           args.tolerance)
+            regressions = [name for name, c in report["comparison"].items()
+                           if c["regression"]]
+    print(json.dumps(report))
+    if regressions:
+        print("Regressions: {}".format(", ".join(regressions)),
+              file=sys.stderr)
+        sys.exit(1)
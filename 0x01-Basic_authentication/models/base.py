@@ -1,40 +1,301 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from functools import lru_cache
+from operator import attrgetter
+from typing import TypeVar, List, Iterable, Callable, Tuple
+from os import getenv
+from models.journal import Journal
+from models.sqlite_storage import SQLiteStorage
+from models.storage import MemoryStorage, Storage
 import json
+import sys
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+# Per class, the (created_at, id) of every stored object, sorted
+ORDERS = {}
+STORAGES = {}
+LISTENERS = {}
+# Per class, held while DATA, INDEXES and ORDERS are mutated
+LOCKS = {}
+# Journal mode: save() and remove() append one record to the log instead
+# of rewriting the whole file, see models.journal
+JOURNAL_MODE = getenv("DB_JOURNAL", "0") == "1"
+JOURNAL_COMPACT_EVERY = int(getenv("DB_JOURNAL_COMPACT_EVERY", "1000"))
+# Reads look for the changes of other processes at most every
+# DB_SYNC_INTERVAL seconds, writes always do
+SYNC_INTERVAL = float(getenv("DB_SYNC_INTERVAL", "0"))
+SYNCED_AT = {}
+SQLITE_PATH = getenv("DB_SQLITE_PATH", ".db.sqlite3")
+
+
+def _json_storage(s_class: str) -> Storage:
+    """ Snapshot file and mutation log of a class
+    """
+    return Journal(".db_{}.json".format(s_class), JOURNAL_COMPACT_EVERY,
+                   JOURNAL_MODE)
+
+
+def _sqlite_storage(s_class: str) -> Storage:
+    """ Table of a class in the SQLite database
+    """
+    return SQLiteStorage(SQLITE_PATH, s_class, JOURNAL_COMPACT_EVERY)
+
+
+def _memory_storage(s_class: str) -> Storage:
+    """ No storage at all
+    """
+    return MemoryStorage()
+
+
+# Storage of a class by backend name, see Base.use_storage
+STORAGE_BACKENDS = {"json": _json_storage, "sqlite": _sqlite_storage,
+                    "memory": _memory_storage}
+STORAGE_BACKEND = "json"
+
+
+def _value_of(entry, attr: str):
+    """ Attribute of a stored entry: an object or a not yet built record,
+    as a dict or as JSON text
+    """
+    if type(entry) is str:
+        entry = json.loads(entry)
+    if type(entry) is dict:
+        return entry.get(attr)
+    return getattr(entry, attr, None)
+
+
+def _order_key(obj_id: str, created_at) -> Tuple[str, str]:
+    """ Position of an object in ORDERS: TIMESTAMP_FORMAT strings sort
+    chronologically, ties are broken by id
+    """
+    if type(created_at) is datetime:
+        created_at = created_at.strftime(TIMESTAMP_FORMAT)
+    return (created_at or "", obj_id)
+
+
+def _order_discard(order: list, key: Tuple[str, str]) -> None:
+    """ Drop key from a sorted order
+    """
+    i = bisect_left(order, key)
+    if i < len(order) and order[i] == key:
+        del order[i]
+
+
+def _index_object(cls: type, obj_id: str, entry) -> None:
+    """ Add a stored entry to the secondary indexes of its class
+    """
+    indexes = INDEXES[cls.__name__]
+    for attr in cls.indexed_attributes:
+        _index_add(indexes[attr], _value_of(entry, attr), obj_id)
+    insort(ORDERS[cls.__name__],
+           _order_key(obj_id, _value_of(entry, 'created_at')))
+
+
+def _unindex_object(cls: type, obj_id: str, entry) -> None:
+    """ Drop a stored entry from the secondary indexes of its class
+    """
+    indexes = INDEXES[cls.__name__]
+    for attr in cls.indexed_attributes:
+        _index_discard(indexes[attr], _value_of(entry, attr), obj_id)
+    _order_discard(ORDERS[cls.__name__],
+                   _order_key(obj_id, _value_of(entry, 'created_at')))
+
+
+def public_json(entry) -> dict:
+    """ JSON dictionary of a stored entry, built or not, without its
+    private attributes: what to_json() returns once built
+    """
+    if type(entry) is str:
+        entry = json.loads(entry)
+    if type(entry) is dict:
+        return {k: v for k, v in entry.items() if k[0] != '_'}
+    return entry.to_json()
+
+
+def _notify(cls: type, event: str, obj: TypeVar('Base')) -> None:
+    """ Call the listeners subscribed to cls
+    """
+    for callback in LISTENERS.get(cls.__name__, ()):
+        callback(event, obj)
+
+
+def _index_add(index: dict, value, obj_id: str) -> None:
+    """ Register obj_id under value, unhashable values are not indexed
+    """
+    try:
+        index.setdefault(value, {})[obj_id] = None
+    except TypeError:
+        pass
+
+
+def _index_discard(index: dict, value, obj_id: str) -> None:
+    """ Unregister obj_id from value
+    """
+    try:
+        ids = index.get(value)
+    except TypeError:
+        return
+    if ids is not None:
+        ids.pop(obj_id, None)
+        if len(ids) == 0:
+            del index[value]
+
+
+@lru_cache(maxsize=4096)
+def _parse_timestamp(value: str) -> datetime:
+    """ Datetime of a TIMESTAMP_FORMAT string, the same object for equal
+    strings while they are cached
+    """
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+class Timestamp():
+    """ Datetime attribute kept in its serialized form, formatted once when
+    set and parsed when read, stored in the slot named after it with a
+    leading underscore
+    """
+
+    def __set_name__(self, owner: type, name: str):
+        """ Remember the attribute name and its slot
+        """
+        self.name = name
+        self.slot = owner.__dict__['_' + name]
+
+    def __get__(self, obj, objtype: type = None):
+        """ Return the datetime
+        """
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj)
+        if type(value) is str:
+            return _parse_timestamp(value)
+        return value
+
+    def __set__(self, obj, value):
+        """ Store the interned TIMESTAMP_FORMAT string of a datetime or
+        the string itself
+        """
+        if type(value) is datetime:
+            value = value.strftime(TIMESTAMP_FORMAT)
+        if type(value) is str:
+            value = sys.intern(value)
+        self.slot.__set__(obj, value)
+
+    def raw(self, obj):
+        """ Stored value: the TIMESTAMP_FORMAT string
+        """
+        return self.slot.__get__(obj)
+
+
+def _build_serializers(json_slots: tuple) -> dict:
+    """ For to_json(False) and to_json(True): the JSON keys and a function
+    returning the values of their slots, at least id and the timestamps
+    """
+    serializers = {}
+    for for_serialization in (False, True):
+        pairs = [(key, slot) for key, slot in json_slots
+                 if for_serialization or key[0] != '_']
+        keys = tuple(key for key, _ in pairs)
+        values = attrgetter(*(slot for _, slot in pairs))
+        serializers[for_serialization] = (keys, values)
+    return serializers
 
 
 class Base():
     """ Base class
+
+    Objects loaded from file are kept as their JSON record in DATA, as a
+    dict or as text, and only built on first access, see `_materialize`.
+
+    Attributes are held in __slots__, each subclass declaring its own.
+    `to_json` serializes them in declaration order, Timestamp slots under
+    the name of their attribute, followed by any attribute set on a
+    subclass without __slots__.
     """
 
+    __slots__ = ('id', '_created_at', '_updated_at')
+
+    created_at = Timestamp()
+    updated_at = Timestamp()
+
+    # Attributes looked up by exact match through a hash index in `search`
+    indexed_attributes = ()
+
+    # (JSON key, slot) of the attributes, see __init_subclass__
+    _json_slots = (('id', 'id'), ('created_at', '_created_at'),
+                   ('updated_at', '_updated_at'))
+    _serializers = _build_serializers(_json_slots)
+
+    def __init_subclass__(cls, **kwargs):
+        """ Append the slots declared by cls to _json_slots
+        """
+        super().__init_subclass__(**kwargs)
+        json_slots = list(cls._json_slots)
+        for slot in cls.__dict__.get('__slots__', ()):
+            attr = getattr(cls, slot[1:], None) if slot[0] == '_' else None
+            json_slots.append((slot[1:], slot) if type(attr) is Timestamp
+                              else (slot, slot))
+        cls._json_slots = tuple(json_slots)
+        cls._serializers = _build_serializers(cls._json_slots)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+        if INDEXES.get(s_class) is None:
+            INDEXES[s_class] = {a: {} for a in self.indexed_attributes}
+        if ORDERS.get(s_class) is None:
+            ORDERS[s_class] = []
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
+        # Timestamp strings are only parsed when the attribute is read
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs.get('created_at')
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs.get('updated_at')
         else:
             self.updated_at = datetime.utcnow()
 
+    def __setattr__(self, name: str, value) -> None:
+        """ Set an attribute, keeping the indexes of stored objects in sync
+        """
+        if name == 'created_at' and self._is_stored():
+            with self.__class__._lock():
+                order = ORDERS[self.__class__.__name__]
+                _order_discard(order, _order_key(self.id,
+                                                 Base.created_at.raw(self)))
+                object.__setattr__(self, name, value)
+                insort(order, _order_key(self.id, Base.created_at.raw(self)))
+            return
+        if name not in self.indexed_attributes or not self._is_stored():
+            object.__setattr__(self, name, value)
+            return
+        with self.__class__._lock():
+            index = INDEXES[self.__class__.__name__][name]
+            _index_discard(index, getattr(self, name, None), self.id)
+            object.__setattr__(self, name, value)
+            _index_add(index, getattr(self, name, None), self.id)
+
+    def _is_stored(self) -> bool:
+        """ True if this very instance is the one held in DATA
+        """
+        objs = DATA.get(self.__class__.__name__)
+        obj_id = getattr(self, 'id', None)
+        return objs is not None and objs.get(obj_id) is self
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -47,64 +308,251 @@ class Base():
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
-        result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
-                continue
+        keys, values = self._serializers[for_serialization]
+        try:
+            result = dict(zip(keys, values(self)))
+        except AttributeError:
+            # Some slots are not set
+            result = {}
+            for key, slot in self._json_slots:
+                if for_serialization or key[0] != '_':
+                    try:
+                        result[key] = getattr(self, slot)
+                    except AttributeError:
+                        continue
+        extras = getattr(self, '__dict__', None)
+        if extras:
+            for key, value in extras.items():
+                if for_serialization or key[0] != '_':
+                    result[key] = value
+        for key, value in result.items():
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
         return result
 
+    @classmethod
+    def storage(cls) -> Storage:
+        """ Storage of this class, from the backend in use
+        """
+        s_class = cls.__name__
+        if STORAGES.get(s_class) is None:
+            STORAGES[s_class] = STORAGE_BACKENDS[STORAGE_BACKEND](s_class)
+        return STORAGES[s_class]
+
+    @staticmethod
+    def use_storage(backend: str):
+        """ Persist every class with backend, one of STORAGE_BACKENDS,
+        from their next load
+        """
+        global STORAGE_BACKEND
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError("Unknown storage backend: {}".format(backend))
+        STORAGE_BACKEND = backend
+        STORAGES.clear()
+
+    @classmethod
+    def _lock(cls) -> threading.RLock:
+        """ Lock of the in-memory objects of this class
+        """
+        lock = LOCKS.get(cls.__name__)
+        if lock is None:
+            lock = LOCKS.setdefault(cls.__name__, threading.RLock())
+        return lock
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
+
+        Records are streamed from the file and stored as is, objects are
+        built from them on first access.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        with cls._lock():
+            objs = cls.storage().load()
+            indexes = {a: {} for a in cls.indexed_attributes}
+            order = []
+            for obj_id, obj_json in objs.items():
+                if type(obj_json) is str:
+                    obj_json = json.loads(obj_json)
+                for attr in cls.indexed_attributes:
+                    _index_add(indexes[attr], obj_json.get(attr), obj_id)
+                order.append(_order_key(obj_id, obj_json.get('created_at')))
+            order.sort()
+            # Readers keep the former dicts until they look again
+            DATA[s_class] = objs
+            INDEXES[s_class] = indexes
+            ORDERS[s_class] = order
+            _notify(cls, "load", None)
+
+    @classmethod
+    def _sync(cls):
+        """ Catch up with the changes made by other processes, if any
+        """
+        if SYNC_INTERVAL > 0:
+            now = time.monotonic()
+            if now - SYNCED_AT.get(cls.__name__, 0) < SYNC_INTERVAL:
+                return
+            SYNCED_AT[cls.__name__] = now
+        storage = cls.storage()
+        if not storage.changed():
             return
+        with cls._lock(), storage.lock():
+            cls._sync_locked()
+
+    @classmethod
+    def _sync_locked(cls):
+        """ Catch up with the changes made by other processes, applying
+        their mutations one by one when the storage knows them, under
+        both locks
+        """
+        storage = cls.storage()
+        if not storage.changed():
+            return
+        changes = storage.changes()
+        if changes is None or cls.__name__ not in DATA:
+            cls.load_from_file()
+            return
+        for op, obj_id, obj_json in changes:
+            cls._apply(op, obj_id, obj_json)
+
+    @classmethod
+    def _apply(cls, op: str, obj_id: str, obj_json: dict = None):
+        """ Apply a mutation made by another process and notify the
+        listeners with an object built from its record
+        """
+        s_class = cls.__name__
+        current = DATA[s_class].get(obj_id)
+        if current is not None:
+            _unindex_object(cls, obj_id, current)
+            del DATA[s_class][obj_id]
+        if op == "save":
+            DATA[s_class][obj_id] = obj_json
+            _index_object(cls, obj_id, obj_json)
+            _notify(cls, "save", cls(**obj_json))
+        elif current is not None:
+            if type(current) is str:
+                current = json.loads(current)
+            if type(current) is dict:
+                current = cls(**current)
+            _notify(cls, "remove", current)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def subscribe(cls, callback: Callable[[str, TypeVar('Base')], None]):
+        """ Register callback(event, obj), called after each save()
+        ("save") or remove() ("remove") of an object of this class and
+        after load_from_file() ("load", obj is None)
+        """
+        LISTENERS.setdefault(cls.__name__, []).append(callback)
+
+    @classmethod
+    def _materialize(cls, obj_id: str, entry) -> TypeVar('Base'):
+        """ Return the object of a stored entry, building it from its
+        record if needed
+
+        The entry is only replaced while it is still the one stored:
+        when a removal or a reload happened since it was read, the
+        current object is returned instead, None if there is none.
+        """
+        while type(entry) in (str, dict):
+            record = json.loads(entry) if type(entry) is str else entry
+            obj = cls(**record)
+            with cls._lock():
+                objs = DATA[cls.__name__]
+                current = objs.get(obj_id)
+                if current is entry:
+                    objs[obj_id] = obj
+                    return obj
+            entry = current
+        return entry
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        def objs_json():
+            return {obj_id: obj if type(obj) in (str, dict)
+                    else obj.to_json(True)
+                    for obj_id, obj in DATA[s_class].items()}
+
+        with cls._lock():
+            cls.storage().checkpoint(objs_json)
 
     def save(self):
         """ Save current object
+
+        The changes of other processes are applied first, under the lock
+        of the storage, so that none of them is overwritten.
+        """
+        cls = self.__class__
+        s_class = cls.__name__
+        storage = cls.storage()
+        with cls._lock(), storage.lock():
+            cls._sync_locked()
+            self.updated_at = datetime.utcnow()
+            current = DATA[s_class].get(self.id)
+            if current is not self:
+                if current is not None:
+                    _unindex_object(cls, self.id, current)
+                DATA[s_class][self.id] = self
+                _index_object(cls, self.id, self)
+            if storage.incremental:
+                storage.append("save", self.id, self.to_json(True))
+            else:
+                cls.save_to_file()
+        _notify(cls, "save", self)
+
+    @classmethod
+    def save_many(cls, objs: List[TypeVar('Base')]):
+        """ Save several objects of this class with a single write to
+        their storage
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        s_class = cls.__name__
+        storage = cls.storage()
+        with cls._lock(), storage.lock():
+            cls._sync_locked()
+            now = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+            for obj in objs:
+                obj.updated_at = now
+                current = DATA[s_class].get(obj.id)
+                if current is not obj:
+                    if current is not None:
+                        _unindex_object(cls, obj.id, current)
+                    DATA[s_class][obj.id] = obj
+                    _index_object(cls, obj.id, obj)
+            if storage.incremental:
+                storage.append_many(("save", obj.id, obj.to_json(True))
+                                    for obj in objs)
+            else:
+                cls.save_to_file()
+        for obj in objs:
+            _notify(cls, "save", obj)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
+        cls = self.__class__
+        s_class = cls.__name__
+        storage = cls.storage()
+        with cls._lock(), storage.lock():
+            cls._sync_locked()
+            current = DATA[s_class].get(self.id)
+            if current is None:
+                return
+            _unindex_object(cls, self.id, current)
             del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+            if storage.incremental:
+                storage.append("remove", self.id)
+            else:
+                cls.save_to_file()
+        _notify(cls, "remove", self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        cls._sync()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -114,24 +562,66 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def page(cls, limit: int, after: Tuple[str, str] = None) -> Tuple:
+        """ Return up to limit objects ordered by created_at then id,
+        starting after the position `after`, and the position to resume
+        from, None on the last page
+        """
+        cls._sync()
+        s_class = cls.__name__
+        objs = DATA[s_class]
+        order = ORDERS[s_class]
+        start = 0 if after is None else bisect_right(order, tuple(after))
+        keys = order[start:start + limit]
+        page = [cls._materialize(obj_id, objs.get(obj_id))
+                for _, obj_id in keys if obj_id in objs]
+        page = [obj for obj in page if obj is not None]
+        if start + limit >= len(order) or len(keys) == 0:
+            return page, None
+        return page, keys[-1]
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        cls._sync()
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        entry = DATA[s_class].get(id)
+        if entry is None:
+            return None
+        return cls._materialize(id, entry)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        When one of the attributes is indexed, only the objects registered
+        under that value are checked instead of every stored object.
         """
+        cls._sync()
         s_class = cls.__name__
+        objs = DATA[s_class]
+        ids = objs
+        for k, v in attributes.items():
+            if k not in cls.indexed_attributes:
+                continue
+            try:
+                ids = INDEXES[s_class][k].get(v, {})
+            except TypeError:
+                continue
+            break
+        candidates = [cls._materialize(obj_id, objs.get(obj_id))
+                      for obj_id in list(ids) if obj_id in objs]
+
         def _search(obj):
+            if obj is None:
+                return False
             if len(attributes) == 0:
                 return True
             for k, v in attributes.items():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        return list(filter(_search, candidates))
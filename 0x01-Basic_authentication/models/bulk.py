@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+""" Bulk import and export of Users as NDJSON or CSV
+
+Import:
+    python3 -m models.bulk import users.ndjson
+    python3 -m models.bulk import --format csv users.csv
+Export (to stdout):
+    python3 -m models.bulk export --format csv > users.csv
+"""
+import csv
+import io
+import json
+import os
+from typing import Iterable, Iterator
+from models.base import DATA, Base, public_json
+from models.password import hash_passwords
+from models.user import User
+
+
+FORMATS = ("ndjson", "csv")
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FIELDS = ("id", "email", "first_name", "last_name",
+                 "created_at", "updated_at")
+
+
+def format_of(name: str) -> str:
+    """ Bulk format of a mimetype or a file name, None if unknown
+    """
+    if name is None:
+        return None
+    name = name.split(";", 1)[0].strip().lower()
+    for fmt, mimetype in MIMETYPES.items():
+        if name == mimetype or name.endswith("." + fmt):
+            return fmt
+    if name in ("application/jsonl", "application/json-seq") \
+            or name.endswith(".jsonl"):
+        return "ndjson"
+    return None
+
+
+def iter_rows(lines: Iterable[str], fmt: str) -> Iterator[tuple]:
+    """ Yield the (line number, row dict or error message) of each
+    non empty line of an NDJSON or CSV document, read one line at a time
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(lines, 1):
+        if line.strip() == "":
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, "Wrong format: {}".format(e)
+            continue
+        if type(row) is not dict:
+            yield line_num, "Wrong format"
+            continue
+        yield line_num, row
+
+
+def _user_of(row: dict, emails: set) -> User:
+    """ User of an import row, ValueError with the reason if invalid
+
+    Its password is left in clear text, see `_save_batch`.
+    """
+    email = row.get("email")
+    password = row.get("password")
+    if not email or type(email) is not str:
+        raise ValueError("email missing")
+    if not password or type(password) is not str:
+        raise ValueError("password missing")
+    if email in emails or len(User.search({"email": email})) > 0:
+        raise ValueError("email already exists")
+    user = User()
+    user.email = email
+    user._password = password
+    user.first_name = row.get("first_name") or None
+    user.last_name = row.get("last_name") or None
+    return user
+
+
+def import_users(lines: Iterable[str], fmt: str,
+                 batch_size: int = None) -> dict:
+    """ Create the Users of an NDJSON or CSV document
+
+    Valid rows are saved with a single write of the file instead of one
+    per User, or one write every batch_size rows when given. Invalid rows
+    are skipped and reported with their line number.
+    """
+    created = 0
+    errors = []
+    emails = set()
+    batch = []
+    for line_num, row in iter_rows(lines, fmt):
+        try:
+            if type(row) is str:
+                raise ValueError(row)
+            user = _user_of(row, emails)
+        except ValueError as e:
+            errors.append({"line": line_num, "error": str(e)})
+            continue
+        emails.add(user.email)
+        batch.append(user)
+        if batch_size and len(batch) >= batch_size:
+            created += _save_batch(batch)
+            batch = []
+    if len(batch) > 0:
+        created += _save_batch(batch)
+    return {"created": created, "errors": errors}
+
+
+def _save_batch(batch: list) -> int:
+    """ Hash the passwords of a batch of Users on every CPU, then save
+    them, and return how many were saved
+    """
+    hashes = hash_passwords([user._password for user in batch])
+    for user, hashed in zip(batch, hashes):
+        user._password = hashed
+    User.save_many(batch)
+    return len(batch)
+
+
+def export_users(fmt: str) -> Iterator[str]:
+    """ Yield all Users as NDJSON lines or CSV rows, one at a time,
+    without building the objects nor the whole document
+    """
+    User._sync()
+    objs = DATA.get(User.__name__, {})
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS,
+                                extrasaction='ignore')
+        writer.writeheader()
+    for obj_id in list(objs):
+        entry = objs.get(obj_id)
+        if entry is None:
+            continue
+        user_json = public_json(entry)
+        if fmt != "csv":
+            yield json.dumps(user_json) + "\n"
+            continue
+        writer.writerow(user_json)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if fmt == "csv" and buffer.tell() > 0:
+        yield buffer.getvalue()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("file", nargs="?", help="import file, - for stdin")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--batch-size", type=int,
+                        help="write the file every BATCH_SIZE Users")
+    args = parser.parse_args()
+
+    Base.use_storage(os.getenv("DB_BACKEND", "json"))
+    User.load_from_file()
+    if args.command == "export":
+        for chunk in export_users(args.format or "ndjson"):
+            sys.stdout.write(chunk)
+        sys.exit(0)
+    fmt = args.format or format_of(args.file) or "ndjson"
+    if args.file is None or args.file == "-":
+        report = import_users(sys.stdin, fmt, args.batch_size)
+    else:
+        with open(args.file, 'r', newline='') as f:
+            report = import_users(f, fmt, args.batch_size)
+    print(json.dumps(report))
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+""" Journal module
+
+A class is persisted as a JSON snapshot (`.db_<Class>.json`) plus an
+append-only log of the mutations made since that snapshot
+(`.db_<Class>.json.log`), one JSON record per line.
+Compaction folds the log into a new snapshot in a background thread:
+the log is first rotated to `.db_<Class>.json.log.old` so writers keep
+appending while the old segment is replayed on top of the snapshot.
+Snapshots are always replaced atomically, and replaying a record twice
+is harmless, so a crash at any point leaves a loadable store.
+
+Several processes can share the files: writes hold an exclusive lock on
+`.db_<Class>.json.lock`, and one compaction runs at a time, holding
+`.db_<Class>.json.compact.lock`. Each process remembers which snapshot
+it read and how far into the log, so it reads the records appended by
+the others instead of loading everything again.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+from models.json_backend import dumps
+from models.storage import Storage
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks: the files belong to a single process
+    fcntl = None
+
+CHUNK_SIZE = 1 << 16
+
+
+def _stat(path: str) -> Optional[Tuple[int, int, int]]:
+    """ Inode, size and modification time of path, None if missing
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _record_line(op: str, obj_id: str, obj_json: dict = None) -> bytes:
+    """ Log line of one mutation
+    """
+    record = {"op": op, "id": obj_id}
+    if obj_json is not None:
+        record["obj"] = obj_json
+    return (dumps(record) + "\n").encode()
+
+
+def _apply_record(objs_json: dict, record: dict) -> None:
+    """ Apply one log record to objs_json
+    """
+    if record["op"] == "save":
+        objs_json[record["id"]] = record["obj"]
+    else:
+        objs_json.pop(record["id"], None)
+
+
+class Journal(Storage):
+    """ Snapshot and mutation log of one class
+    """
+
+    def __init__(self, file_path: str, compact_every: int = 1000,
+                 incremental: bool = True):
+        """ Initialize a Journal for the snapshot at file_path, appending
+        to its log when incremental, checkpointing otherwise
+        """
+        super().__init__()
+        self.file_path = file_path
+        self.log_path = file_path + ".log"
+        self.old_path = file_path + ".log.old"
+        self.lock_path = file_path + ".lock"
+        self.compact_lock_path = file_path + ".compact.lock"
+        self.compact_every = compact_every
+        self.incremental = incremental
+        self._log = None
+        self._count = 0
+        self._depth = 0
+        self._fds = {}
+        self._pid = os.getpid()
+        self._compact_lock = threading.Lock()
+        # What this process last read or wrote: the snapshot and old
+        # segment signatures, the inode of the log and how far into it
+        self._seen = (None, None)
+        self._log_ino = None
+        self._log_offset = 0
+
+    def load(self) -> dict:
+        """ Return the snapshot with all logged mutations replayed
+        """
+        with self.lock():
+            seen = self._signature()
+            objs_json = self._read_snapshot()
+            self._replay(self.old_path, objs_json)
+            self._log_ino, self._log_offset, self._count = \
+                self._replay(self.log_path, objs_json)
+            self._seen = seen
+        return objs_json
+
+    def append(self, op: str, obj_id: str, obj_json: dict = None):
+        """ Durably log one mutation: "save" with the serialized object
+        or "remove"
+        """
+        self._write(_record_line(op, obj_id, obj_json), 1)
+
+    def append_many(self, mutations: Iterable[Tuple[str, str, dict]]):
+        """ Durably log several mutations with a single write
+        """
+        lines = [_record_line(*mutation) for mutation in mutations]
+        if len(lines) > 0:
+            self._write(b"".join(lines), len(lines))
+
+    def _write(self, lines: bytes, count: int):
+        """ Append count records to the log and sync it
+        """
+        with self.lock():
+            log = self._open_log()
+            st = os.fstat(log.fileno())
+            in_sync = self._log_offset == st.st_size \
+                and self._log_ino in (None, st.st_ino)
+            log.write(lines)
+            log.flush()
+            os.fsync(log.fileno())
+            if in_sync:
+                self._log_ino = st.st_ino
+                self._log_offset = st.st_size + len(lines)
+            self._count += count
+            if self._count < self.compact_every:
+                return
+        self.compact_in_background()
+
+    def changed(self) -> bool:
+        """ True if the files differ from what this process last read or
+        wrote
+        """
+        if self._signature() != self._seen:
+            return True
+        log = _stat(self.log_path)
+        if log is None:
+            return self._log_ino is not None
+        return log[0] != self._log_ino or log[1] != self._log_offset
+
+    def changes(self) -> Optional[list]:
+        """ The records appended to the log by other processes, None
+        once the snapshot was rewritten or the log rotated
+        """
+        if self._signature() != self._seen:
+            return None
+        try:
+            f = open(self.log_path, 'rb+')
+        except FileNotFoundError:
+            return [] if self._log_ino is None else None
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            if self._log_ino is not None and ino != self._log_ino:
+                return None
+            offset = self._log_offset if self._log_ino is not None else 0
+            changes = []
+            for record, offset in self._records(f, offset):
+                changes.append((record["op"], record["id"],
+                                record.get("obj")))
+        self._log_ino, self._log_offset = ino, offset
+        self._count += len(changes)
+        return changes
+
+    @contextmanager
+    def lock(self):
+        """ Hold the files exclusively, against the other threads of this
+        process and the other processes
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: inherited descriptors share their locks with
+                # the parent process
+                self._fds = {}
+                self._log = None
+                self._pid = os.getpid()
+            if self._depth == 0:
+                self._flock(self.lock_path)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._funlock(self.lock_path)
+
+    def compact_in_background(self):
+        """ Start a compaction unless one is already running
+        """
+        if self._compact_lock.locked():
+            return
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """ Fold the current log into the snapshot, unless another thread
+        or process is already compacting
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return
+        try:
+            if not self._flock(self.compact_lock_path, blocking=False):
+                return
+            try:
+                self._compact()
+            finally:
+                self._funlock(self.compact_lock_path)
+        finally:
+            self._compact_lock.release()
+
+    def _compact(self):
+        """ Rotate the log, fold it outside of the lock, then replace the
+        snapshot unless it was checkpointed meanwhile
+        """
+        with self.lock():
+            # A leftover old segment (crash during a previous
+            # compaction) is folded first, the live log stays put
+            if not os.path.exists(self.old_path):
+                self._close_log()
+                if not os.path.exists(self.log_path):
+                    return
+                in_sync = not self.changed()
+                os.replace(self.log_path, self.old_path)
+                self._count = 0
+                if in_sync:
+                    self._seen = self._signature()
+                    self._log_ino, self._log_offset = None, 0
+            start = self._signature()
+        objs_json = self._read_snapshot()
+        self._replay(self.old_path, objs_json)
+        tmp_path = _write_tmp(self.file_path, objs_json)
+        with self.lock():
+            if self._signature() != start:
+                os.remove(tmp_path)
+                return
+            _replace(tmp_path, self.file_path)
+            os.remove(self.old_path)
+            if self._seen == start:
+                self._seen = self._signature()
+
+    def checkpoint(self, objs_json: Callable[[], dict]):
+        """ Replace the snapshot with objs_json() and empty the log
+        """
+        with self.lock():
+            _write_atomic(self.file_path, objs_json())
+            self._close_log()
+            for log_path in (self.log_path, self.old_path):
+                if os.path.exists(log_path):
+                    os.remove(log_path)
+            self._count = 0
+            self._seen = self._signature()
+            self._log_ino, self._log_offset = None, 0
+
+    def _signature(self) -> Tuple:
+        """ Signatures of the snapshot and of the old log segment, both
+        change whenever the log is rotated or the snapshot replaced
+        """
+        return (_stat(self.file_path), _stat(self.old_path))
+
+    def _flock(self, path: str, blocking: bool = True) -> bool:
+        """ Lock the file at path exclusively, False if it is already
+        locked and blocking is False
+        """
+        if fcntl is None:
+            return True
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._fds[path] = fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking
+                                             else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+
+    def _funlock(self, path: str):
+        """ Unlock the file at path
+        """
+        if fcntl is not None:
+            fcntl.flock(self._fds[path], fcntl.LOCK_UN)
+
+    def _read_snapshot(self) -> dict:
+        """ Read the snapshot one record at a time
+        """
+        objs_json = {}
+        try:
+            f = open(self.file_path, 'r')
+        except FileNotFoundError:
+            return objs_json
+        with f:
+            for obj_id, obj_json in iter_snapshot(f):
+                objs_json[obj_id] = obj_json
+        return objs_json
+
+    def _open_log(self):
+        """ The log opened for appending, opened again when another
+        process rotated or removed it
+        """
+        if self._log is not None:
+            current = _stat(self.log_path)
+            if current is None \
+                    or current[0] != os.fstat(self._log.fileno()).st_ino:
+                self._close_log()
+        if self._log is None:
+            self._log = open(self.log_path, 'ab')
+        return self._log
+
+    def _close_log(self):
+        """ Close the log file, it is reopened on the next append
+        """
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    @classmethod
+    def _replay(cls, log_path: str, objs_json: dict) -> Tuple[int, int, int]:
+        """ Apply the records of log_path to objs_json and return the
+        inode of the log, the offset of its end and how many records
+        were applied
+        """
+        ino, offset, count = None, 0, 0
+        try:
+            f = open(log_path, 'rb+')
+        except FileNotFoundError:
+            return ino, offset, count
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            for record, offset in cls._records(f):
+                _apply_record(objs_json, record)
+                count += 1
+        return ino, offset, count
+
+    @staticmethod
+    def _records(f, offset: int = 0) -> Iterator[Tuple[dict, int]]:
+        """ Yield the records of an open log from offset, each with the
+        offset of its end
+
+        A torn last record, left by a crash in the middle of an append,
+        is cut off so that later appends are not hidden behind it.
+        """
+        f.seek(offset)
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("torn record")
+                record = json.loads(line)
+            except ValueError:
+                f.truncate(offset)
+                return
+            offset += len(line)
+            yield record, offset
+
+
+def iter_snapshot(f, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple]:
+    """ Yield the (id, record) pairs of a snapshot file, reading it in
+    chunks so that the whole document is never held in memory
+
+    Records are yielded as their JSON text, which is far more compact
+    than the decoded dict: decoding is left to the first access.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    # Next token: "{", then "key" ":" "value" and "," or "}" for each record
+    expect = "{"
+    key = None
+    while True:
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+        while pos < len(buf) and buf[pos] in " \t\n\r":
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("truncated snapshot")
+            chunk = f.read(chunk_size)
+            eof = chunk == ""
+            buf += chunk
+            continue
+        if expect in ("key", "value"):
+            if expect == "key" and buf[pos] == "}" and key is None:
+                return
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = len(buf)
+            if end == len(buf) and not eof:
+                # The token may go on in the next chunk
+                chunk = f.read(chunk_size)
+                eof = chunk == ""
+                buf += chunk
+                continue
+            if expect == "key":
+                key = value
+                expect = ":"
+            else:
+                yield key, buf[pos:end]
+                expect = ","
+            pos = end
+        elif expect == ",":
+            if buf[pos] == "}":
+                return
+            if buf[pos] != ",":
+                raise ValueError("expected ',' in snapshot")
+            pos += 1
+            expect = "key"
+        else:
+            if buf[pos] != expect:
+                raise ValueError("expected '{}' in snapshot".format(expect))
+            pos += 1
+            expect = "key" if expect == "{" else "value"
+
+
+def _write_tmp(file_path: str, objs_json: dict) -> str:
+    """ Write objs_json to a synced temporary file next to file_path and
+    return its path
+
+    Records are either dicts or their JSON text, see `iter_snapshot`.
+    """
+    # Named after the writer: a compaction and a checkpoint may write
+    # at the same time
+    tmp_path = "{}.{}-{}.tmp".format(file_path, os.getpid(),
+                                     threading.get_ident())
+    with open(tmp_path, 'w') as f:
+        f.write("{")
+        sep = ""
+        for obj_id, obj_json in objs_json.items():
+            if type(obj_json) is not str:
+                obj_json = dumps(obj_json)
+            f.write("{}{}: {}".format(sep, dumps(obj_id), obj_json))
+            sep = ", "
+        f.write("}")
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def _replace(tmp_path: str, file_path: str):
+    """ Atomically rename tmp_path to file_path and sync the directory
+    """
+    os.replace(tmp_path, file_path)
+    try:
+        dir_fd = os.open(os.path.dirname(file_path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _write_atomic(file_path: str, objs_json: dict):
+    """ Write objs_json to file_path through a synced temporary file
+    """
+    _replace(_write_tmp(file_path, objs_json), file_path)
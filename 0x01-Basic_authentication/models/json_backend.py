@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+""" JSON encoding backend
+
+orjson is used when it is installed, unless JSON_BACKEND=json. Both
+produce the same documents, orjson without optional spaces.
+"""
+from os import getenv
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if getenv("JSON_BACKEND", "orjson") == "json":
+    orjson = None
+
+BACKEND = "json" if orjson is None else "orjson"
+
+
+def dumps(obj) -> str:
+    """ Serialize obj to a JSON formatted str
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            # Not supported by orjson, e.g. integers above 64 bits
+            pass
+    return json.dumps(obj)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+""" Password hashing module
+
+Passwords are stored as versioned records carrying their parameters,
+salt and hash in unpadded urlsafe base64:
+    $pbkdf2-sha256$<iterations>$<salt>$<hash>
+    $scrypt$<log2 n>,<r>,<p>$<salt>$<hash>
+Legacy hashes, the hex SHA-256 of the password, are still verified and
+`needs_rehash` tells when a record should be replaced by one of the
+current scheme, see User.is_valid_password.
+
+The scheme and its cost are set by PASSWORD_HASH ("pbkdf2" or
+"scrypt"), PASSWORD_PBKDF2_ITERATIONS and PASSWORD_SCRYPT_LOG_N.
+Successful verifications are cached (PASSWORD_CACHE_SIZE entries, 0
+disables it) under an HMAC of the record and the password. The time of
+the last key derivations is kept for `fake_verify`, which takes as long
+for users that don't exist.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import List
+
+SCHEME = getenv("PASSWORD_HASH", "pbkdf2")
+PBKDF2_ITERATIONS = int(getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+SCRYPT_LOG_N = int(getenv("PASSWORD_SCRYPT_LOG_N", "15"))
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+CACHE_SIZE = int(getenv("PASSWORD_CACHE_SIZE", "10000"))
+
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+# Seconds taken by the last key derivations of verify_password
+_verify_seconds = deque(maxlen=64)
+# Passwords are never kept: cache keys are HMACs with a per-process secret
+_secret = os.urandom(32)
+
+
+def _b64(raw: bytes) -> str:
+    """ Unpadded urlsafe base64 of raw
+    """
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    """ Bytes of unpadded urlsafe base64 text
+    """
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _pbkdf2(pwd: bytes, salt: bytes, iterations: int) -> bytes:
+    """ PBKDF2-HMAC-SHA256 of pwd
+    """
+    return hashlib.pbkdf2_hmac("sha256", pwd, salt, iterations)
+
+
+def _scrypt(pwd: bytes, salt: bytes, log_n: int, r: int, p: int) -> bytes:
+    """ scrypt of pwd, with room for its memory cost
+    """
+    return hashlib.scrypt(pwd, salt=salt, n=1 << log_n, r=r, p=p,
+                          maxmem=256 * r * (1 << log_n) + (1 << 20),
+                          dklen=32)
+
+
+def hash_password(pwd: str) -> str:
+    """ Record of pwd in the current scheme, with a new salt
+    """
+    salt = os.urandom(SALT_SIZE)
+    if SCHEME == "scrypt":
+        digest = _scrypt(pwd.encode(), salt, SCRYPT_LOG_N, SCRYPT_R,
+                         SCRYPT_P)
+        return "$scrypt${},{},{}${}${}".format(
+            SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P, _b64(salt), _b64(digest))
+    digest = _pbkdf2(pwd.encode(), salt, PBKDF2_ITERATIONS)
+    return "$pbkdf2-sha256${}${}${}".format(
+        PBKDF2_ITERATIONS, _b64(salt), _b64(digest))
+
+
+def hash_passwords(pwds: List[str], workers: int = None) -> List[str]:
+    """ Records of several passwords, computed by a pool of threads:
+    both key derivations release the GIL
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(pwds) < 2:
+        return [hash_password(pwd) for pwd in pwds]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(hash_password, pwds))
+
+
+def verify_password(pwd: str, stored: str) -> bool:
+    """ True if pwd matches the stored record, compared in constant time
+    """
+    if pwd is None or stored is None:
+        return False
+    if not stored.startswith("$"):
+        legacy = hashlib.sha256(pwd.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored.lower())
+    key = None
+    if CACHE_SIZE > 0:
+        key = hmac.new(_secret, stored.encode() + b"\0" + pwd.encode(),
+                       hashlib.sha256).digest()
+        with _verified_lock:
+            if key in _verified:
+                _verified.move_to_end(key)
+                return True
+    start = time.perf_counter()
+    try:
+        _, scheme, params, salt, digest = stored.split("$")
+        salt, digest = _unb64(salt), _unb64(digest)
+        if scheme == "pbkdf2-sha256":
+            computed = _pbkdf2(pwd.encode(), salt, int(params))
+        elif scheme == "scrypt":
+            log_n, r, p = (int(param) for param in params.split(","))
+            computed = _scrypt(pwd.encode(), salt, log_n, r, p)
+        else:
+            return False
+    except ValueError:
+        return False
+    _verify_seconds.append(time.perf_counter() - start)
+    if not hmac.compare_digest(computed, digest):
+        return False
+    if key is not None:
+        with _verified_lock:
+            _verified[key] = None
+            while len(_verified) > CACHE_SIZE:
+                _verified.popitem(last=False)
+    return True
+
+
+def fake_verify() -> bool:
+    """ False, after about as long as verify_password takes to reject a
+    password, so that unknown users can't be told apart by timing: sleep
+    for one of the last derivation times, or derive a key before any
+    """
+    recent = list(_verify_seconds)
+    if recent:
+        time.sleep(random.choice(recent))
+        return False
+    start = time.perf_counter()
+    hash_password(os.urandom(16).hex())
+    _verify_seconds.append(time.perf_counter() - start)
+    return False
+
+
+def needs_rehash(stored: str) -> bool:
+    """ True if the stored record is not of the current scheme and cost
+    """
+    if stored is None:
+        return False
+    if SCHEME == "scrypt":
+        return not stored.startswith("$scrypt${},{},{}$".format(
+            SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P))
+    return not stored.startswith("$pbkdf2-sha256${}$".format(
+        PBKDF2_ITERATIONS))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+
+The records of a class are the rows (id, seq, record) of the table named
+after it. Every write takes the next seq, indexed, so that a process
+reads only the rows written since it last looked: removed objects stay
+as rows without record until the next checkpoint, or until compact_every
+of them were written by this process, when they are purged. Both bump
+the generation of the class, telling the other processes to load
+everything again.
+"""
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional, Tuple
+from models.json_backend import dumps
+from models.storage import Storage
+
+
+class SQLiteStorage(Storage):
+    """ Records of one class in a table of a SQLite database
+    """
+
+    incremental = True
+
+    def __init__(self, db_path: str, table: str, compact_every: int = 1000):
+        """ Initialize a SQLiteStorage of the table in db_path
+        """
+        super().__init__()
+        self.db_path = db_path
+        self.table = table
+        self.compact_every = compact_every
+        # Rows without record written since the last purge
+        self._removed = 0
+        self._conn = None
+        self._pid = None
+        self._depth = 0
+        # What this process last read or wrote
+        self._generation = None
+        self._seq = 0
+        self._data_version = None
+
+    def load(self) -> dict:
+        """ Return the records of every stored object by id, as JSON text
+        """
+        with self.lock():
+            conn = self._connect()
+            self._data_version = self._version(conn)
+            self._generation = self._generation_of(conn)
+            self._seq = self._last_seq(conn)
+            return dict(conn.execute(
+                'SELECT id, record FROM "{}" WHERE record IS NOT NULL'
+                .format(self.table)))
+
+    def append(self, op: str, obj_id: str, obj_json: dict = None):
+        """ Upsert the record of a saved object, or empty it on "remove"
+        """
+        self.append_many([(op, obj_id, obj_json)])
+
+    def append_many(self, mutations: Iterable[Tuple[str, str, dict]]):
+        """ Upsert several records in one transaction
+        """
+        with self.lock():
+            conn = self._connect()
+            last = self._last_seq(conn)
+            seq = last
+            rows = []
+            for op, obj_id, obj_json in mutations:
+                seq += 1
+                record = dumps(obj_json) if op == "save" else None
+                rows.append((obj_id, seq, record))
+            conn.executemany(
+                'INSERT OR REPLACE INTO "{}" (id, seq, record) '
+                'VALUES (?, ?, ?)'.format(self.table), rows)
+            caught_up = last == self._seq and \
+                self._generation == self._generation_of(conn)
+            if caught_up:
+                self._seq = seq
+            self._removed += sum(1 for row in rows if row[2] is None)
+            if self.compact_every > 0 and \
+                    self._removed >= self.compact_every:
+                self._purge(conn, caught_up)
+
+    def _purge(self, conn: sqlite3.Connection, caught_up: bool):
+        """ Delete the rows without record, under the lock: the other
+        processes may not have read them, so they load everything again
+        """
+        conn.execute('DELETE FROM "{}" WHERE record IS NULL'
+                     .format(self.table))
+        generation = self._generation_of(conn) + 1
+        conn.execute('INSERT OR REPLACE INTO generations '
+                     '(name, generation) VALUES (?, ?)',
+                     (self.table, generation))
+        if caught_up:
+            # Nothing was missed: no need to load again here
+            self._generation = generation
+            self._seq = self._last_seq(conn)
+        self._removed = 0
+
+    def checkpoint(self, objs_json: Callable[[], dict]):
+        """ Replace the table with objs_json()
+        """
+        with self.lock():
+            conn = self._connect()
+            conn.execute('DELETE FROM "{}"'.format(self.table))
+            conn.executemany(
+                'INSERT INTO "{}" (id, seq, record) VALUES (?, 0, ?)'
+                .format(self.table),
+                ((obj_id, obj_json if type(obj_json) is str
+                  else dumps(obj_json))
+                 for obj_id, obj_json in objs_json().items()))
+            self._generation = self._generation_of(conn) + 1
+            conn.execute('INSERT OR REPLACE INTO generations '
+                         '(name, generation) VALUES (?, ?)',
+                         (self.table, self._generation))
+            self._seq = 0
+            self._removed = 0
+
+    @contextmanager
+    def lock(self):
+        """ Hold a write transaction: mutations made under the lock are
+        committed together, or rolled back if an exception leaves it
+        """
+        with self._lock:
+            conn = self._connect()
+            if self._depth == 0:
+                conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                conn.execute("COMMIT")
+
+    def changed(self) -> bool:
+        """ True if another connection committed since this process last
+        read the database
+        """
+        with self._lock:
+            return self._version(self._connect()) != self._data_version
+
+    def changes(self) -> Optional[list]:
+        """ The rows written by other processes, None after a checkpoint
+        """
+        conn = self._connect()
+        version = self._version(conn)
+        if self._generation_of(conn) != self._generation:
+            return None
+        changes = []
+        for obj_id, seq, record in conn.execute(
+                'SELECT id, seq, record FROM "{}" WHERE seq > ? '
+                'ORDER BY seq'.format(self.table), (self._seq,)):
+            if record is None:
+                changes.append(("remove", obj_id, None))
+            else:
+                changes.append(("save", obj_id, json.loads(record)))
+            self._seq = seq
+        self._data_version = version
+        return changes
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Connection of this process, the table created if needed
+        """
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        # A connection must not be used across a fork
+        self._depth = 0
+        conn = sqlite3.connect(self.db_path, timeout=30,
+                               isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute('CREATE TABLE IF NOT EXISTS "{}" (id TEXT PRIMARY KEY, '
+                     'seq INTEGER NOT NULL, record TEXT)'.format(self.table))
+        conn.execute('CREATE INDEX IF NOT EXISTS "{0}_seq" ON "{0}" (seq)'
+                     .format(self.table))
+        conn.execute('CREATE TABLE IF NOT EXISTS generations '
+                     '(name TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def _generation_of(self, conn: sqlite3.Connection) -> int:
+        """ Number of checkpoints of the table
+        """
+        row = conn.execute('SELECT generation FROM generations '
+                           'WHERE name = ?', (self.table,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _last_seq(self, conn: sqlite3.Connection) -> int:
+        """ seq of the last written row
+        """
+        return conn.execute('SELECT MAX(seq) FROM "{}"'
+                            .format(self.table)).fetchone()[0] or 0
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection) -> int:
+        """ Changes whenever another connection commits
+        """
+        return conn.execute("PRAGMA data_version").fetchone()[0]
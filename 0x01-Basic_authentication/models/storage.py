@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+""" Storage module
+
+A Storage persists the objects of one class as their JSON records and
+tells whether another process changed them since they were last read.
+`Base` holds a Storage per class, see `Base.use_storage`:
+- "json": models.journal, a snapshot file and a mutation log
+- "sqlite": models.sqlite_storage, a table of a SQLite database
+- "memory": MemoryStorage, nothing is persisted
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+class Storage():
+    """ Storage of one class, the objects only live in this process
+    """
+
+    # True: save() and remove() append one mutation, False: they
+    # checkpoint every object
+    incremental = False
+
+    def __init__(self):
+        """ Initialize a Storage
+        """
+        self._lock = threading.RLock()
+
+    def load(self) -> dict:
+        """ Return the records of every stored object by id
+        """
+        return {}
+
+    def append(self, op: str, obj_id: str, obj_json: dict = None):
+        """ Persist one mutation: "save" with the serialized object
+        or "remove"
+        """
+        pass
+
+    def append_many(self, mutations: Iterable[Tuple[str, str, dict]]):
+        """ Persist several (op, id, record) mutations at once
+        """
+        for op, obj_id, obj_json in mutations:
+            self.append(op, obj_id, obj_json)
+
+    def checkpoint(self, objs_json: Callable[[], dict]):
+        """ Replace the stored objects with objs_json()
+        """
+        pass
+
+    @contextmanager
+    def lock(self):
+        """ Hold the store exclusively, reentrant: mutations read then
+        write it under this lock
+        """
+        with self._lock:
+            yield
+
+    def changed(self) -> bool:
+        """ Cheap check: True if the store may have been changed by
+        someone else since this process last read or wrote it
+        """
+        return False
+
+    def changes(self) -> Optional[List[Tuple[str, str, dict]]]:
+        """ The (op, id, record) mutations made by someone else since
+        this process last read or wrote the store, None when they are
+        not known and everything must be loaded again
+
+        Called under lock().
+        """
+        return []
+
+
+class MemoryStorage(Storage):
+    """ Storage of tests and benchmarks: DATA is the only copy of the
+    objects, loading returns none of them
+    """
+
+    incremental = True
+
+    def append_many(self, mutations: Iterable[Tuple[str, str, dict]]):
+        """ Nothing to persist, the mutations are not even built
+        """
+        pass
@@ -10,8 +10,11 @@ my_db = DB()
 
 user_1 = my_db.add_user("test@test.com", "SuperHashedPwd")
 print(user_1.id)
-user_1 = my_db.add_user("test@test.com", "SuperHashedPwd")
-print(user_1.id)
+try:
+    user_1 = my_db.add_user("test@test.com", "SuperHashedPwd")
+    print(user_1.id)
+except ValueError as err:
+    print(err)
 
 user_2 = my_db.add_user("test1@test.com", "SuperHashedPwd1")
 print(user_2.id)
@@ -7,10 +7,67 @@ make it more secure.
 """
 from flask import Flask, jsonify,\
     request, abort, make_response, redirect, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os
 from auth import Auth
+from hashing import HasherBusy
+from rate_limit import RateLimited
 
 AUTH = Auth()
 app = Flask(__name__)
+# Behind TRUSTED_PROXIES reverse proxies, the client IP of the login
+# rate limits is the one they add to X-Forwarded-For
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+if os.getenv("METRICS") == "1":
+    import metrics
+    metrics.init_app(app)
+
+
+@app.teardown_appcontext
+def release_db_session(exception=None) -> None:
+    """
+    Gives the database session of the request back to the pool
+    so that requests served by other threads never share it
+    """
+    AUTH.release_db_session()
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error: HasherBusy):
+    """
+    Too many passwords are being hashed: the client should retry later
+    :return: json dictionary
+    :rtype: dict
+    """
+    data = {"message": "service busy, retry later"}
+    resp = make_response(jsonify(data), 503)
+    resp.headers['Retry-After'] = str(error.retry_after)
+    return resp
+
+
+@app.errorhandler(RateLimited)
+def rate_limited(error: RateLimited):
+    """
+    Too many login attempts from the client IP or for the email
+    :return: json dictionary
+    :rtype: dict
+    """
+    data = {"message": "too many login attempts, retry later"}
+    resp = make_response(jsonify(data), 429)
+    resp.headers['Retry-After'] = str(error.retry_after)
+    return resp
+
+
+@app.route('/metrics/hasher', methods=['GET'])
+def hasher_metrics():
+    """
+    Counters of the password hashing pool
+    :return: json dictionary
+    :rtype: dict
+    """
+    return jsonify(AUTH.hasher_metrics())
 
 
 @app.route('/')
@@ -76,6 +133,8 @@ def login():
         abort(400, 'Missing email')
     if password is None:
         abort(400, 'Missing password')
+    # Refused before any bcrypt check when over the limits
+    AUTH.limit_login(email, request.remote_addr)
     try:
         # check that authentication is valid
         if AUTH.valid_login(email, password):
@@ -84,6 +143,8 @@ def login():
         else:
             # Failed to Authenticate
             abort(401)
+    except HasherBusy:
+        raise
     except BaseException as e:
         abort(401)
         # print("could not create a new user: {}".format(err))
@@ -219,6 +280,8 @@ def update_password():
         AUTH.update_password(
             reset_token=reset_token, password=new_password)
         data = {"email": f"{email}", "message": "Password updated"}
+    except HasherBusy:
+        raise
     except Exception as e:
         # reset token not found
         abort(403)
@@ -228,4 +291,4 @@ def update_password():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port="5000")
+    app.run(host="0.0.0.0", port="5000", threaded=True)
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+ASGI variant of app.py: the same routes served by one asyncio event
+loop, which can hold thousands of idle keep-alive connections in a
+single process. The database and bcrypt run off the loop, see
+AsyncAuth. GET /metrics is not served: metrics.py times Flask requests
+only, /metrics/hasher is.
+
+Run it with any ASGI server:
+uvicorn asgi_app:app --port 5000
+or with the small HTTP/1.1 server of this module:
+python3 asgi_app.py
+"""
+import asyncio
+import json
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+from os import getenv
+from typing import Callable, Tuple
+from urllib.parse import parse_qs
+
+from async_auth import AsyncAuth
+from hashing import HasherBusy
+from rate_limit import RateLimited
+
+AUTH = AsyncAuth()
+MAX_BODY = 1 << 20
+# Reverse proxies in front of the app, see app.TRUSTED_PROXIES
+TRUSTED_PROXIES = int(getenv("TRUSTED_PROXIES", "0"))
+
+
+class Request:
+    """
+    Incoming HTTP request: method, path, headers, form, cookies and
+    client IP
+    """
+
+    def __init__(self, scope: dict, body: bytes) -> None:
+        """Initialize from the ASGI scope and the full body"""
+        self.method = scope["method"]
+        self.path = scope["path"]
+        client = scope.get("client")
+        self.client_ip = client[0] if client else None
+        if TRUSTED_PROXIES > 0:
+            # The address added by the first trusted proxy, as ProxyFix
+            forwarded = [ip.strip() for name, value in scope["headers"]
+                         if name == b"x-forwarded-for"
+                         for ip in value.decode('latin-1').split(",")]
+            if len(forwarded) >= TRUSTED_PROXIES:
+                self.client_ip = forwarded[-TRUSTED_PROXIES]
+        self.headers = {name.decode('latin-1'): value.decode('latin-1')
+                        for name, value in scope["headers"]}
+        self.form = {}
+        if self.headers.get("content-type", "").startswith(
+                "application/x-www-form-urlencoded"):
+            fields = parse_qs(body.decode('utf-8', 'replace'))
+            self.form = {key: values[0] for key, values in fields.items()}
+        self.cookies = {}
+        if "cookie" in self.headers:
+            cookie = SimpleCookie()
+            cookie.load(self.headers["cookie"])
+            self.cookies = {key: morsel.value
+                            for key, morsel in cookie.items()}
+
+
+class Response:
+    """
+    Outgoing HTTP response
+    """
+
+    def __init__(self, status: int, body: bytes = b"",
+                 content_type: str = "application/json",
+                 headers: list = None) -> None:
+        """Initialize a response"""
+        self.status = status
+        self.body = body
+        self.headers = [("content-type", content_type)]
+        self.headers.extend(headers or [])
+
+
+def json_response(data: dict, status: int = 200,
+                  headers: list = None) -> Response:
+    """
+    JSON response of data
+    """
+    return Response(status, json.dumps(data).encode('utf-8'),
+                    headers=headers)
+
+
+def error(status: int, description: str = None) -> Response:
+    """
+    Plain text error response, like Flask's abort
+    """
+    phrase = HTTPStatus(status).phrase
+    body = "{} {}\n{}\n".format(status, phrase, description or "")
+    return Response(status, body.encode('utf-8'), "text/plain")
+
+
+async def index(request: Request) -> Response:
+    """
+    GET /
+    """
+    return json_response({"message": "Bienvenue"})
+
+
+async def add_user(request: Request) -> Response:
+    """
+    POST /users, see app.add_user
+    """
+    email = request.form.get('email')
+    password = request.form.get('password')
+    if email is None:
+        return error(400, 'Missing email')
+    if password is None:
+        return error(400, 'Missing password')
+    try:
+        await AUTH.register_user(email, password)
+    except ValueError:
+        return json_response({"message": "email already registered"}, 400)
+    return json_response({"email": email, "message": "user created"})
+
+
+async def login(request: Request) -> Response:
+    """
+    POST /sessions, see app.login
+    """
+    email = request.form.get('email')
+    password = request.form.get('password')
+    if email is None:
+        return error(400, 'Missing email')
+    if password is None:
+        return error(400, 'Missing password')
+    AUTH.limit_login(email, request.client_ip)
+    try:
+        if not await AUTH.valid_login(email, password):
+            return error(401)
+        session_id = await AUTH.create_session(email)
+    except ValueError:
+        # e.g. a malformed stored hash, refused as app.login does
+        return error(401)
+    if not session_id:
+        return error(401)
+    return json_response({"email": email, "message": "logged in"},
+                         headers=[("set-cookie",
+                                   f"session_id={session_id}; Path=/")])
+
+
+async def logout(request: Request) -> Response:
+    """
+    DELETE /sessions, see app.logout
+    """
+    session_id = request.cookies.get('session_id')
+    user = await AUTH.get_user_from_session_id(session_id)
+    if user is None:
+        return error(403)
+    await AUTH.destroy_session(user.id)
+    return Response(302, content_type="text/plain",
+                    headers=[("location", "/")])
+
+
+async def profile(request: Request) -> Response:
+    """
+    GET /profile, see app.profile
+    """
+    session_id = request.cookies.get('session_id')
+    if session_id is None:
+        return error(400, 'Missing session_id')
+    user = await AUTH.get_user_from_session_id(session_id)
+    if user is None:
+        return error(403)
+    return json_response({"email": user.email})
+
+
+async def reset_password(request: Request) -> Response:
+    """
+    POST /reset_password, see app.reset_password
+    """
+    email = request.form.get('email')
+    if email is None:
+        return error(400, 'Missing email')
+    data = {}
+    if await AUTH.create_session(email):
+        reset_token = await AUTH.get_reset_password_token(email)
+        data = {"email": email, "reset_token": reset_token}
+    return json_response(data)
+
+
+async def update_password(request: Request) -> Response:
+    """
+    PUT /reset_password, see app.update_password
+    """
+    email = request.form.get('email')
+    reset_token = request.form.get('reset_token')
+    new_password = request.form.get('new_password')
+    if email is None:
+        return error(400, 'Missing email')
+    if reset_token is None:
+        return error(400, 'Missing reset_token')
+    if new_password is None:
+        return error(400, 'Missing new_password')
+    try:
+        await AUTH.update_password(reset_token, new_password)
+    except ValueError:
+        return error(403)
+    return json_response({"email": email, "message": "Password updated"})
+
+
+async def hasher_metrics(request: Request) -> Response:
+    """
+    GET /metrics/hasher
+    """
+    return json_response(AUTH.hasher_metrics())
+
+
+ROUTES = {
+    "/": {"GET": index},
+    "/users": {"POST": add_user},
+    "/sessions": {"POST": login, "DELETE": logout},
+    "/profile": {"GET": profile},
+    "/reset_password": {"POST": reset_password, "PUT": update_password},
+    "/metrics/hasher": {"GET": hasher_metrics},
+}
+
+
+async def dispatch(request: Request) -> Response:
+    """
+    Routes a request to its view
+    """
+    methods = ROUTES.get(request.path)
+    if methods is None:
+        return error(404)
+    view = methods.get(request.method)
+    if view is None:
+        return error(405)
+    try:
+        return await view(request)
+    except HasherBusy as busy:
+        return json_response({"message": "service busy, retry later"}, 503,
+                             [("retry-after", str(busy.retry_after))])
+    except RateLimited as limited:
+        return json_response(
+            {"message": "too many login attempts, retry later"}, 429,
+            [("retry-after", str(limited.retry_after))])
+
+
+async def app(scope: dict, receive: Callable, send: Callable) -> None:
+    """
+    ASGI application
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(body) > MAX_BODY:
+            response = error(413)
+            break
+    else:
+        response = await dispatch(Request(scope, body))
+    headers = [(name.encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers]
+    headers.append((b"content-length", str(len(response.body)).encode()))
+    await send({"type": "http.response.start", "status": response.status,
+                "headers": headers})
+    await send({"type": "http.response.body", "body": response.body})
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple:
+    """
+    Reads the head of an HTTP/1.x request
+    :return: (method, target, version, headers) or None at end of stream
+    :rtype: tuple
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode('latin-1').split("\r\n")
+    method, target, version = lines[0].split(" ", 2)
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, value = line.split(":", 1)
+            headers.append((name.strip().lower().encode('latin-1'),
+                            value.strip().encode('latin-1')))
+    return method, target, version, headers
+
+
+async def _handle_connection(reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter,
+                             keep_alive_timeout: float) -> None:
+    """
+    Serves the requests of one connection until it is closed
+    """
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(_read_request(reader),
+                                                 keep_alive_timeout)
+            except (asyncio.TimeoutError, asyncio.LimitOverrunError,
+                    ValueError):
+                return
+            if request is None:
+                return
+            method, target, version, headers = request
+            fields = dict(headers)
+            if b"transfer-encoding" in fields:
+                writer.write(b"HTTP/1.1 411 Length Required\r\n"
+                             b"content-length: 0\r\n\r\n")
+                return
+            length = fields.get(b"content-length", b"0").strip()
+            if not length.isdigit():
+                writer.write(b"HTTP/1.1 400 Bad Request\r\n"
+                             b"content-length: 0\r\n\r\n")
+                return
+            length = int(length)
+            if length > MAX_BODY:
+                writer.write(b"HTTP/1.1 413 Payload Too Large\r\n"
+                             b"content-length: 0\r\n\r\n")
+                return
+            body = await reader.readexactly(length) if length else b""
+            path, _, query = target.partition("?")
+            connection = fields.get(b"connection", b"").lower()
+            keep_alive = (version == "HTTP/1.1" and connection != b"close") \
+                or connection == b"keep-alive"
+            scope = {"type": "http", "asgi": {"version": "3.0"},
+                     "http_version": version[5:], "method": method,
+                     "scheme": "http", "path": path,
+                     "raw_path": path.encode('latin-1'),
+                     "query_string": query.encode('latin-1'),
+                     "headers": headers,
+                     "client": writer.get_extra_info("peername"),
+                     "server": writer.get_extra_info("sockname")}
+            received = False
+
+            async def receive() -> dict:
+                nonlocal received
+                if not received:
+                    received = True
+                    return {"type": "http.request", "body": body,
+                            "more_body": False}
+                await asyncio.Event().wait()
+
+            async def send(message: dict) -> None:
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    lines = ["HTTP/1.1 {} {}".format(
+                        status, HTTPStatus(status).phrase)]
+                    for name, value in message["headers"]:
+                        lines.append("{}: {}".format(name.decode('latin-1'),
+                                                     value.decode('latin-1')))
+                    if not keep_alive:
+                        lines.append("connection: close")
+                    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode(
+                        'latin-1'))
+                elif message["type"] == "http.response.body":
+                    writer.write(message.get("body", b""))
+
+            await app(scope, receive, send)
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.IncompleteReadError):
+        return
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, keep_alive_timeout: float = 75,
+                ready: Callable = None) -> None:
+    """
+    Serves app over HTTP/1.1 with keep-alive, forever
+    :param ready: called with the bound port once listening
+    """
+    server = await asyncio.start_server(
+        lambda r, w: _handle_connection(r, w, keep_alive_timeout),
+        host, port, backlog=4096)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(getenv("API_HOST", "0.0.0.0"),
+                      int(getenv("API_PORT", "5000"))))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Asyncio mirror of the Auth module: the same operations as coroutines,
+with the database behind AsyncDB and bcrypt on the hashing pool, so
+that neither blocks the event loop.
+"""
+import asyncio
+import os
+import time
+
+from sqlalchemy.exc import NoResultFound
+
+from async_db import AsyncDB
+from auth import _generate_uuid
+from hashing import bcrypt_check, bcrypt_hash, hasher_from_env
+from negative_cache import negative_cache_from_env
+from rate_limit import login_limiter_from_env
+from session_store import session_store_from_env
+from session_token import session_tokens_from_env
+from user import User
+
+
+class AsyncAuth:
+    """AsyncAuth class: see Auth for the semantics of each method
+    """
+
+    def __init__(self):
+        """Initialize AsyncAuth class"""
+        self._db = AsyncDB()
+        self._sessions = session_store_from_env()
+        self._tokens = session_tokens_from_env()
+        self._hasher = hasher_from_env()
+        self._limiter = login_limiter_from_env()
+        self._unknown = negative_cache_from_env()
+
+    def hasher_metrics(self) -> dict:
+        """
+        Counters of the password hashing pool
+        """
+        return self._hasher.metrics()
+
+    async def _hash(self, password: str) -> str:
+        """
+        bcrypt hash of password, computed on the hashing pool
+        :raises HasherBusy: too many hashes pending
+        """
+        future = self._hasher.submit(bcrypt_hash, password.encode('utf-8'))
+        hashed_password = await asyncio.wrap_future(future)
+        return hashed_password.decode('utf-8')
+
+    async def _check(self, password: str, hashed_password: str) -> bool:
+        """
+        Checks password on the hashing pool
+        :raises HasherBusy: too many hashes pending
+        """
+        start = time.perf_counter()
+        future = self._hasher.submit(bcrypt_check, password.encode('utf-8'),
+                                     hashed_password.encode('utf-8'))
+        matched = await asyncio.wrap_future(future)
+        self._hasher.record_check(time.perf_counter() - start)
+        return matched
+
+    async def _fake_check(self) -> bool:
+        """
+        See PasswordHasher.fake_check, waiting without blocking the loop
+        :raises HasherBusy: too many hashes pending
+        """
+        delay = self._hasher.check_delay()
+        if delay is not None:
+            await asyncio.sleep(delay)
+            return False
+        start = time.perf_counter()
+        await self._hash(os.urandom(16).hex())
+        self._hasher.record_check(time.perf_counter() - start)
+        return False
+
+    async def register_user(self, email: str, password: str) -> User:
+        """
+        See Auth.register_user
+        """
+        try:
+            await self._db.find_user_by(email=email)
+        except NoResultFound:
+            hashed_password = await self._hash(password)
+            user = await self._db.add_user(email, hashed_password)
+            self._unknown.discard(email)
+            return user
+        raise ValueError(f"User {email} already exists")
+
+    def limit_login(self, email: str, ip: str = None) -> None:
+        """
+        See Auth.limit_login
+        """
+        self._limiter.check(email, ip)
+
+    async def valid_login(self, email: str, password: str) -> bool:
+        """
+        See Auth.valid_login
+        """
+        if email in self._unknown:
+            return await self._fake_check()
+        try:
+            user = await self._db.find_user_by(email=email)
+        except NoResultFound:
+            self._unknown.add(email)
+            return await self._fake_check()
+        return await self._check(password, user.hashed_password)
+
+    async def create_session(self, email: str) -> str:
+        """
+        See Auth.create_session
+        """
+        if self._tokens is not None:
+            try:
+                user = await self._db.find_user_by(email=email)
+            except NoResultFound:
+                return None
+            return self._tokens.issue(user.id, email)
+        session_id = _generate_uuid()
+        try:
+            user_id = await self._db.update_user_where(
+                {"email": email}, session_id=session_id)
+        except (NoResultFound, ValueError):
+            return None
+        self._sessions.set(session_id, user_id, email)
+        return session_id
+
+    async def get_user_from_session_id(self, session_id: str) -> User:
+        """
+        See Auth.get_user_from_session_id
+        """
+        if not session_id:
+            return None
+        if self._tokens is not None:
+            claims = self._tokens.verify(session_id)
+            if claims is None:
+                return None
+            user_id, email = claims
+            return User(id=user_id, email=email, session_id=session_id)
+        cached = self._sessions.get(session_id)
+        if cached is not None:
+            user_id, email = cached
+            return User(id=user_id, email=email, session_id=session_id)
+        try:
+            user = await self._db.find_user_by(session_id=session_id)
+        except NoResultFound:
+            return None
+        self._sessions.set(session_id, user.id, user.email)
+        return user
+
+    async def destroy_session(self, user_id: int) -> None:
+        """
+        See Auth.destroy_session
+        """
+        if self._tokens is not None:
+            self._tokens.revoke(user_id)
+            return None
+        try:
+            await self._db.update_user(user_id, session_id=None)
+        except (NoResultFound, ValueError):
+            return None
+        self._sessions.delete_user(user_id)
+        return None
+
+    async def get_reset_password_token(self, email: str) -> str:
+        """
+        See Auth.get_reset_password_token
+        """
+        reset_token = _generate_uuid()
+        try:
+            await self._db.update_user_where(
+                {"email": email}, reset_token=reset_token)
+        except NoResultFound:
+            raise ValueError(f"User {email} does not exist")
+        return reset_token
+
+    async def update_password(self, reset_token: str, password: str) -> None:
+        """
+        See Auth.update_password
+        """
+        if not reset_token or not password:
+            return None
+        try:
+            user_id = await self._db.update_user_where(
+                {"reset_token": reset_token})
+            hashed_password = await self._hash(password)
+            await self._db.update_user_where(
+                {"id": user_id, "reset_token": reset_token},
+                hashed_password=hashed_password, reset_token=None)
+        except NoResultFound:
+            raise ValueError("reset_token not found")
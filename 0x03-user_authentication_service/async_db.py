@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Async DB module
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from db import DB
+from user import User
+
+
+class AsyncDB:
+    """AsyncDB class: asyncio mirror of DB
+
+    Every call runs on a small pool of threads dedicated to the
+    database, each with its own session closed after the call, so the
+    event loop never blocks on SQLite.
+    """
+
+    def __init__(self, db: DB = None, workers: int = 4) -> None:
+        """Initialize a new AsyncDB instance
+        """
+        self._db = DB() if db is None else db
+        self._executor = ThreadPoolExecutor(workers,
+                                            thread_name_prefix="db")
+
+    async def _run(self, method: Callable, *args, **kwargs):
+        """
+        Runs a DB method on the database threads
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self._call, method, *args, **kwargs))
+
+    def _call(self, method: Callable, *args, **kwargs):
+        """
+        Calls method then releases the session of the thread
+        """
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._db.remove_session()
+
+    async def add_user(self, email: str, hashed_password: str) -> User:
+        """
+        See DB.add_user
+        """
+        return await self._run(self._db.add_user, email, hashed_password)
+
+    async def find_user_by(self, **kwargs) -> User:
+        """
+        See DB.find_user_by
+        """
+        return await self._run(self._db.find_user_by, **kwargs)
+
+    async def update_user(self, user_id: int, **kwargs) -> None:
+        """
+        See DB.update_user
+        """
+        return await self._run(self._db.update_user, user_id, **kwargs)
+
+    async def update_user_where(self, criteria: dict, **kwargs) -> int:
+        """
+        See DB.update_user_where
+        """
+        return await self._run(self._db.update_user_where, criteria,
+                               **kwargs)
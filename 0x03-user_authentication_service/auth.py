@@ -9,9 +9,16 @@ requires bcrypt installed with :
 pip install bcrypt
 """
 import uuid
+from collections import deque
+from typing import Iterable, List, Tuple
 import bcrypt
 from sqlalchemy.exc import NoResultFound
 from db import DB
+from hashing import HasherBusy, bcrypt_hash, hasher_from_env
+from negative_cache import negative_cache_from_env
+from rate_limit import login_limiter_from_env
+from session_store import session_store_from_env
+from session_token import session_tokens_from_env
 from user import User
 
 
@@ -44,6 +51,31 @@ class Auth:
     def __init__(self):
         """Initialize Auth class"""
         self._db = DB()
+        self._sessions = session_store_from_env()
+        # Signed session tokens instead of session_id, see session_token.py
+        self._tokens = session_tokens_from_env()
+        # bcrypt runs on this bounded pool, see hashing.py
+        self._hasher = hasher_from_env()
+        # Login attempts per IP and email, see rate_limit.py
+        self._limiter = login_limiter_from_env()
+        # Emails valid_login did not find, see negative_cache.py
+        self._unknown = negative_cache_from_env()
+
+    def hasher_metrics(self) -> dict:
+        """
+        Counters of the password hashing pool
+        :return: see PasswordHasher.metrics
+        :rtype: dict
+        """
+        return self._hasher.metrics()
+
+    def release_db_session(self) -> None:
+        """
+        Ends the database session of the current thread/request
+        :return: Nothing
+        :rtype: None
+        """
+        self._db.remove_session()
 
     def register_user(self, email: str, password: str) -> User:
         """
@@ -63,20 +95,117 @@ class Auth:
         except NoResultFound as e:
             # Clear to register a new User
             # hash their password
-            hashed_pwd = _hash_password(password)
+            hashed_pwd = self._hasher.hash(password)
             # print(type(hashed_pwd))
             string_hashed_password = hashed_pwd.decode('utf-8')
             # print(type(string_hashed_password))
             new_user = self._db.add_user(email, string_hashed_password)
+            self._unknown.discard(email)
             return new_user
         else:
             # Reject User Creation as perhaps user already exists or
             # other exception occurred.
             raise ValueError(f"User {email} already exists")
 
+    def register_users(self, users: Iterable[Tuple[str, str]],
+                       batch_size: int = 500) -> List[Tuple[int, str]]:
+        """
+        Creates many Users: registered emails are looked up once per
+        batch, passwords are hashed in parallel on the hashing pool and
+        each batch is inserted in a single transaction
+        :param users: (email, password) pairs
+        :type users: iterable
+        :param batch_size: users per transaction
+        :type batch_size: integer
+        :return: (position in users, email) of the users not created
+         because their email is already registered
+        :rtype: list
+        :raises HasherBusy: the hashing pool is saturated by other requests
+        """
+        rejected = []
+        batch = []
+        for position, (email, password) in enumerate(users):
+            batch.append((position, email, password))
+            if len(batch) >= batch_size:
+                rejected.extend(self._register_batch(batch))
+                batch = []
+        if len(batch) > 0:
+            rejected.extend(self._register_batch(batch))
+        return rejected
+
+    def _register_batch(self, batch: list) -> List[Tuple[int, str]]:
+        """
+        See register_users
+        :param batch: (position, email, password) triples
+        :type batch: list
+        :return: (position, email) of the rejected users
+        :rtype: list
+        """
+        registered = self._db.registered_emails(
+            email for _, email, _ in batch)
+        rejected = []
+        accepted = []
+        for position, email, password in batch:
+            if email in registered:
+                rejected.append((position, email))
+            else:
+                registered.add(email)
+                accepted.append((position, email, password))
+        hashes = self._hash_all([password for _, _, password in accepted])
+        positions = {email: position for position, email, _ in accepted}
+        duplicates = self._db.add_users(
+            [(email, hashed_password.decode('utf-8'))
+             for (_, email, _), hashed_password in zip(accepted, hashes)])
+        rejected.extend((positions[email], email) for email in duplicates)
+        for _, email, _ in accepted:
+            self._unknown.discard(email)
+        return rejected
+
+    def _hash_all(self, passwords: List[str]) -> List[bytes]:
+        """
+        Hashes passwords on the hashing pool, keeping at most one
+        hash per worker in flight
+        :param passwords: plain passwords
+        :type passwords: list
+        :return: hashes, in the same order
+        :rtype: list
+        :raises HasherBusy: the pool is full and none of ours is pending
+        """
+        hashes = []
+        pending = deque()
+        for password in passwords:
+            if len(pending) >= self._hasher.workers:
+                hashes.append(pending.popleft().result())
+            while True:
+                try:
+                    pending.append(self._hasher.submit(
+                        bcrypt_hash, password.encode('utf-8')))
+                    break
+                except HasherBusy:
+                    if len(pending) == 0:
+                        raise
+                    hashes.append(pending.popleft().result())
+        hashes.extend(future.result() for future in pending)
+        return hashes
+
+    def limit_login(self, email: str, ip: str = None) -> None:
+        """
+        Counts a login attempt against the limits of ip and email,
+        to be called before valid_login checks the password
+        :param email: username
+        :type email: string
+        :param ip: client IP, if known
+        :type ip: string
+        :raises RateLimited: too many attempts, retry later
+        """
+        self._limiter.check(email, ip)
+
     def valid_login(self, email: str, password: str) -> bool:
         """
         Verifies for Correct Password for auth
+        Emails recently found unknown are refused without a query, and
+        unknown emails take as long as a wrong password, see
+        PasswordHasher.fake_check
         :param email: username
         :type email: string
         :param password: hashed password
@@ -85,6 +214,8 @@ class Auth:
         :rtype: bool
         """
         retval = False
+        if email in self._unknown:
+            return self._hasher.fake_check()
         # Find User Using email
         try:
             # Raises ``sqlalchemy.orm.exc.NoResultFound`` if the query selects
@@ -92,16 +223,14 @@ class Auth:
             result = self._db.find_user_by(email=email)
         except NoResultFound as e:
             # User not found
-            return retval
+            self._unknown.add(email)
+            return self._hasher.fake_check()
         else:
             # User Found, Verify that password matches
             stored_hashed_password = result.hashed_password
             # print(type(stored_hashed_password))
-            hashed_password_as_bytes = stored_hashed_password.encode('utf-8')
-            # print(type(hashed_password_as_bytes))
-            comp_result = bcrypt.checkpw(
-                password.encode('utf-8'),
-                hashed_password_as_bytes)
+            comp_result = self._hasher.check(
+                password, stored_hashed_password)
             # print("Comparison Result ", comp_result)
             if comp_result:
                 retval = True
@@ -115,34 +244,38 @@ class Auth:
         """
         creates a uniquely generated session string then
          updates user's object instance
+        In token mode, issues a signed token instead, only reading the
+         user's id
 
         :param email: user's login email
         :type email: string
         :return: generated session_id
         :rtype: string
         """
-        session_id = None
-        # Find User Using email
-        try:
-            # Raises ``sqlalchemy.orm.exc.NoResultFound`` if the query selects
-            #         no rows.
-            result = self._db.find_user_by(email=email)
-        except NoResultFound as e:
-            # User not found
-            return session_id
-        else:
-            # User Found, Generate user's session ID
-            # Update User's session_id
+        if self._tokens is not None:
             try:
-                session_id = _generate_uuid()
-                self._db.update_user(result.id, session_id=session_id)
-            except ValueError as e:
+                user = self._db.find_user_by(email=email)
+            except NoResultFound:
                 return None
+            return self._tokens.issue(user.id, email)
+        # Store the new session_id of the user found by email
+        session_id = _generate_uuid()
+        try:
+            user_id = self._db.update_user_where(
+                {"email": email}, session_id=session_id)
+        except (NoResultFound, ValueError) as e:
+            # User not found
+            return None
+        # Replaces the previous session of the user in the store
+        self._sessions.set(session_id, user_id, email)
         return session_id
 
     def get_user_from_session_id(self, session_id):
         """
         Gets User Object
+        Sessions known to the session store, and signed tokens in token
+        mode, are answered without querying the database, with a User
+        holding only id, email and session_id.
         :param session_id:
         :type session_id:
         :return:
@@ -153,6 +286,18 @@ class Auth:
             # Handle case when session_id is None
             return retval
 
+        if self._tokens is not None:
+            claims = self._tokens.verify(session_id)
+            if claims is None:
+                return retval
+            user_id, email = claims
+            return User(id=user_id, email=email, session_id=session_id)
+
+        cached = self._sessions.get(session_id)
+        if cached is not None:
+            user_id, email = cached
+            return User(id=user_id, email=email, session_id=session_id)
+
         try:
             # Raises ``sqlalchemy.orm.exc.NoResultFound`` if the query selects
             #         no rows.
@@ -162,33 +307,29 @@ class Auth:
             return retval
         else:
             # User Found, Return User Object
+            self._sessions.set(session_id, result.id, result.email)
             return result
 
     def destroy_session(self, user_id: int) -> None:
         """
         Updates the session_id field of User object by setting it to None
+        In token mode, revokes the tokens issued to the user so far
         :param user_id: User_id
         :type user_id: integer
         :return: Nothing
         :rtype: None
         """
         session_id = None
-        # Find User Using email
+        if self._tokens is not None:
+            self._tokens.revoke(user_id)
+            return session_id
+        # Update User's session_id to None
         try:
-            # Raises ``sqlalchemy.orm.exc.NoResultFound`` if the query selects
-            #         no rows.
-            result = self._db.find_user_by(id=user_id)
-        except NoResultFound as e:
+            self._db.update_user(user_id, session_id=session_id)
+        except (NoResultFound, ValueError) as e:
             # User not found
-            # raise NoResultFound
             return session_id
-        else:
-            # User Found,
-            # Update User's session_id to None
-            try:
-                self._db.update_user(result.id, session_id=session_id)
-            except ValueError as e:
-                return session_id
+        self._sessions.delete_user(user_id)
         return session_id
 
     def get_reset_password_token(self, email: str) -> str:
@@ -201,22 +342,14 @@ class Auth:
         :return: generated token
         :rtype: string
         """
-        # raise ValueError if user's email already exists
-        reset_token_uuid = ""
+        reset_token_uuid = _generate_uuid()
         try:
-            # Raises ``sqlalchemy.orm.exc.NoResultFound`` if the query selects
-            #         no rows.
-            result = self._db.find_user_by(email=email)
+            # Update the User's reset_token
+            self._db.update_user_where(
+                {"email": email}, reset_token=reset_token_uuid)
         except NoResultFound as e:
             # User Does not Exist Raise a Value Error
             raise ValueError(f"User {email} does not exist")
-        else:
-            # No error Reported.
-            if result:
-                # User Exists therefore lets generate a UUID
-                reset_token_uuid = _generate_uuid()
-                # Update the Use's reset_token
-                self._db.update_user(result.id, reset_token=reset_token_uuid)
         # return the generated token to calling function
         return reset_token_uuid
 
@@ -236,21 +369,15 @@ class Auth:
             # Handle case when reset_token or password is  None
             return None
         try:
-            # Raises ``sqlalchemy.orm.exc.NoResultFound`` if the query selects
-            #         no rows.
-            result = self._db.find_user_by(reset_token=reset_token)
-            # print(result)
+            # Unknown tokens are refused before any bcrypt work
+            user_id = self._db.update_user_where(
+                {"reset_token": reset_token})
+            hashed_password = self._hasher.hash(password).decode('utf-8')
+            # Set the new password and clear reset_token at once, unless
+            # the token was used meanwhile
+            self._db.update_user_where(
+                {"id": user_id, "reset_token": reset_token},
+                hashed_password=hashed_password, reset_token=None)
         except NoResultFound as e:
             # User not found
             raise ValueError("reset_token not found")
-        else:
-            # User Object found
-            hashed_password = _hash_password(password)
-            # Update user's hashed password
-            # print(result)
-            self._db.update_user(
-                user_id=result.id,
-                hashed_password=hashed_password)
-            # print(result)
-            # set reset_token to None
-            self._db.update_user(user_id=result.id, reset_token=None)
@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+"""
+Benchmarks and load tests of the authentication service.
+Run them from the project root with:
+python3 -m benchmarks.<module> --help
+"""
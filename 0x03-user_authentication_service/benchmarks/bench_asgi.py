@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Compares app.py on a threaded WSGI server with asgi_app.py on an
+asyncio server while many idle connections are open: GET /profile
+latency of one active client and resident memory of the server. The
+threaded server spends one thread per open connection, the asyncio one
+a coroutine.
+Idle connections have not sent a request yet: werkzeug closes every
+connection after its first response, so it can't hold keep-alive ones.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = {
+    "wsgi": """
+import logging
+from werkzeug.serving import make_server
+from app import app
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+server = make_server("127.0.0.1", 0, app, threaded=True)
+server.request_queue_size = 4096
+print(server.server_port, flush=True)
+server.serve_forever()
+""",
+    "asgi": """
+import asyncio
+from asgi_app import serve
+asyncio.run(serve("127.0.0.1", 0, ready=lambda port: print(port, flush=True)))
+""",
+}
+
+
+def start_server(kind: str, cwd: str) -> tuple:
+    """
+    Launches the wsgi or asgi server in a subprocess whose database
+    lives in cwd
+    :return: (process, port)
+    :rtype: tuple
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    proc = subprocess.Popen([sys.executable, "-c", SERVERS[kind]], cwd=cwd,
+                            env=env, stdout=subprocess.PIPE, text=True)
+    return proc, int(proc.stdout.readline())
+
+
+def rss_kib(pid: int) -> int:
+    """
+    Resident memory of a process, from /proc
+    :return: KiB, 0 when unavailable
+    :rtype: int
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def log_in(port: int, email: str, password: str) -> str:
+    """
+    Registers and logs in a user
+    :return: session_id cookie
+    :rtype: string
+    """
+    url = "http://127.0.0.1:{}".format(port)
+    data = urllib.parse.urlencode(
+        {"email": email, "password": password}).encode()
+    urllib.request.urlopen(url + "/users", data=data).read()
+    with urllib.request.urlopen(url + "/sessions", data=data) as resp:
+        cookie = resp.headers["Set-Cookie"]
+    return cookie.split(";", 1)[0].split("=", 1)[1]
+
+
+def open_idle(port: int, count: int) -> list:
+    """
+    Opens count connections that send nothing
+    :return: sockets
+    :rtype: list
+    """
+    sockets = [socket.create_connection(("127.0.0.1", port))
+               for _ in range(count)]
+    # let the server accept them all before measuring
+    time.sleep(1 + count / 1000)
+    return sockets
+
+
+def read_response(sock: socket.socket) -> bytes:
+    """
+    Reads one HTTP response with a Content-Length
+    :return: response body
+    :rtype: bytes
+    """
+    response = b""
+    while b"\r\n\r\n" not in response:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        response += chunk
+    head, body = response.split(b"\r\n\r\n", 1)
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    while len(body) < length:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        body += chunk
+    return body
+
+
+def profile_latency(port: int, session_id: str, requests: int) -> dict:
+    """
+    Times GET /profile, one connection per request
+    :return: p50 and p99 latency in milliseconds
+    :rtype: dict
+    """
+    request = ("GET /profile HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+               "Connection: close\r\n"
+               "Cookie: session_id={}\r\n\r\n").format(session_id).encode()
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.settimeout(30)
+            sock.sendall(request)
+            read_response(sock)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"p50_ms": round(statistics.median(timings), 3),
+            "p99_ms": round(timings[int(len(timings) * 0.99) - 1], 3)}
+
+
+def run(kinds: list, idle: list, requests: int) -> list:
+    """
+    Runs the comparison for each server and idle connection count
+    :return: one result per (server, idle connections)
+    :rtype: list
+    """
+    results = []
+    for kind in kinds:
+        for count in idle:
+            with tempfile.TemporaryDirectory() as tmp:
+                proc, port = start_server(kind, tmp)
+                sockets = []
+                try:
+                    session_id = log_in(port, "bench@example.com",
+                                        "benchPwd")
+                    sockets = open_idle(port, count)
+                    result = {"server": kind, "idle_connections": count}
+                    result.update(profile_latency(port, session_id,
+                                                  requests))
+                    result["server_rss_kib"] = rss_kib(proc.pid)
+                    results.append(result)
+                finally:
+                    for sock in sockets:
+                        sock.close()
+                    proc.terminate()
+                    proc.wait()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS),
+                        default=["wsgi", "asgi"])
+    parser.add_argument("--idle", type=int, nargs="+",
+                        default=[0, 100, 1000])
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+    for result in run(args.servers, args.idle, args.requests):
+        print(json.dumps(result))
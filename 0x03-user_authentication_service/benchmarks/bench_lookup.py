@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Latency of DB.find_user_by on email, session_id and reset_token
+for a growing number of users, with the users table indexes
+and, for comparison, after dropping them (full table scans).
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import insert, text
+from db import DB
+from user import User
+
+BATCH = 10000
+
+
+def fill(db: DB, n: int) -> None:
+    """
+    Inserts n users in batches
+    :param n: number of users
+    :type n: integer
+    """
+    with db._engine.begin() as conn:
+        for start in range(0, n, BATCH):
+            conn.execute(insert(User), [
+                {"email": "user{}@example.com".format(i),
+                 "hashed_password": "x" * 60,
+                 "session_id": "session-{}".format(i),
+                 "reset_token": "token-{}".format(i)}
+                for i in range(start, min(n, start + BATCH))])
+
+
+def lookups_us(db: DB, n: int, number: int) -> dict:
+    """
+    Average microseconds of `number` lookups of random users
+    :return: latency per looked up column
+    :rtype: dict
+    """
+    result = {}
+    for column, fmt in (("email", "user{}@example.com"),
+                        ("session_id", "session-{}"),
+                        ("reset_token", "token-{}")):
+        values = [fmt.format(random.randrange(n)) for _ in range(number)]
+        start = time.perf_counter()
+        for value in values:
+            db.find_user_by(**{column: value})
+        elapsed = time.perf_counter() - start
+        result[column] = round(elapsed / number * 1e6, 1)
+    return result
+
+
+def run(n: int, number: int = 200, scan: bool = True) -> dict:
+    """
+    Benchmarks lookups on a fresh database of n users
+    :return: latencies with and without the indexes
+    :rtype: dict
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            db = DB()
+            fill(db, n)
+            result = {"users": n, "indexed_us": lookups_us(db, n, number)}
+            if scan:
+                with db._engine.begin() as conn:
+                    for index in User.__table__.indexes:
+                        conn.execute(text(
+                            "DROP INDEX {}".format(index.name)))
+                db.remove_session()
+                result["scan_us"] = lookups_us(db, n, max(1, number // 10))
+            db.remove_session()
+            return result
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--no-scan", action="store_true",
+                        help="skip the unindexed comparison")
+    args = parser.parse_args()
+    for n in args.users:
+        print(json.dumps(run(n, scan=not args.no_scan)))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Load test of GET /profile against app.py served by a multi-threaded
+WSGI server in a separate process, for a growing number of client
+threads. Throughput should grow with the thread count now that each
+request gets its own database session from the pool.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = """
+import logging
+from werkzeug.serving import make_server
+from app import app
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+server = make_server("127.0.0.1", 0, app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+
+
+def start_server(cwd: str) -> tuple:
+    """
+    Launches app.py in a subprocess whose database lives in cwd
+    :return: (process, base url)
+    :rtype: tuple
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    proc = subprocess.Popen([sys.executable, "-c", SERVER], cwd=cwd,
+                            env=env, stdout=subprocess.PIPE, text=True)
+    port = int(proc.stdout.readline())
+    return proc, "http://127.0.0.1:{}".format(port)
+
+
+def log_in(url: str, email: str, password: str) -> str:
+    """
+    Registers and logs in a user
+    :return: session_id cookie
+    :rtype: string
+    """
+    data = urllib.parse.urlencode(
+        {"email": email, "password": password}).encode()
+    urllib.request.urlopen(url + "/users", data=data)
+    with urllib.request.urlopen(url + "/sessions", data=data) as resp:
+        cookie = resp.headers["Set-Cookie"]
+    return cookie.split(";", 1)[0].split("=", 1)[1]
+
+
+def profile_throughput(url: str, session_id: str, threads: int,
+                       seconds: float) -> dict:
+    """
+    Hammers GET /profile from `threads` client threads
+    :return: requests per second and error count
+    :rtype: dict
+    """
+    counts = [0] * threads
+    errors = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def client(i: int) -> None:
+        req = urllib.request.Request(
+            url + "/profile",
+            headers={"Cookie": "session_id={}".format(session_id)})
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(req) as resp:
+                    resp.read()
+                counts[i] += 1
+            except OSError:
+                errors[i] += 1
+
+    workers = [threading.Thread(target=client, args=(i,))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return {"threads": threads,
+            "requests_per_second": round(sum(counts) / seconds, 1),
+            "errors": sum(errors)}
+
+
+def run(threads: list, seconds: float) -> list:
+    """
+    Runs the load test for each client thread count
+    :return: one result per thread count
+    :rtype: list
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, url = start_server(tmp)
+        try:
+            session_id = log_in(url, "bench@example.com", "benchPwd")
+            return [profile_throughput(url, session_id, n, seconds)
+                    for n in threads]
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, nargs="+",
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+    for result in run(args.threads, args.seconds):
+        print(json.dumps(result))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Cost of resolving a session cookie (Auth.get_user_from_session_id) in
+each session mode, against a database of n users:
+- db: SESSION_STORE=none, one query on users.session_id per lookup
+- store: SESSION_STORE=memory, the session store in front of it
+- token: SESSION_MODE=token, an HMAC check and no database read
+python3 -m benchmarks.bench_session_modes --users 1000 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+MODES = {
+    "db": {"SESSION_MODE": "db", "SESSION_STORE": "none"},
+    "store": {"SESSION_MODE": "db", "SESSION_STORE": "memory"},
+    "token": {"SESSION_MODE": "token", "SESSION_STORE": "none",
+              "SESSION_TOKEN_SECRET": "bench-secret",
+              "SESSION_REVOCATIONS": "memory"},
+}
+
+
+def measure(mode: str, n: int, sessions: int, lookups: int) -> dict:
+    """
+    Times lookups of sessions cookies in a fresh database of n users
+    :return: mean microseconds per lookup
+    :rtype: dict
+    """
+    from auth import Auth
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(MODES[mode])
+        os.environ["DB_URL"] = "sqlite:///" + os.path.join(tmp, "a.db")
+        os.environ["DB_RESET"] = "1"
+        auth = Auth()
+        emails = [f"user{i}@example.com" for i in range(n)]
+        auth._db.add_users([(email, "x") for email in emails])
+        step = max(n // sessions, 1)
+        cookies = [auth.create_session(email) for email in emails[::step]]
+        for cookie in cookies:
+            assert auth.get_user_from_session_id(cookie) is not None
+        start = time.perf_counter()
+        for i in range(lookups):
+            auth.get_user_from_session_id(cookies[i % len(cookies)])
+            auth.release_db_session()
+        elapsed = time.perf_counter() - start
+        auth.release_db_session()
+    return {"mode": mode, "users": n,
+            "lookup_us": round(elapsed / lookups * 1e6, 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[1000, 100000])
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES),
+                        default=["db", "store", "token"])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+    for n in args.users:
+        for mode in args.modes:
+            print(json.dumps(measure(mode, n, args.sessions, args.lookups)))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Load generator and capacity report of app.py (or asgi_app.py).
+
+Launches the server in a subprocess on a fresh database of seeded users,
+then replays a weighted mix of user actions from many concurrent
+asyncio clients, spread over --workers processes so that the generator
+itself is not the bottleneck. Each client owns one seeded user and loops
+until --seconds have passed, waiting for each response (closed loop):
+- register: POST /users with a new email
+- login: POST /sessions, keeping the session_id cookie
+- profile: GET /profile, logging in first without a session
+- logout: DELETE /sessions, logging in first without a session
+- reset: POST /reset_password then PUT /reset_password with the token
+A client answered 503 (bcrypt pool busy) or 429 (rate limited) waits
+for its Retry-After, as a well-behaved client would, instead of
+retrying at once. Every client connects from 127.0.0.1, so the login
+rate limits are off unless RATE_LIMIT is set.
+For each number of clients, one JSON line reports the throughput, the
+p50/p95/p99 latency and the error rate of every endpoint: a response
+with another status than the expected one, a timeout or a connection
+error counts as an error.
+python3 -m benchmarks.loadgen --clients 10 50 100 --mix login-peak
+python3 -m benchmarks.loadgen --mix login=80,profile=20 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode
+
+from benchmarks.bench_asgi import PROJECT_DIR, SERVERS, start_server
+
+PASSWORD = "loadPwd"
+MIXES = {
+    "login-peak": {"login": 60, "profile": 25, "logout": 5,
+                   "register": 5, "reset": 5},
+    "steady": {"profile": 60, "login": 15, "logout": 10,
+               "register": 10, "reset": 5},
+}
+# Endpoint: expected status
+EXPECTED = {
+    "POST /users": 200,
+    "POST /sessions": 200,
+    "GET /profile": 200,
+    "DELETE /sessions": 302,
+    "POST /reset_password": 200,
+    "PUT /reset_password": 200,
+}
+SEED = """
+import sys
+from db import DB
+from hashing import bcrypt_hash
+hashed = bcrypt_hash(sys.argv[2].encode()).decode()
+DB().add_users([("load{}@example.com".format(i), hashed)
+                for i in range(int(sys.argv[1]))])
+"""
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """
+    A named mix, or action=weight pairs separated by commas
+    :return: weight by action
+    :rtype: dict
+    """
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for pair in value.split(","):
+        action, _, weight = pair.partition("=")
+        if action not in MIXES["steady"] or not weight.isdigit():
+            raise argparse.ArgumentTypeError(
+                "expected a mix among {} or action=weight pairs with "
+                "actions among {}".format(", ".join(MIXES),
+                                          ", ".join(MIXES["steady"])))
+        mix[action] = int(weight)
+    if sum(mix.values()) == 0:
+        raise argparse.ArgumentTypeError("the weights sum to 0")
+    return mix
+
+
+def seed(cwd: str, users: int) -> None:
+    """
+    Registers users load0@example.com... in the database of cwd, all
+    with PASSWORD hashed once
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    subprocess.run([sys.executable, "-c", SEED, str(users), PASSWORD],
+                   cwd=cwd, env=env, check=True)
+
+
+async def http(port: int, method: str, path: str, form: dict = None,
+               session_id: str = None) -> Tuple[int, dict, bytes]:
+    """
+    Sends one request on a new connection and reads the whole response
+    :return: (status, headers with lowercase names, body)
+    :rtype: tuple
+    """
+    body = urlencode(form).encode() if form is not None else b""
+    lines = ["{} {} HTTP/1.1".format(method, path), "Host: 127.0.0.1",
+             "Connection: close", "Content-Length: {}".format(len(body))]
+    if form is not None:
+        lines.append("Content-Type: application/x-www-form-urlencoded")
+    if session_id is not None:
+        lines.append("Cookie: session_id={}".format(session_id))
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write("\r\n".join(lines).encode() + b"\r\n\r\n" + body)
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(status_line.split()[1]), headers, body
+
+
+class Client:
+    """
+    One simulated user replaying actions drawn from a mix
+    """
+
+    def __init__(self, port: int, email: str, name: str,
+                 stats: dict, timeout: float) -> None:
+        """Initialize a client without a session"""
+        self.port = port
+        self.email = email
+        self.name = name
+        self.stats = stats
+        self.timeout = timeout
+        self.session_id = None
+        self.registered = 0
+        self.deadline = 0.0
+
+    async def request(self, method: str, path: str,
+                      form: dict = None) -> Tuple[int, dict, bytes]:
+        """
+        Sends a timed request and records it under its endpoint
+        :return: (status, headers, body), status 0 on a failure
+        :rtype: tuple
+        """
+        endpoint = "{} {}".format(method, path)
+        start = time.perf_counter()
+        try:
+            status, headers, body = await asyncio.wait_for(
+                http(self.port, method, path, form, self.session_id),
+                self.timeout)
+            outcome = str(status)
+        except asyncio.TimeoutError:
+            status, headers, body, outcome = 0, {}, b"", "timeout"
+        except (OSError, ValueError, IndexError):
+            status, headers, body, outcome = 0, {}, b"", "error"
+        seconds = time.perf_counter() - start
+        stat = self.stats[endpoint]
+        stat["latencies"].append(seconds)
+        stat["outcomes"][outcome] = stat["outcomes"].get(outcome, 0) + 1
+        if status != EXPECTED[endpoint]:
+            stat["errors"] += 1
+        if status in (429, 503):
+            retry_after = float(headers.get("retry-after", "1"))
+            await asyncio.sleep(min(retry_after, max(
+                self.deadline - time.monotonic(), 0)))
+        return status, headers, body
+
+    async def register(self) -> None:
+        """POST /users with a new email"""
+        self.registered += 1
+        await self.request("POST", "/users", {
+            "email": "new-{}-{}@example.com".format(self.name,
+                                                    self.registered),
+            "password": PASSWORD})
+
+    async def login(self) -> None:
+        """POST /sessions, keeping the session_id cookie"""
+        status, headers, _ = await self.request("POST", "/sessions", {
+            "email": self.email, "password": PASSWORD})
+        cookie = headers.get("set-cookie", "")
+        if status == 200 and cookie.startswith("session_id="):
+            self.session_id = cookie.split(";", 1)[0].split("=", 1)[1]
+
+    async def profile(self) -> None:
+        """GET /profile, logging in first without a session"""
+        if self.session_id is None:
+            await self.login()
+            if self.session_id is None:
+                return
+        await self.request("GET", "/profile")
+
+    async def logout(self) -> None:
+        """DELETE /sessions, logging in first without a session"""
+        if self.session_id is None:
+            await self.login()
+            if self.session_id is None:
+                return
+        await self.request("DELETE", "/sessions")
+        self.session_id = None
+
+    async def reset(self) -> None:
+        """POST then PUT /reset_password, which ends the session"""
+        status, _, body = await self.request("POST", "/reset_password",
+                                             {"email": self.email})
+        self.session_id = None
+        if status != 200:
+            return
+        token = json.loads(body).get("reset_token")
+        await self.request("PUT", "/reset_password", {
+            "email": self.email, "reset_token": token,
+            "new_password": PASSWORD})
+
+    async def run(self, mix: Dict[str, int], deadline: float) -> None:
+        """Replays actions drawn from mix until deadline"""
+        actions = [getattr(self, action) for action in mix]
+        weights = list(mix.values())
+        self.deadline = deadline
+        while time.monotonic() < deadline:
+            await random.choices(actions, weights)[0]()
+
+
+async def run_clients(port: int, first: int, count: int,
+                      mix: Dict[str, int], seconds: float,
+                      timeout: float, tag: str) -> dict:
+    """
+    Runs count clients, owning the seeded users from first on and
+    registering emails tagged with tag
+    :return: latencies, outcomes and errors by endpoint
+    :rtype: dict
+    """
+    stats = {endpoint: {"latencies": [], "outcomes": {}, "errors": 0}
+             for endpoint in EXPECTED}
+    deadline = time.monotonic() + seconds
+    clients = [Client(port, "load{}@example.com".format(i),
+                      "{}-{}".format(tag, i), stats, timeout)
+               for i in range(first, first + count)]
+    await asyncio.gather(*(client.run(mix, deadline) for client in clients))
+    return stats
+
+
+def worker(port: int, first: int, count: int, mix: Dict[str, int],
+           seconds: float, timeout: float, tag: str) -> dict:
+    """
+    Event loop of one generator process
+    :return: latencies, outcomes and errors by endpoint
+    :rtype: dict
+    """
+    return asyncio.run(run_clients(port, first, count, mix, seconds,
+                                   timeout, tag))
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of sorted values, in milliseconds
+    :rtype: float
+    """
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return round(ordered[rank - 1] * 1e3, 3)
+
+
+def report(results: List[dict], elapsed: float) -> dict:
+    """
+    Merges the stats of every worker into the report of each endpoint
+    :return: totals and report by endpoint
+    :rtype: dict
+    """
+    endpoints = {}
+    total = errors = 0
+    for endpoint in EXPECTED:
+        latencies = sorted(seconds for stats in results
+                           for seconds in stats[endpoint]["latencies"])
+        if not latencies:
+            continue
+        outcomes = {}
+        for stats in results:
+            for outcome, n in stats[endpoint]["outcomes"].items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + n
+        failed = sum(stats[endpoint]["errors"] for stats in results)
+        total += len(latencies)
+        errors += failed
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "requests_per_second": round(len(latencies) / elapsed, 2),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "errors": failed,
+            "error_rate": round(failed / len(latencies), 4),
+            "statuses": dict(sorted(outcomes.items()))}
+    return {"requests": total,
+            "requests_per_second": round(total / elapsed, 2),
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "endpoints": endpoints}
+
+
+def load(port: int, clients: int, workers: int, mix: Dict[str, int],
+         seconds: float, timeout: float, tag: str = "0") -> dict:
+    """
+    Spreads clients over workers processes and runs them all at once,
+    tag telling apart the emails registered by successive loads
+    :return: report of the run
+    :rtype: dict
+    """
+    workers = max(min(workers, clients), 1)
+    shares = [clients // workers + (i < clients % workers)
+              for i in range(workers)]
+    firsts = [sum(shares[:i]) for i in range(workers)]
+    start = time.perf_counter()
+    if workers == 1:
+        results = [worker(port, 0, clients, mix, seconds, timeout, tag)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(worker, port, first, share, mix,
+                                   seconds, timeout, tag)
+                       for first, share in zip(firsts, shares)]
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    result = {"clients": clients, "workers": workers,
+              "seconds": round(elapsed, 3)}
+    result.update(report(results, elapsed))
+    return result
+
+
+def run(kind: str, clients: List[int], workers: int, mix: Dict[str, int],
+        seconds: float, timeout: float) -> List[dict]:
+    """
+    Seeds one user per client, launches the server then runs the load
+    for each number of clients
+    :return: one report per number of clients
+    :rtype: list
+    """
+    results = []
+    os.environ.setdefault("RATE_LIMIT", "none")
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(tmp, max(clients))
+        proc, port = start_server(kind, tmp)
+        try:
+            for n, count in enumerate(clients):
+                result = {"server": kind, "mix": mix}
+                result.update(load(port, count, workers, mix, seconds,
+                                   timeout, str(n)))
+                results.append(result)
+        finally:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="wsgi")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--workers", type=int, default=1,
+                        help="generator processes sharing the clients")
+    parser.add_argument("--mix", type=parse_mix, default="login-peak",
+                        help="{} or action=weight,...".format(
+                            " or ".join(MIXES)))
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds before a request counts as failed")
+    args = parser.parse_args()
+    for result in run(args.server, args.clients, args.workers, args.mix,
+                      args.seconds, args.timeout):
+        print(json.dumps(result))
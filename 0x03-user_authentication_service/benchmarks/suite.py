@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite of app.py, in-process through the Flask test client,
+against a fresh SQLite database holding n users.
+
+Scenarios:
+register (POST /users), login (POST /sessions) and update_password
+(PUT /reset_password) each run bcrypt, so they get few operations;
+profile (GET /profile), logout (DELETE /sessions) and reset_token
+(POST /reset_password) only query the database and the session store.
+
+Results are printed as JSON, with the median of each scenario compared
+to a baseline (benchmarks/baseline.json by default): the exit status is
+1 when one of them is more than --tolerance slower.
+python3 -m benchmarks.suite --users 10000
+python3 -m benchmarks.suite --users 10000 --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+PASSWORD = "suite-password"
+
+
+def measure(op: Callable[[int], None], ops: int,
+            setup: Callable[[int], None] = None) -> dict:
+    """
+    Times op(i) for i in range(ops), calling setup(i) untimed before each
+    :return: number of operations, median and p95 in milliseconds
+    :rtype: dict
+    """
+    times = []
+    for i in range(ops):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        op(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"ops": ops,
+            "median_ms": round(statistics.median(times) * 1e3, 4),
+            "p95_ms": round(times[int(0.95 * (ops - 1))] * 1e3, 4)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """
+    Compares each median to the baseline one
+    :return: per scenario, the baseline median, the ratio and whether it
+     is a regression
+    :rtype: dict
+    """
+    comparison = {}
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] \
+            if before["median_ms"] else 1.0
+        comparison[name] = {"baseline_median_ms": before["median_ms"],
+                            "ratio": round(ratio, 3),
+                            "regression": ratio > 1 + tolerance}
+    return comparison
+
+
+def positive_int(value: str) -> int:
+    """
+    Command line integer of at least 1
+    :rtype: integer
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("expected at least 1")
+    return number
+
+
+def scenarios(n: int, scale: int) -> dict:
+    """
+    Runs every scenario against n users, with scale times the base
+    number of operations
+    :return: measures by scenario
+    :rtype: dict
+    """
+    from app import AUTH, app
+    from hashing import bcrypt_hash
+
+    hashed = bcrypt_hash(PASSWORD.encode()).decode()
+    AUTH._db.add_users([(f"user{i}@example.com", hashed)
+                        for i in range(n)])
+    client = app.test_client()
+    emails = [f"user{i}@example.com" for i in range(n)]
+
+    def email(i: int) -> str:
+        # Scenarios may run more operations than there are users
+        return emails[i % n]
+
+    def form(i: int) -> dict:
+        return {"email": email(i), "password": PASSWORD}
+
+    def register(i: int) -> None:
+        assert client.post("/users", data={
+            "email": f"new{i}@example.com",
+            "password": PASSWORD}).status_code == 200
+
+    def login(i: int) -> None:
+        assert client.post("/sessions", data=form(i)).status_code == 200
+
+    def log_in_quietly(i: int) -> None:
+        session_id = AUTH.create_session(email(i))
+        client.set_cookie("session_id", session_id)
+
+    def profile(i: int) -> None:
+        assert client.get("/profile").status_code == 200
+
+    def logout(i: int) -> None:
+        assert client.delete("/sessions").status_code == 302
+
+    def reset_token(i: int) -> None:
+        assert client.post("/reset_password", data={
+            "email": email(i)}).status_code == 200
+
+    tokens = []
+
+    def new_token(i: int) -> None:
+        tokens.append(AUTH.get_reset_password_token(email(i)))
+
+    def update_password(i: int) -> None:
+        assert client.put("/reset_password", data={
+            "email": email(i), "reset_token": tokens[-1],
+            "new_password": PASSWORD}).status_code == 200
+
+    log_in_quietly(0)
+    return {"register": measure(register, 3 * scale),
+            "login": measure(login, 3 * scale),
+            "profile": measure(profile, 200 * scale),
+            "logout": measure(logout, 100 * scale, log_in_quietly),
+            "reset_token": measure(reset_token, 100 * scale),
+            "update_password": measure(update_password, 3 * scale,
+                                       new_token)}
+
+
+def run(n: int, scale: int = 1) -> dict:
+    """
+    Runs the suite in a fresh database
+    :return: report of the run
+    :rtype: dict
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_URL"] = "sqlite:///" + os.path.join(tmp, "a.db")
+        os.environ["DB_RESET"] = "1"
+        # Every login comes from the same client
+        os.environ.setdefault("RATE_LIMIT", "none")
+        results = scenarios(n, scale)
+    return {"suite": "0x03-user_authentication_service", "users": n,
+            "python": platform.python_version(), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=positive_int, default=1000)
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiply the number of operations")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown ratio above which a median regresses")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+    report = run(args.users, args.scale)
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("users") == args.users:
+            report["comparison"] = compare(report["results"], baseline,
+                                           args.tolerance)
+            regressions = [name for name, c in report["comparison"].items()
+                           if c["regression"]]
+    print(json.dumps(report))
+    if regressions:
+        print("Regressions: {}".format(", ".join(regressions)),
+              file=sys.stderr)
+        sys.exit(1)
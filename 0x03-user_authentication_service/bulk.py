@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Bulk import and export of users as NDJSON or CSV.
+
+Import rows carry an email and a password; passwords are hashed in
+parallel on the hashing pool and users inserted one transaction per
+batch, see Auth.register_users. Export streams the id and email of
+every user, never their hashes, sessions or reset tokens.
+
+python3 bulk.py import users.ndjson
+python3 bulk.py import --format csv users.csv
+python3 bulk.py export --format csv > users.csv
+"""
+import csv
+import io
+import json
+from typing import Iterable, Iterator, Tuple
+
+from auth import Auth
+from db import DB
+
+FORMATS = ("ndjson", "csv")
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = ("id", "email")
+
+
+def format_of(name: str) -> str:
+    """
+    Bulk format of a mimetype or a file name
+    :param name: Content-Type or file name
+    :type name: string
+    :return: ndjson, csv or None if unknown
+    :rtype: string
+    """
+    if name is None:
+        return None
+    name = name.split(";", 1)[0].strip().lower()
+    for fmt, mimetype in MIMETYPES.items():
+        if name == mimetype or name.endswith("." + fmt):
+            return fmt
+    if name == "application/jsonl" or name.endswith(".jsonl"):
+        return "ndjson"
+    return None
+
+
+def iter_rows(lines: Iterable[str], fmt: str) -> Iterator[Tuple]:
+    """
+    Parses an NDJSON or CSV document one line at a time
+    :param lines: lines of the document
+    :type lines: iterable
+    :param fmt: ndjson or csv
+    :type fmt: string
+    :return: (line number, row dict) or (line number, error message)
+     for each non empty line
+    :rtype: iterator
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(lines, 1):
+        if line.strip() == "":
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, f"Wrong format: {e}"
+            continue
+        if type(row) is not dict:
+            yield line_num, "Wrong format"
+            continue
+        yield line_num, row
+
+
+def import_users(auth: Auth, lines: Iterable[str], fmt: str,
+                 batch_size: int = 500) -> dict:
+    """
+    Registers the users of an NDJSON or CSV document
+    :param auth: Auth registering the users
+    :type auth: Auth
+    :param lines: lines of the document
+    :type lines: iterable
+    :param fmt: ndjson or csv
+    :type fmt: string
+    :param batch_size: users per transaction
+    :type batch_size: integer
+    :return: number of users created and the errors of the other lines
+    :rtype: dict
+    :raises HasherBusy: the hashing pool is saturated
+    """
+    errors = []
+    line_nums = []
+
+    def valid_users() -> Iterator[Tuple[str, str]]:
+        for line_num, row in iter_rows(lines, fmt):
+            if type(row) is str:
+                errors.append({"line": line_num, "error": row})
+                continue
+            email = row.get("email")
+            password = row.get("password")
+            if not email or type(email) is not str:
+                errors.append({"line": line_num, "error": "Missing email"})
+            elif not password or type(password) is not str:
+                errors.append({"line": line_num,
+                               "error": "Missing password"})
+            else:
+                line_nums.append(line_num)
+                yield email, password
+
+    rejected = auth.register_users(valid_users(), batch_size)
+    for position, email in rejected:
+        errors.append({"line": line_nums[position],
+                       "error": "email already registered"})
+    errors.sort(key=lambda error: error["line"])
+    return {"created": len(line_nums) - len(rejected), "errors": errors}
+
+
+def export_users(db: DB, fmt: str) -> Iterator[str]:
+    """
+    Streams the id and email of every user
+    :param db: database to read
+    :type db: DB
+    :param fmt: ndjson or csv
+    :type fmt: string
+    :return: NDJSON lines or CSV rows, header first
+    :rtype: iterator
+    """
+    rows = db.iter_users(*EXPORT_COLUMNS)
+    if fmt != "csv":
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("file", nargs="?", help="import file, - for stdin")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for chunk in export_users(DB(), args.format or "ndjson"):
+            sys.stdout.write(chunk)
+        sys.exit(0)
+    auth = Auth()
+    fmt = args.format or format_of(args.file) or "ndjson"
+    if args.file is None or args.file == "-":
+        report = import_users(auth, sys.stdin, fmt, args.batch_size)
+    else:
+        with open(args.file, 'r', newline='') as f:
+            report = import_users(auth, f, fmt, args.batch_size)
+    print(json.dumps(report))
@@ -1,14 +1,43 @@
 #!/usr/bin/env python3
 """DB module
 """
-from sqlalchemy import create_engine
-from sqlalchemy.exc import InvalidRequestError
+from os import getenv
+from typing import Iterable, Iterator, List, Set, Tuple
+from sqlalchemy import create_engine, delete, event, func, insert, \
+    inspect, select, update
+from sqlalchemy.exc import IntegrityError, InvalidRequestError, \
+    NoResultFound, OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import QueuePool, StaticPool
 
 from user import Base, User
 
+# Attributes accepted by find_user_by and update_user
+USER_COLUMNS = frozenset(column.key for column in User.__table__.columns)
+
+# Set on every new SQLite connection: WAL lets readers run alongside a
+# writer, including in other processes sharing the database file
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "busy_timeout=5000",
+    "cache_size=-16000",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Applies SQLITE_PRAGMAS to a new DBAPI connection
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
 
 class DB:
     """DB class
@@ -16,20 +45,100 @@ class DB:
 
     def __init__(self) -> None:
         """Initialize a new DB instance
+
+        The database is DB_URL (default: sqlite:///a.db). Missing tables
+        and indexes are created and existing data is kept, unless
+        DB_RESET=1 which drops everything first.
+        Connections come from a pool sized by DB_POOL_SIZE and
+        DB_MAX_OVERFLOW, and each thread gets its own session.
+        """
+        url = getenv("DB_URL", "sqlite:///a.db")
+        options = {"echo": False}
+        if url.startswith("sqlite"):
+            options["connect_args"] = {"check_same_thread": False}
+        if url in ("sqlite://", "sqlite:///:memory:"):
+            # Every connection would get its own empty in-memory database
+            options["poolclass"] = StaticPool
+        else:
+            options["poolclass"] = QueuePool
+            options["pool_size"] = int(getenv("DB_POOL_SIZE", "5"))
+            options["max_overflow"] = int(getenv("DB_MAX_OVERFLOW", "10"))
+        self._engine = create_engine(url, **options)
+        if url.startswith("sqlite"):
+            event.listen(self._engine, "connect", _set_sqlite_pragmas)
+
+        if getenv("DB_RESET", "0") == "1":
+            Base.metadata.drop_all(self._engine)
+        try:
+            Base.metadata.create_all(self._engine)
+            self.migrate()
+        except OperationalError:
+            # Another worker process created the schema concurrently
+            Base.metadata.create_all(self._engine)
+            self.migrate()
+        # Sessions only live for one request: objects stay readable
+        # after the commit and after the session is closed
+        self.__session = scoped_session(
+            sessionmaker(bind=self._engine, expire_on_commit=False))
+
+    def migrate(self) -> None:
+        """
+        Brings the schema of an existing database up to date:
+        creates the indexes declared on User that are missing,
+        such as the unique index on users.email.
+        Databases created before it may hold duplicate emails: with
+        DB_DEDUPE_EMAILS=1 only the first registered user of each
+        email is kept, otherwise the migration stops.
+        :raises ValueError: emails are not unique and DB_DEDUPE_EMAILS
+         is not set
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
-        Base.metadata.create_all(self._engine)
-        self.__session = None
+        existing = {index["name"] for index in
+                    inspect(self._engine).get_indexes(User.__tablename__)}
+        for index in User.__table__.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                self._dedupe(*(column.key for column in index.columns))
+            index.create(bind=self._engine)
+
+    def _dedupe(self, *columns: str) -> None:
+        """
+        Makes columns unique before their unique index is created,
+        deleting all but the first user of each duplicated value
+        when DB_DEDUPE_EMAILS=1
+        :raises ValueError: columns hold duplicates
+        """
+        keys = [getattr(User, column) for column in columns]
+        with self._engine.begin() as connection:
+            duplicates = connection.execute(
+                select(*keys, func.count()).group_by(*keys).having(
+                    func.count() > 1)).all()
+            if len(duplicates) == 0:
+                return
+            if getenv("DB_DEDUPE_EMAILS", "0") != "1":
+                examples = ", ".join(str(row[0]) for row in duplicates[:5])
+                raise ValueError(
+                    f"Cannot create the unique index on users."
+                    f"{', '.join(columns)}: {len(duplicates)} values are "
+                    f"shared by several users ({examples}...). Remove the "
+                    f"duplicates, or set DB_DEDUPE_EMAILS=1 to keep only "
+                    f"the first registered user of each, or DB_RESET=1 "
+                    f"to start from an empty database.")
+            first = select(func.min(User.id)).group_by(*keys)
+            connection.execute(delete(User).where(User.id.not_in(first)))
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Session object of the current thread
+        """
+        return self.__session()
+
+    def remove_session(self) -> None:
+        """
+        Closes the session of the current thread, giving its
+        connection back to the pool. Called at the end of each request.
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        self.__session.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """
@@ -40,12 +149,82 @@ class DB:
         :type hashed_password: string
         :return: User object
         :rtype: User
+        :raises ValueError: email is already registered
         """
         new_user = User(email=f"{email}", hashed_password=f"{hashed_password}")
         self._session.add(new_user)
-        self.save()
+        try:
+            self.save()
+        except IntegrityError:
+            # email is unique: registered concurrently
+            self._session.rollback()
+            raise ValueError(f"User {email} already exists")
         return new_user
 
+    def add_users(self, users: List[Tuple[str, str]]) -> List[str]:
+        """
+        Adds several users in one transaction
+        :param users: (email, hashed_password) pairs
+        :type users: list
+        :return: emails rejected because they are already registered
+        :rtype: list
+        """
+        if len(users) == 0:
+            return []
+        rows = [{"email": email, "hashed_password": hashed_password}
+                for email, hashed_password in users]
+        try:
+            self._session.execute(insert(User), rows)
+            self.save()
+            return []
+        except IntegrityError:
+            self._session.rollback()
+        # Some emails were registered meanwhile: one savepoint per user
+        # to find them, still committing once
+        rejected = []
+        for row in rows:
+            try:
+                with self._session.begin_nested():
+                    self._session.execute(insert(User), [row])
+            except IntegrityError:
+                rejected.append(row["email"])
+        self.save()
+        return rejected
+
+    def registered_emails(self, emails: Iterable[str]) -> Set[str]:
+        """
+        Which of emails are already registered, in one query
+        :param emails: emails to look up
+        :type emails: iterable
+        :return: the registered ones
+        :rtype: set
+        """
+        emails = list(emails)
+        if len(emails) == 0:
+            return set()
+        return set(self._session.execute(
+            select(User.email).where(User.email.in_(emails))).scalars())
+
+    def iter_users(self, *columns: str,
+                   batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Yields the given columns of every user, by id, fetching
+        batch_size rows at a time instead of the whole table
+        :param columns: names of the columns
+        :type columns: string
+        :return: one tuple of values per user
+        :rtype: iterator
+        :raises ValueError: a name is not a column of users
+        """
+        if not USER_COLUMNS.issuperset(columns):
+            raise ValueError()
+        statement = select(*(getattr(User, column) for column in columns))
+        result = self._session.execute(
+            statement.order_by(User.id),
+            execution_options={"yield_per": batch_size})
+        for row in result:
+            yield tuple(row)
+
     def save(self) -> None:
         """
             commits all changes of current database session
@@ -62,11 +241,9 @@ class DB:
 
         key = kwargs.keys()
         result = None
-        # vars(User))
-        user_keys = User.__dict__.keys()
         # print(key)
         key = list(key)[0]
-        if key in list(user_keys):
+        if key in USER_COLUMNS:
             # if key == 'email':
             result = self._session.query(User).filter(
                 getattr(User, key) == kwargs.get(f'{key}')).one()
@@ -87,17 +264,47 @@ class DB:
         :type kwargs: dict
         :return: None
         :rtype: None
+        :raises NoResultFound: no user has this id
+        :raises ValueError: a key is not a column of users
         """
-        find_user = self.find_user_by(id=user_id)
+        self.update_user_where({"id": user_id}, **kwargs)
 
-        # Check if all keys in kwargs are in the class dictionary
-        user_keys = set(User.__dict__.keys())
-        update_keys = set(kwargs.keys())
-        if not update_keys.issubset(user_keys):
+    def update_user_where(self, criteria: dict, **kwargs) -> int:
+        """
+        Updates several fields of the user matching criteria with
+        a single UPDATE statement and commit
+        :param criteria: column/value pairs identifying the user,
+         e.g. {"email": email}
+        :type criteria: dict
+        :param kwargs: key Value pairs to be updated, none to only
+         look the user up
+        :type kwargs: dict
+        :return: id of the updated user
+        :rtype: integer
+        :raises NoResultFound: no user matches criteria
+        :raises ValueError: a key is not a column of users
+        """
+        if not USER_COLUMNS.issuperset(kwargs) or \
+                not USER_COLUMNS.issuperset(criteria):
             raise ValueError()
-
-        # Update with new values
-        for key, value in kwargs.items():
-            setattr(find_user, key, value)
-
+        where = [getattr(User, key) == value
+                 for key, value in criteria.items()]
+        if len(kwargs) == 0:
+            # Nothing to set: only check that the user exists
+            user_id = self._session.execute(
+                select(User.id).where(*where)).scalars().first()
+            if user_id is None:
+                raise NoResultFound()
+            return user_id
+        statement = update(User).where(*where).values(**kwargs)
+        if getattr(self._engine.dialect, "update_returning", False):
+            user_ids = self._session.execute(
+                statement.returning(User.id)).scalars().all()
+        else:
+            user_ids = self._session.execute(
+                select(User.id).where(*where)).scalars().all()
+            self._session.execute(statement)
         self.save()
+        if len(user_ids) == 0:
+            raise NoResultFound()
+        return user_ids[0]
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Password hashing module: runs bcrypt hashing and checking on a
+bounded worker pool instead of the request threads, so that a burst
+of logins can only use the pool's workers and leaves the CPU to cheap
+endpoints. When too many hashes are pending, new ones are refused with
+HasherBusy, which app.py turns into a 503 with a Retry-After header.
+The pool also remembers how long the last checks took, so that a login
+to an unknown account can take as long without running bcrypt, see
+fake_check.
+
+Configuration:
+HASHER_KIND: thread (default, bcrypt releases the GIL) or process
+HASHER_WORKERS: pool size (default: number of CPUs minus one)
+HASHER_MAX_PENDING: hashes running or queued (default: 4 per worker)
+HASHER_RETRY_AFTER: seconds advertised to refused clients (default 1)
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from typing import Callable, Optional
+
+import bcrypt
+
+
+def bcrypt_hash(password: bytes) -> bytes:
+    """
+    Hashes a password with a new salt
+    :param password: encoded password
+    :type password: bytes
+    :return: hashed password
+    :rtype: bytes
+    """
+    return bcrypt.hashpw(password, bcrypt.gensalt())
+
+
+def bcrypt_check(password: bytes, hashed_password: bytes) -> bool:
+    """
+    Checks a password against a bcrypt hash
+    :param password: encoded password
+    :type password: bytes
+    :param hashed_password: stored hash
+    :type hashed_password: bytes
+    :return: True if they match
+    :rtype: bool
+    """
+    return bcrypt.checkpw(password, hashed_password)
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the hashing queue is full
+    """
+
+    def __init__(self, retry_after: int) -> None:
+        """retry_after: seconds the client should wait"""
+        super().__init__("password hashing queue is full")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Bounded pool of workers running bcrypt
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = None,
+                 max_pending: int = None, retry_after: int = 1) -> None:
+        """Initialize the pool"""
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) - 1)
+        if max_pending is None:
+            max_pending = 4 * workers
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(workers)
+        elif kind == "thread":
+            self._executor = ThreadPoolExecutor(
+                workers, thread_name_prefix="hasher")
+        else:
+            raise ValueError(f"Unknown HASHER_KIND {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._seconds = 0.0
+        # Durations of the last checks, queueing included
+        self._check_seconds = deque(maxlen=64)
+
+    def hash(self, password: str) -> bytes:
+        """
+        Hashes a password on the pool, waiting for the result
+        :raises HasherBusy: too many hashes pending
+        """
+        return self.submit(bcrypt_hash, password.encode('utf-8')).result()
+
+    def check(self, password: str, hashed_password: str) -> bool:
+        """
+        Checks a password on the pool, waiting for the result
+        :raises HasherBusy: too many hashes pending
+        """
+        start = time.perf_counter()
+        matched = self.submit(bcrypt_check, password.encode('utf-8'),
+                              hashed_password.encode('utf-8')).result()
+        self.record_check(time.perf_counter() - start)
+        return matched
+
+    def record_check(self, seconds: float) -> None:
+        """
+        Remembers how long a check took, from submission to result
+        :param seconds: duration of the check
+        :type seconds: float
+        """
+        self._check_seconds.append(seconds)
+
+    def check_delay(self) -> Optional[float]:
+        """
+        Duration of one of the last checks, drawn at random
+        :return: seconds, None before any check
+        :rtype: float
+        """
+        recent = list(self._check_seconds)
+        return random.choice(recent) if recent else None
+
+    def fake_check(self) -> bool:
+        """
+        Takes about as long as a failed check, for a user that does not
+        exist, so that the response time doesn't tell whether an email
+        is registered: sleeps for the duration of a recent check, or
+        before any was timed hashes a random password, which costs as
+        much as a check
+        :return: False
+        :rtype: bool
+        :raises HasherBusy: too many hashes pending
+        """
+        delay = self.check_delay()
+        if delay is not None:
+            time.sleep(delay)
+            return False
+        start = time.perf_counter()
+        self.hash(os.urandom(16).hex())
+        self.record_check(time.perf_counter() - start)
+        return False
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """
+        Queues fn(*args) unless max_pending calls are already pending
+        :return: future of the result
+        :rtype: Future
+        :raises HasherBusy: too many hashes pending
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HasherBusy(self.retry_after)
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._submitted += 1
+
+        def done(_: Future) -> None:
+            self._slots.release()
+            with self._lock:
+                self._completed += 1
+                self._seconds += time.perf_counter() - start
+
+        future.add_done_callback(done)
+        return future
+
+    def metrics(self) -> dict:
+        """
+        Counters of the pool
+        :return: workers, max_pending, pending, submitted, completed,
+         rejected and the mean seconds from submission to completion
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._submitted - self._completed,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "mean_seconds": (self._seconds / self._completed
+                                 if self._completed else 0.0),
+            }
+
+
+def hasher_from_env() -> PasswordHasher:
+    """
+    Builds the PasswordHasher configured by the HASHER_* variables
+    :return: password hasher
+    :rtype: PasswordHasher
+    """
+    workers = _getenv_int("HASHER_WORKERS")
+    max_pending = _getenv_int("HASHER_MAX_PENDING")
+    return PasswordHasher(os.getenv("HASHER_KIND", "thread"), workers,
+                          max_pending, _getenv_int("HASHER_RETRY_AFTER", 1))
+
+
+def _getenv_int(name: str, default: int = None) -> int:
+    """Integer environment variable, default when unset"""
+    value = os.getenv(name)
+    return default if value is None else int(value)
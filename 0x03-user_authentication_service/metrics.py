@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Request and hot path latency metrics, in the Prometheus text format.
+
+Opt-in with METRICS=1: init_app then times every request by route,
+method and status, wraps bcrypt (PasswordHasher) and the database
+queries (DB) with timers and serves GET /metrics. Nothing is wrapped
+nor registered otherwise, so disabled metrics cost nothing.
+"""
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, List
+from flask import Flask, Response, g, request
+
+# Upper bounds of the buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Timed methods, observed under the phase "<class>.<method>"
+DB_METHODS = ("add_user", "add_users", "registered_emails", "find_user_by",
+              "update_user", "update_user_where")
+HASHER_METHODS = ("hash", "check")
+
+
+class Histogram:
+    """
+    Latency histogram per set of label values
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple,
+                 buckets: tuple = BUCKETS) -> None:
+        """Initialize a histogram without any series"""
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Label values: [count per bucket then +Inf, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *values: str) -> None:
+        """
+        Counts one measure
+        :param seconds: measured duration
+        :type seconds: float
+        :param values: values of the labels, in order
+        :type values: str
+        """
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += seconds
+
+    def render(self) -> List[str]:
+        """
+        Lines of the histogram in the text format
+        :return: HELP and TYPE, then cumulative buckets, sum and count
+         of each series
+        :rtype: list
+        """
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((values, list(counts), total)
+                            for values, (counts, total)
+                            in self._series.items())
+        for values, counts, total in series:
+            labels = ",".join(f'{label}="{_escape(value)}"'
+                              for label, value in zip(self.labels, values))
+            sep = "," if labels else ""
+            cumulated = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulated += count
+                lines.append(f'{self.name}_bucket{{{labels}{sep}'
+                             f'le="{bound}"}} {cumulated}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulated}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    """Label value escaped for the text format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+REQUESTS = Histogram("http_request_duration_seconds",
+                     "Time to build the response of a request",
+                     ("method", "route", "status"))
+PHASES = Histogram("app_phase_duration_seconds",
+                   "Time spent in a hot path, per call",
+                   ("phase",))
+
+
+def timed(fn: Callable, phase: str) -> Callable:
+    """
+    Wraps fn to observe each call in PHASES
+    :param fn: function to time
+    :type fn: Callable
+    :param phase: label of the calls
+    :type phase: str
+    :return: timed function
+    :rtype: Callable
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            PHASES.observe(time.perf_counter() - start, phase)
+    return wrapper
+
+
+def instrument(cls: type, name: str) -> None:
+    """
+    Replaces the method name of cls by its timed version, observed under
+    the phase "<class>.<method>"
+    :param cls: class defining or inheriting the method
+    :type cls: type
+    :param name: method name
+    :type name: str
+    """
+    phase = f"{cls.__name__}.{name}"
+    method = inspect.getattr_static(cls, name)
+    if isinstance(method, classmethod):
+        setattr(cls, name, classmethod(timed(method.__func__, phase)))
+    elif isinstance(method, staticmethod):
+        setattr(cls, name, staticmethod(timed(method.__func__, phase)))
+    else:
+        setattr(cls, name, timed(method, phase))
+
+
+def render() -> str:
+    """
+    Every metric in the Prometheus text format
+    :return: text document
+    :rtype: str
+    """
+    return "\n".join(REQUESTS.render() + PHASES.render()) + "\n"
+
+
+def init_app(app: Flask) -> None:
+    """
+    Times the requests of app, bcrypt and the database queries, and
+    serves the metrics on GET /metrics
+    :param app: the Flask app, before its own before_request functions
+    :type app: Flask
+    """
+    from db import DB
+    from hashing import PasswordHasher
+
+    for name in DB_METHODS:
+        instrument(DB, name)
+    for name in HASHER_METHODS:
+        instrument(PasswordHasher, name)
+
+    @app.before_request
+    def start_timer() -> None:
+        """Remembers when the request started"""
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response: Response) -> Response:
+        """Observes the time to build the response"""
+        start = g.get("metrics_start")
+        if start is not None:
+            rule = request.url_rule
+            REQUESTS.observe(time.perf_counter() - start, request.method,
+                             rule.rule if rule is not None else "unmatched",
+                             str(response.status_code))
+        return response
+
+    def metrics() -> Response:
+        """
+        Latency histograms of the requests and of the hot paths
+        curl localhost:5000/metrics
+        :return: Prometheus text document
+        :rtype: Response
+        """
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", metrics, methods=["GET"])
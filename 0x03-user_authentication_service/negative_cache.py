@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Negative cache module: remembers the emails valid_login did not find,
+so that repeated logins to unknown accounts (credential stuffing)
+are answered without querying the database. Auth forgets an email as
+soon as it registers it, and every entry expires after a TTL, which
+bounds how long an email registered by another worker keeps being
+refused here.
+
+Backends, chosen with NEGATIVE_CACHE:
+- none (default): every login queries the database
+- memory: LRU + TTL set local to the process, for a single worker
+  process only
+- kv: shared by every worker through the key/value server of
+  session_store.py, at SESSION_STORE_ADDRESS
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any
+
+
+def _digest(email: str) -> bytes:
+    """Fixed size key of an email, however long"""
+    return hashlib.blake2b(email.encode('utf-8', 'replace'),
+                           digest_size=16).digest()
+
+
+class NegativeCache:
+    """
+    Interface of the negative caches: a set of unknown emails
+    """
+
+    def __contains__(self, email: str) -> bool:
+        """
+        Whether email was recently found unknown
+        :param email: User's email
+        :type email: string
+        :return: True if it is known not to be registered
+        :rtype: bool
+        """
+        return False
+
+    def add(self, email: str) -> None:
+        """
+        Records that email is not registered
+        :param email: User's email
+        :type email: string
+        """
+
+    def discard(self, email: str) -> None:
+        """
+        Forgets email, once it is registered
+        :param email: User's email
+        :type email: string
+        """
+
+
+class MemoryNegativeCache(NegativeCache):
+    """
+    Bounded LRU set local to the process, entries expiring after ttl
+    seconds
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 60) -> None:
+        """Initialize an empty cache"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._emails = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, email: str) -> bool:
+        """See NegativeCache.__contains__"""
+        key = _digest(email)
+        with self._lock:
+            expires = self._emails.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._emails[key]
+                return False
+            self._emails.move_to_end(key)
+            return True
+
+    def add(self, email: str) -> None:
+        """See NegativeCache.add"""
+        if self.max_size <= 0:
+            return
+        key = _digest(email)
+        with self._lock:
+            self._emails.pop(key, None)
+            self._emails[key] = time.monotonic() + self.ttl
+            while len(self._emails) > self.max_size:
+                self._emails.popitem(last=False)
+
+    def discard(self, email: str) -> None:
+        """See NegativeCache.discard"""
+        with self._lock:
+            self._emails.pop(_digest(email), None)
+
+    def __len__(self) -> int:
+        """Number of cached emails"""
+        return len(self._emails)
+
+
+class KeyValueNegativeCache(NegativeCache):
+    """
+    Negative cache kept in a KeyValueStore, local or served by another
+    process, so that a registration clears it for every worker
+    """
+
+    def __init__(self, store: Any, ttl: float = 60) -> None:
+        """Initialize a cache on top of a key/value store"""
+        self._store = store
+        self.ttl = ttl
+
+    def __contains__(self, email: str) -> bool:
+        """See NegativeCache.__contains__"""
+        return self._store.get(f"unknown:{_digest(email).hex()}") \
+            is not None
+
+    def add(self, email: str) -> None:
+        """See NegativeCache.add"""
+        self._store.set(f"unknown:{_digest(email).hex()}", True, self.ttl)
+
+    def discard(self, email: str) -> None:
+        """See NegativeCache.discard"""
+        self._store.delete(f"unknown:{_digest(email).hex()}")
+
+
+def negative_cache_from_env() -> NegativeCache:
+    """
+    Builds the negative cache configured by NEGATIVE_CACHE,
+    NEGATIVE_CACHE_SIZE and NEGATIVE_CACHE_TTL, and for the kv backend
+    SESSION_STORE_ADDRESS and SESSION_STORE_AUTHKEY
+    :return: negative cache
+    :rtype: NegativeCache
+    """
+    backend = getenv("NEGATIVE_CACHE", "none")
+    ttl = float(getenv("NEGATIVE_CACHE_TTL", "60"))
+    if backend == "none":
+        return NegativeCache()
+    if backend == "kv":
+        from session_store import connect
+        store = connect(getenv("SESSION_STORE_ADDRESS", "127.0.0.1:6380"),
+                        getenv("SESSION_STORE_AUTHKEY", "").encode())
+        return KeyValueNegativeCache(store, ttl)
+    if backend == "memory":
+        return MemoryNegativeCache(
+            int(getenv("NEGATIVE_CACHE_SIZE", "100000")), ttl)
+    raise ValueError(f"Unknown NEGATIVE_CACHE {backend}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Rate limiting module: login attempts take a token of the client IP and
+one of the email before any bcrypt check, so that a flood of logins
+can't keep the hashing pool busy. A token bucket holds `burst` tokens
+refilled one every `period / burst` seconds; it is kept as one float,
+the time at which it is full again, and a full bucket is the same as no
+bucket so it gets evicted. Without a token, RateLimited is raised and
+app.py answers 429 with a Retry-After header.
+
+Configuration:
+RATE_LIMIT: memory (default, buckets of the process), kv (shared by
+every worker through the key/value server of session_store.py, at
+SESSION_STORE_ADDRESS) or none
+RATE_LIMIT_IP: "<burst>/<seconds>" per client IP (default 30/60)
+RATE_LIMIT_EMAIL: "<burst>/<seconds>" per email (default 5/60)
+RATE_LIMIT_SIZE: buckets per limit of the memory backend (default
+100000), least recently used first out
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Tuple
+
+
+class RateLimited(Exception):
+    """
+    Raised when a client IP or an email has no token left
+    """
+
+    def __init__(self, retry_after: int) -> None:
+        """retry_after: seconds until a token is available"""
+        super().__init__("too many login attempts")
+        self.retry_after = retry_after
+
+
+def take(full_at: float, now: float, interval: float,
+         burst: int) -> Tuple[float, float]:
+    """
+    Takes one token from a bucket
+    :param full_at: time at which the bucket is full again
+    :type full_at: float
+    :param now: current time, on the same clock
+    :type now: float
+    :param interval: seconds to refill one token
+    :type interval: float
+    :param burst: tokens of a full bucket
+    :type burst: integer
+    :return: (new full_at, 0) when a token was taken, else (full_at,
+     seconds until one is available)
+    :rtype: tuple
+    """
+    after = max(full_at, now) + interval
+    wait = after - now - burst * interval
+    if wait > 0:
+        return full_at, wait
+    return after, 0.0
+
+
+def _digest(key: str) -> str:
+    """Fixed size key of a bucket, however long the email"""
+    return hashlib.blake2b(key.encode('utf-8', 'replace'),
+                           digest_size=8).hexdigest()
+
+
+class RateLimiter:
+    """
+    Interface of the limits, never reached: burst tokens per key,
+    refilled over period seconds
+    """
+
+    def __init__(self, burst: int = 1, period: float = 1) -> None:
+        """Initialize a limit"""
+        self.burst = burst
+        self.interval = period / burst
+
+    def take(self, key: str) -> float:
+        """
+        Takes a token of key
+        :param key: client IP or email
+        :type key: string
+        :return: 0 when taken, else seconds until one is available
+        :rtype: float
+        """
+        return 0.0
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Buckets of the process, in the order of their last take
+    """
+
+    def __init__(self, burst: int = 1, period: float = 1,
+                 max_size: int = 100000) -> None:
+        """Initialize without any bucket"""
+        super().__init__(burst, period)
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """See RateLimiter.take"""
+        key = _digest(key)
+        now = time.monotonic()
+        with self._lock:
+            full_at, wait = take(self._buckets.pop(key, now), now,
+                                 self.interval, self.burst)
+            self._buckets[key] = full_at
+            buckets = self._buckets
+            while buckets and (len(buckets) > self.max_size
+                               or buckets[next(iter(buckets))] <= now):
+                buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        """Number of buckets not full"""
+        return len(self._buckets)
+
+
+class KeyValueRateLimiter(RateLimiter):
+    """
+    Buckets kept in a KeyValueStore, local or served by another
+    process, each take being one atomic round trip
+    """
+
+    def __init__(self, store: Any, name: str, burst: int = 1,
+                 period: float = 1) -> None:
+        """Initialize a limit whose keys are prefixed with name"""
+        super().__init__(burst, period)
+        self._store = store
+        self.name = name
+
+    def take(self, key: str) -> float:
+        """See RateLimiter.take"""
+        return self._store.take_token(f"rate:{self.name}:{_digest(key)}",
+                                      self.interval, self.burst)
+
+
+class LoginLimiter:
+    """
+    Limits of the login attempts per client IP and per email
+    """
+
+    def __init__(self, by_ip: RateLimiter, by_email: RateLimiter) -> None:
+        """Initialize with one limit per IP and one per email"""
+        self.by_ip = by_ip
+        self.by_email = by_email
+
+    def check(self, email: str, ip: str = None) -> None:
+        """
+        Takes a token of ip, then one of email
+        :param email: email of the attempt
+        :type email: string
+        :param ip: client IP, if known
+        :type ip: string
+        :raises RateLimited: one of them has no token left
+        """
+        wait = self.by_ip.take(ip or "")
+        if wait == 0:
+            wait = self.by_email.take(email.lower())
+        if wait > 0:
+            raise RateLimited(math.ceil(wait))
+
+
+def _limit(name: str, default: str) -> Tuple[int, float]:
+    """(burst, period) of the "<burst>/<seconds>" variable name"""
+    burst, _, period = getenv(name, default).partition("/")
+    return int(burst), float(period)
+
+
+def login_limiter_from_env() -> LoginLimiter:
+    """
+    Builds the login limits configured by RATE_LIMIT, RATE_LIMIT_IP,
+    RATE_LIMIT_EMAIL and RATE_LIMIT_SIZE, and for the kv backend
+    SESSION_STORE_ADDRESS and SESSION_STORE_AUTHKEY
+    :return: login limiter
+    :rtype: LoginLimiter
+    """
+    backend = getenv("RATE_LIMIT", "memory")
+    by_ip = _limit("RATE_LIMIT_IP", "30/60")
+    by_email = _limit("RATE_LIMIT_EMAIL", "5/60")
+    if backend == "none":
+        return LoginLimiter(RateLimiter(), RateLimiter())
+    if backend == "kv":
+        from session_store import connect
+        store = connect(getenv("SESSION_STORE_ADDRESS", "127.0.0.1:6380"),
+                        getenv("SESSION_STORE_AUTHKEY", "").encode())
+        return LoginLimiter(KeyValueRateLimiter(store, "ip", *by_ip),
+                            KeyValueRateLimiter(store, "email", *by_email))
+    if backend == "memory":
+        size = int(getenv("RATE_LIMIT_SIZE", "100000"))
+        return LoginLimiter(MemoryRateLimiter(*by_ip, size),
+                            MemoryRateLimiter(*by_email, size))
+    raise ValueError(f"Unknown RATE_LIMIT {backend}")
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Session store module: caches which user a session_id belongs to so
+that validating a session doesn't need a SQL query.
+The users.session_id column stays the source of truth, stores are
+written through by Auth and only answer for sessions they were told
+about.
+
+Backends, chosen with SESSION_STORE:
+- none (default): no caching, every lookup goes to the database
+- memory: LRU + TTL cache local to the process, for a single worker
+  process only: a logout in another worker is not seen here until the
+  entry expires
+- kv: shared by every worker through a key/value server, see
+  KeyValueStore and `python3 session_store.py` to run it; the login
+  rate limits can live there too, see rate_limit.py
+"""
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+from os import getenv
+from typing import Any, Optional, Tuple
+
+from rate_limit import take
+
+
+class SessionStore:
+    """
+    Interface of the session stores: maps a session_id to the
+    (user id, email) of its user, with at most one session per user
+    """
+
+    def get(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """
+        Looks a session up
+        :param session_id: session cookie
+        :type session_id: string
+        :return: (user id, email) or None when unknown
+        :rtype: tuple
+        """
+        return None
+
+    def set(self, session_id: str, user_id: int, email: str) -> None:
+        """
+        Records the session of a user, replacing its previous one
+        :param session_id: new session cookie
+        :type session_id: string
+        :param user_id: User id
+        :type user_id: integer
+        :param email: User's email
+        :type email: string
+        """
+
+    def delete_user(self, user_id: int) -> None:
+        """
+        Forgets the session of a user
+        :param user_id: User id
+        :type user_id: integer
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Bounded LRU store local to the process. Entries expire after ttl
+    seconds, which bounds how long a session ended by another worker
+    keeps being accepted here: only use it with a single worker
+    process.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300) -> None:
+        """Initialize an empty store"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """See SessionStore.get"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                self._discard(session_id)
+                return None
+            self._sessions.move_to_end(session_id)
+            return entry[0], entry[1]
+
+    def set(self, session_id: str, user_id: int, email: str) -> None:
+        """See SessionStore.set"""
+        with self._lock:
+            previous = self._by_user.get(user_id)
+            if previous is not None:
+                self._discard(previous)
+            self._sessions[session_id] = (user_id, email,
+                                          time.monotonic() + self.ttl)
+            self._by_user[user_id] = session_id
+            while len(self._sessions) > self.max_size:
+                self._discard(next(iter(self._sessions)))
+
+    def delete_user(self, user_id: int) -> None:
+        """See SessionStore.delete_user"""
+        with self._lock:
+            session_id = self._by_user.get(user_id)
+            if session_id is not None:
+                self._discard(session_id)
+
+    def _discard(self, session_id: str) -> None:
+        """Drops one session, the lock must be held"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None and self._by_user.get(entry[0]) == session_id:
+            del self._by_user[entry[0]]
+
+
+class KeyValueStore:
+    """
+    In-memory key/value store with per-key expiry: a pure-Python
+    stand-in for a networked cache such as Redis or memcached.
+    Served to other processes by `serve`.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty store"""
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Value of key, None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """Sets key, expiring after ttl seconds if given"""
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def getset(self, key: str, value: Any, ttl: float = None) -> Any:
+        """Sets key and returns its previous value, in one round trip"""
+        with self._lock:
+            entry = self._data.get(key)
+            expires = None if ttl is None else time.monotonic() + ttl
+            self._data[key] = (value, expires)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def take_token(self, key: str, interval: float, burst: int) -> float:
+        """
+        Takes a token from the bucket at key in one atomic round trip,
+        as a server-side script would: see rate_limit.take. The bucket
+        expires once full again.
+        :return: 0 when taken, else seconds until one is available
+        :rtype: float
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            full_at = now if entry is None else entry[0]
+            full_at, wait = take(full_at, now, interval, burst)
+            self._data[key] = (full_at, full_at)
+        return wait
+
+    def delete(self, *keys: str) -> None:
+        """Deletes keys"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def purge(self) -> int:
+        """Drops the expired keys, returns how many were dropped"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires) in self._data.items()
+                       if expires is not None and expires < now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+class KeyValueSessionStore(SessionStore):
+    """
+    Session store kept in a KeyValueStore, local or served by another
+    process, so that every worker sees the same sessions
+    """
+
+    def __init__(self, store: KeyValueStore, ttl: float = 86400) -> None:
+        """Initialize a store on top of a key/value store"""
+        self._store = store
+        self.ttl = ttl
+
+    def get(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """See SessionStore.get"""
+        entry = self._store.get(f"session:{session_id}")
+        return None if entry is None else tuple(entry)
+
+    def set(self, session_id: str, user_id: int, email: str) -> None:
+        """See SessionStore.set"""
+        previous = self._store.getset(f"user:{user_id}", session_id,
+                                      self.ttl)
+        if previous is not None and previous != session_id:
+            self._store.delete(f"session:{previous}")
+        self._store.set(f"session:{session_id}", (user_id, email),
+                        self.ttl)
+
+    def delete_user(self, user_id: int) -> None:
+        """See SessionStore.delete_user"""
+        previous = self._store.getset(f"user:{user_id}", None, self.ttl)
+        if previous is not None:
+            self._store.delete(f"session:{previous}", f"user:{user_id}")
+
+
+class _KeyValueClient(BaseManager):
+    """Client side of the key/value server"""
+
+
+_KeyValueClient.register("store")
+
+
+def _parse_address(address: str) -> Tuple[str, int]:
+    """host:port to (host, port)"""
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def _check_authkey(authkey: bytes) -> None:
+    """
+    Refuses an empty authkey: the server unpickles what its clients
+    send, so whoever can reach it can run code in it
+    :raises ValueError: authkey is empty
+    """
+    if not authkey:
+        raise ValueError("SESSION_STORE_AUTHKEY must be set to a secret "
+                         "shared by the key/value server and its clients")
+
+
+def connect(address: str, authkey: bytes) -> KeyValueStore:
+    """
+    Connects to a key/value server started by `serve`
+    :param address: host:port
+    :type address: string
+    :param authkey: shared secret of the server
+    :type authkey: bytes
+    :return: proxy of the served KeyValueStore
+    :rtype: KeyValueStore
+    :raises ValueError: authkey is empty
+    """
+    _check_authkey(authkey)
+    client = _KeyValueClient(address=_parse_address(address),
+                             authkey=authkey)
+    client.connect()
+    return client.store()
+
+
+def serve(address: str, authkey: bytes) -> None:
+    """
+    Serves one KeyValueStore to the worker processes, forever
+    :param address: host:port to listen on, keep it on a private
+     interface such as the default 127.0.0.1
+    :type address: string
+    :param authkey: shared secret the workers must present
+    :type authkey: bytes
+    :raises ValueError: authkey is empty
+    """
+    _check_authkey(authkey)
+    store = KeyValueStore()
+
+    def purge_forever() -> None:
+        while True:
+            time.sleep(60)
+            store.purge()
+
+    threading.Thread(target=purge_forever, daemon=True).start()
+
+    class _KeyValueServer(BaseManager):
+        """Server side of the key/value server"""
+
+    _KeyValueServer.register("store", callable=lambda: store)
+    server = _KeyValueServer(address=_parse_address(address),
+                             authkey=authkey)
+    server.get_server().serve_forever()
+
+
+def session_store_from_env() -> SessionStore:
+    """
+    Builds the session store configured by SESSION_STORE,
+    SESSION_STORE_SIZE and SESSION_STORE_TTL, and for the kv backend
+    SESSION_STORE_ADDRESS and SESSION_STORE_AUTHKEY
+    :return: session store
+    :rtype: SessionStore
+    """
+    backend = getenv("SESSION_STORE", "none")
+    ttl = float(getenv("SESSION_STORE_TTL", "300"))
+    if backend == "none":
+        return SessionStore()
+    if backend == "kv":
+        store = connect(getenv("SESSION_STORE_ADDRESS", "127.0.0.1:6380"),
+                        getenv("SESSION_STORE_AUTHKEY", "").encode())
+        return KeyValueSessionStore(store, ttl)
+    if backend == "memory":
+        return MemorySessionStore(
+            int(getenv("SESSION_STORE_SIZE", "10000")), ttl)
+    raise ValueError(f"Unknown SESSION_STORE {backend}")
+
+
+if __name__ == "__main__":
+    serve(getenv("SESSION_STORE_ADDRESS", "127.0.0.1:6380"),
+          getenv("SESSION_STORE_AUTHKEY", "").encode())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Session token module: with SESSION_MODE=token the session_id cookie is
+a signed token carrying the user id, email, issue time and expiry, so
+that resolving it is an HMAC check with no database read and any
+instance knowing SESSION_TOKEN_SECRET can serve it.
+
+token = b64(user_id:issued_ms:expires_ms:email) "." b64(HMAC-SHA256)
+
+A token is revoked by a per-user "not before" time in a denylist: a
+logout revokes every token issued so far and, as with the session_id
+column, a new login revokes the previous ones. Entries expire with the
+tokens they revoke.
+
+Configuration:
+SESSION_MODE: db (default, session_id column) or token
+SESSION_TOKEN_SECRET: signing key shared by every instance, required
+SESSION_TOKEN_TTL: seconds a token is valid (default 86400)
+SESSION_REVOCATIONS: kv (default, shared by every instance through the
+  key/value server of session_store.py, at SESSION_STORE_ADDRESS) or
+  memory (local to the process: only for a single process, a logout is
+  not seen by the others until the token expires)
+"""
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Optional, Tuple
+
+
+def _now_ms() -> int:
+    """Wall clock in milliseconds, shared by instances"""
+    return time.time_ns() // 1000000
+
+
+def _b64(raw: bytes) -> str:
+    """Unpadded urlsafe base64 of raw"""
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _unb64(text: str) -> bytes:
+    """Bytes of unpadded urlsafe base64 text"""
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class Revocations:
+    """
+    Interface of the denylists: the time before which the tokens of a
+    user are revoked
+    """
+
+    def not_before(self, user_id: int) -> int:
+        """
+        Revocation time of the tokens of a user
+        :param user_id: User id
+        :type user_id: integer
+        :return: milliseconds, 0 when none is revoked
+        :rtype: integer
+        """
+        return 0
+
+    def revoke(self, user_id: int, not_before: int) -> None:
+        """
+        Revokes the tokens of a user issued before not_before
+        :param user_id: User id
+        :type user_id: integer
+        :param not_before: milliseconds
+        :type not_before: integer
+        """
+
+
+class MemoryRevocations(Revocations):
+    """
+    Denylist of the process: one time per user, in the order they
+    expire, dropped ttl seconds after the revocation
+    """
+
+    def __init__(self, ttl: float) -> None:
+        """Initialize an empty denylist"""
+        self.ttl_ms = int(ttl * 1000)
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def not_before(self, user_id: int) -> int:
+        """See Revocations.not_before"""
+        return self._users.get(user_id, 0)
+
+    def revoke(self, user_id: int, not_before: int) -> None:
+        """See Revocations.revoke"""
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._users[user_id] = not_before
+            expired = _now_ms() - self.ttl_ms
+            while self._users and \
+                    self._users[next(iter(self._users))] < expired:
+                self._users.popitem(last=False)
+
+    def __len__(self) -> int:
+        """Number of users with revoked tokens"""
+        return len(self._users)
+
+
+class KeyValueRevocations(Revocations):
+    """
+    Denylist kept in a KeyValueStore, local or served by another
+    process, so that a logout is seen by every instance
+    """
+
+    def __init__(self, store: Any, ttl: float) -> None:
+        """Initialize a denylist on top of a key/value store"""
+        self._store = store
+        self.ttl = ttl
+
+    def not_before(self, user_id: int) -> int:
+        """See Revocations.not_before"""
+        return self._store.get(f"revoked:{user_id}") or 0
+
+    def revoke(self, user_id: int, not_before: int) -> None:
+        """See Revocations.revoke"""
+        self._store.set(f"revoked:{user_id}", not_before, self.ttl)
+
+
+class SessionTokens:
+    """
+    Issues and verifies signed session tokens
+    """
+
+    def __init__(self, secret: bytes, ttl: float = 86400,
+                 revocations: Revocations = None) -> None:
+        """Initialize with the signing key and the denylist"""
+        self._secret = secret
+        self.ttl_ms = int(ttl * 1000)
+        self.revocations = revocations if revocations is not None \
+            else MemoryRevocations(ttl)
+
+    def _sign(self, payload: str) -> str:
+        """Signature of the encoded payload"""
+        return _b64(hmac.new(self._secret,
+                             payload.encode('utf-8', 'replace'),
+                             hashlib.sha256).digest())
+
+    def issue(self, user_id: int, email: str) -> str:
+        """
+        Issues a token and revokes the previous ones of the user
+        :param user_id: User id
+        :type user_id: integer
+        :param email: User's email
+        :type email: string
+        :return: token
+        :rtype: string
+        """
+        # Never before a revocation of the same millisecond
+        issued = max(_now_ms(), self.revocations.not_before(user_id))
+        payload = _b64(f"{user_id}:{issued}:{issued + self.ttl_ms}:"
+                       f"{email}".encode('utf-8'))
+        self.revocations.revoke(user_id, issued)
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[Tuple[int, str]]:
+        """
+        Checks the signature, expiry and revocation of a token
+        :param token: session_id cookie
+        :type token: string
+        :return: (user id, email), None if invalid
+        :rtype: tuple
+        """
+        payload, _, signature = token.partition(".")
+        if not hmac.compare_digest(self._sign(payload).encode(),
+                                   signature.encode('utf-8', 'replace')):
+            return None
+        try:
+            user_id, issued, expires, email = \
+                _unb64(payload).decode('utf-8').split(":", 3)
+            user_id, issued, expires = int(user_id), int(issued), \
+                int(expires)
+        except ValueError:
+            return None
+        if expires <= _now_ms():
+            return None
+        if issued < self.revocations.not_before(user_id):
+            return None
+        return user_id, email
+
+    def revoke(self, user_id: int) -> None:
+        """
+        Revokes every token issued to a user so far
+        :param user_id: User id
+        :type user_id: integer
+        """
+        self.revocations.revoke(user_id, _now_ms() + 1)
+
+
+def session_tokens_from_env() -> Optional[SessionTokens]:
+    """
+    Builds the session tokens configured by SESSION_MODE,
+    SESSION_TOKEN_SECRET, SESSION_TOKEN_TTL and SESSION_REVOCATIONS,
+    and for the kv denylist SESSION_STORE_ADDRESS and
+    SESSION_STORE_AUTHKEY
+    :return: session tokens, None in db mode
+    :rtype: SessionTokens
+    :raises ValueError: unknown mode or denylist, or no secret
+    """
+    mode = getenv("SESSION_MODE", "db")
+    if mode == "db":
+        return None
+    if mode != "token":
+        raise ValueError(f"Unknown SESSION_MODE {mode}")
+    secret = getenv("SESSION_TOKEN_SECRET")
+    if not secret:
+        # A key of its own per process would reject the tokens issued
+        # by every other worker
+        raise ValueError("SESSION_MODE=token needs SESSION_TOKEN_SECRET, "
+                         "shared by every instance")
+    secret = secret.encode()
+    ttl = float(getenv("SESSION_TOKEN_TTL", "86400"))
+    backend = getenv("SESSION_REVOCATIONS", "kv")
+    if backend == "kv":
+        from session_store import connect
+        store = connect(getenv("SESSION_STORE_ADDRESS", "127.0.0.1:6380"),
+                        getenv("SESSION_STORE_AUTHKEY", "").encode())
+        return SessionTokens(secret, ttl, KeyValueRevocations(store, ttl))
+    if backend == "memory":
+        return SessionTokens(secret, ttl, MemoryRevocations(ttl))
+    raise ValueError(f"Unknown SESSION_REVOCATIONS {backend}")